@@ -0,0 +1,90 @@
+"""
+Throughput of the in-process audio normalizer against the old ffmpeg subprocess path.
+
+    python -m benchmarks.audio_normalize --seconds 5 30 120 --runs 5
+
+Inputs are synthetic 44.1 kHz stereo recordings encoded as WAV and FLAC.
+"subprocess" reproduces the previous convert_any_audio_to_wav: temp file in,
+blocking `ffmpeg` call, temp WAV out. Results are reported as audio seconds
+processed per wall-clock second.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from src.features.chats.audio import normalize_audio, normalize_with_ffmpeg
+
+
+def synthetic_recording(seconds: float, fmt: str, sample_rate: int = 44100) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    left = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.random.default_rng(0).standard_normal(t.size)
+    right = 0.3 * np.sin(2 * np.pi * 330 * t)
+    buffer = io.BytesIO()
+    sf.write(buffer, np.stack([left, right], axis=1).astype(np.float32), sample_rate, format=fmt)
+    return buffer.getvalue()
+
+
+def subprocess_path(audio_bytes: bytes, ext: str) -> bytes:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tmp_input:
+        tmp_input.write(audio_bytes)
+        tmp_input_path = tmp_input.name
+    tmp_wav_path = tmp_input_path.rsplit(".", 1)[0] + ".wav"
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", tmp_input_path, "-ar", "16000", "-ac", "1", tmp_wav_path],
+        check=True
+    )
+    os.remove(tmp_input_path)
+    with open(tmp_wav_path, "rb") as f:
+        data = f.read()
+    os.remove(tmp_wav_path)
+    return data
+
+
+async def time_runs(fn, runs: int) -> float:
+    started = time.perf_counter()
+    for _ in range(runs):
+        await fn()
+    return (time.perf_counter() - started) / runs
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, nargs="+", default=[5, 30, 120])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    has_ffmpeg = shutil.which("ffmpeg") is not None
+    results = []
+    for fmt, ext in (("WAV", "wav"), ("FLAC", "flac")):
+        for seconds in args.seconds:
+            audio = synthetic_recording(seconds, fmt)
+            row = {"format": ext, "audio_seconds": seconds, "input_bytes": len(audio)}
+
+            per_call = await time_runs(lambda: normalize_audio(audio), args.runs)
+            row["in_process_ms"] = round(per_call * 1000, 2)
+            row["in_process_realtime_x"] = round(seconds / per_call, 1)
+
+            if has_ffmpeg:
+                per_call = await time_runs(lambda: asyncio.to_thread(subprocess_path, audio, ext), args.runs)
+                row["subprocess_ms"] = round(per_call * 1000, 2)
+                row["subprocess_realtime_x"] = round(seconds / per_call, 1)
+
+                per_call = await time_runs(lambda: normalize_with_ffmpeg(audio), args.runs)
+                row["ffmpeg_pipe_ms"] = round(per_call * 1000, 2)
+
+            results.append(row)
+
+    print(json.dumps({"ffmpeg_available": has_ffmpeg, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
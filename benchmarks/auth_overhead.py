@@ -0,0 +1,84 @@
+"""
+Per-request cost of authentication.
+
+    python -m benchmarks.auth_overhead --requests 2000
+
+Reports the bare verification cost (full HS256 decode vs. the verified-token
+cache) and the end-to-end overhead the get_current_user_id dependency adds
+to a request served over an in-process ASGI transport.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import jwt
+from fastapi import Depends, FastAPI
+
+from src.utils import auth_utils
+from src.utils.auth_utils import ALGORITHM, SECRET_KEY, create_access_token, get_current_user_id, get_user_id_from_token
+
+
+def per_call_us(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def per_request_us(client: httpx.AsyncClient, path: str, headers: dict, requests: int) -> float:
+    for _ in range(50):
+        await client.get(path, headers=headers)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await client.get(path, headers=headers)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    token = create_access_token({"user_id": "bench@example.com"})
+    header = f"Bearer {token}"
+
+    def uncached():
+        auth_utils._verified_tokens.clear()
+        get_user_id_from_token(header)
+
+    verification = {
+        "jwt_decode_us": round(per_call_us(lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]), 20000), 2),
+        "uncached_dependency_us": round(per_call_us(uncached, 20000), 2),
+        "cached_dependency_us": round(per_call_us(lambda: get_user_id_from_token(header), 20000), 2)
+    }
+
+    app = FastAPI()
+
+    @app.get("/open")
+    async def open_route():
+        return {"ok": True}
+
+    @app.get("/protected")
+    async def protected_route(user_id: str = Depends(get_current_user_id)):
+        return {"ok": True}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = {"Authorization": header}
+        baseline = await per_request_us(client, "/open", headers, args.requests)
+        protected = await per_request_us(client, "/protected", headers, args.requests)
+
+    print(json.dumps({
+        "verification": verification,
+        "request_us": {
+            "no_auth": round(baseline, 1),
+            "with_auth_dependency": round(protected, 1),
+            "auth_overhead": round(protected - baseline, 1)
+        }
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
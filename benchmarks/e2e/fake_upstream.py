@@ -0,0 +1,205 @@
+"""
+Deterministic stand-ins for OpenAI, Deepgram and the /speak TTS server.
+
+    python -m benchmarks.e2e.fake_upstream --port 8901 --llm-latency-ms 300 --token-interval-ms 15
+
+One process serves all three so the app under test only needs its base URLs
+pointed here (OPENAI_BASE_URL, DEEPGRAM_API_URL, SPEAK_API_URL). Responses
+depend only on the request body, and latencies are fixed, so two runs of the
+benchmark see exactly the same upstream behaviour.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import time
+
+import numpy as np
+import soundfile as sf
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+EMBEDDING_DIMENSIONS = 1536
+
+ANSWER_TEXT = (
+    "Based on the uploaded report your fasting glucose of 108 mg/dL is slightly above the normal range "
+    "and the HbA1c of 6.1 percent points to prediabetes. Ferritin at 12 ng/mL suggests low iron stores, "
+    "which can explain the fatigue you described. Discuss a repeat test in three months, a diet lower in "
+    "refined carbohydrates and an iron supplement with your doctor before starting anything new."
+)
+
+SUMMARY_JSON = {
+    "session_overview": "Review of recent blood work with focus on glucose control and iron levels.",
+    "conversation_highlights": {
+        "patient_concerns": "Fatigue and poor sleep.",
+        "doctor_inquiry": "Diet, sleep and medication history.",
+        "key_observations": "HbA1c 6.1%, fasting glucose 108 mg/dL, ferritin 12 ng/mL.",
+        "doctor_explanation": "Borderline glycaemic control and low iron stores.",
+        "recommendations_given": "Diet changes, iron supplement, repeat labs in three months."
+    },
+    "doctor_assessment": "Prediabetes with iron deficiency without anaemia.",
+    "investigations_suggested": ["Repeat HbA1c in 3 months", "Full iron panel"],
+    "medications_treatment": ["Ferrous sulfate 325 mg daily with vitamin C"],
+    "action_items": ["Reduce refined carbohydrates", "Book follow-up labs"],
+    "ai_summary_note": "Generated by the offline benchmark stand-in."
+}
+
+
+def words(text: str, count: int):
+    base = text.split()
+    return [base[i % len(base)] for i in range(count)]
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def embedding_for(text: str) -> list:
+    # Seeded from the text, so the same chunk always maps to the same vector
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+def tone_wav(seconds: float = 0.5, sample_rate: int = 16000) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buffer = io.BytesIO()
+    sf.write(buffer, (0.2 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI()
+    speech_audio = tone_wav()
+    # Streamed completions by outcome: "aborted" ones lost their client (the app) before the end
+    streams = {"completed": 0, "aborted": 0}
+
+    def completion_text(body: dict) -> str:
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            return json.dumps(SUMMARY_JSON)
+        if "Rank the most relevant chunks" in prompt:
+            return "1, 2, 3"
+        if prompt.startswith("Refine the question"):
+            return prompt.rsplit("User:", 1)[-1].strip()
+        return "The patient discussed recent lab results and next steps."
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-4o")
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        created = int(time.time())
+        await asyncio.sleep(args.llm_latency_ms / 1000)
+
+        if not body.get("stream"):
+            text = completion_text(body)
+            return JSONResponse({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(text), "total_tokens": prompt_tokens + count_tokens(text)}
+            })
+
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def event(delta: dict, finish_reason=None, usage=None, choices=True) -> bytes:
+            payload = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else [],
+            }
+            if usage is not None:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n".encode()
+
+        async def stream():
+            outcome = "aborted"
+            try:
+                yield event({"role": "assistant", "content": ""})
+                for i, word in enumerate(words(ANSWER_TEXT, args.answer_tokens)):
+                    if i:
+                        await asyncio.sleep(args.token_interval_ms / 1000)
+                    yield event({"content": word + " "})
+                yield event({}, finish_reason="stop")
+                if include_usage:
+                    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": args.answer_tokens, "total_tokens": prompt_tokens + args.answer_tokens}
+                    yield event({}, usage=usage, choices=False)
+                yield b"data: [DONE]\n\n"
+                outcome = "completed"
+            finally:
+                streams[outcome] += 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(args.embedding_latency_ms / 1000)
+        tokens = sum(count_tokens(str(text)) for text in inputs)
+        return JSONResponse({
+            "object": "list",
+            "model": body.get("model", "text-embedding-ada-002"),
+            "data": [{"object": "embedding", "index": i, "embedding": embedding_for(str(text))} for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    @app.post("/v1/listen")
+    async def listen(request: Request):
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+        await asyncio.sleep(args.stt_latency_ms / 1000)
+        return JSONResponse({
+            "metadata": {"bytes_received": received},
+            "results": {"channels": [{"alternatives": [{"transcript": "What do my blood test results mean?", "confidence": 0.99}]}]}
+        })
+
+    @app.post("/speak")
+    async def speak(request: Request):
+        body = await request.json()
+        await asyncio.sleep(args.tts_latency_ms / 1000)
+        name = hashlib.sha256(body.get("text", "").encode("utf-8")).hexdigest()[:16]
+        return JSONResponse({"file": f"{name}.wav"})
+
+    @app.get("/static/{filename}")
+    async def static_audio(filename: str):
+        return Response(speech_audio, media_type="audio/wav")
+
+    @app.get("/health")
+    async def health():
+        return {"ok": True}
+
+    @app.get("/stats")
+    async def stats():
+        return {"streams": dict(streams)}
+
+    return app
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Delay before a completion (or its first token)")
+    parser.add_argument("--token-interval-ms", type=float, default=15)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency-ms", type=float, default=80)
+    parser.add_argument("--stt-latency-ms", type=float, default=250)
+    parser.add_argument("--tts-latency-ms", type=float, default=150)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8901)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
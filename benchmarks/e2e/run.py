@@ -0,0 +1,356 @@
+"""
+Offline end-to-end benchmark of the HTTP API.
+
+    python -m benchmarks.e2e.run --concurrency 8 --requests 40 --output bench_e2e.json
+
+Starts the fake upstream (OpenAI, Deepgram, /speak) and the app, both as
+subprocesses on localhost, then drives the scenarios in order:
+
+    upload     POST /doc/upload-document/{session_id} with a generated PDF
+    ask        POST /chat/ask/{session_id}, streamed text answer
+    ask_batch  POST /chat/ask-batch/{session_id}, all QUESTIONS in one NDJSON stream
+    ask_disconnect
+               POST /chat/ask/{session_id}, hanging up after the first words; waits
+               until the answer shows up in /chat/history marked truncated
+    ask_voice  POST /chat/ask/{session_id} with a WAV recording
+    search     GET /doc/search, across every session of the user
+    summarize  POST /chat/summarize/{session_id}, PDF download
+
+Each scenario reports latency percentiles, time to first byte (the first
+streamed answer word for `ask`) and throughput. Pass --app-url to benchmark
+an already running server instead; it must use the same SECRET_KEY.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import jwt
+import numpy as np
+import soundfile as sf
+from fpdf import FPDF
+
+from benchmarks.e2e.fake_upstream import add_latency_arguments
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+SECRET_KEY = "benchmark-secret"
+SCENARIOS = ("upload", "ask", "ask_batch", "ask_disconnect", "ask_voice", "search", "summarize")
+
+QUESTIONS = [
+    "What does my HbA1c result mean?",
+    "Is my ferritin level something to worry about?",
+    "Which of these values are outside the normal range?",
+    "What should I ask my doctor at the follow-up?"
+]
+
+SEARCH_QUERIES = ["ferritin", "HbA1c 6.1", "LDL cholesterol", "TSH mIU/L"]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def summarize_timings(name: str, latencies, first_bytes, errors: int, wall: float) -> dict:
+    ms = lambda values, q: round(percentile(values, q) * 1000, 1) if values else None
+    return {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {"p50": ms(latencies, 50), "p95": ms(latencies, 95), "p99": ms(latencies, 99)},
+        "first_byte_ms": {"p50": ms(first_bytes, 50), "p95": ms(first_bytes, 95), "p99": ms(first_bytes, 99)}
+    }
+
+
+def sample_pdf(index: int, pages: int) -> bytes:
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=11)
+    for page in range(pages):
+        pdf.add_page()
+        # The index keeps every document unique, so uploads are never skipped as duplicates
+        pdf.multi_cell(0, 5, "\n".join(
+            f"Report {index} page {page + 1} line {line + 1}: fasting glucose 108 mg/dL, "
+            f"HbA1c 6.1 %, ferritin 12 ng/mL, TSH 2.3 mIU/L, LDL 131 mg/dL."
+            for line in range(30)
+        ))
+    return bytes(pdf.output())
+
+
+def sample_wav(seconds: float = 2.0, sample_rate: int = 16000) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    buffer = io.BytesIO()
+    sf.write(buffer, (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32), sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def auth_headers(user_id: str) -> dict:
+    token = jwt.encode(
+        {"user_id": user_id, "exp": datetime.now(timezone.utc) + timedelta(hours=2)},
+        SECRET_KEY,
+        algorithm="HS256"
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+class Scenario:
+    def __init__(self, client: httpx.AsyncClient, headers: dict, session_ids, args):
+        self.client = client
+        self.headers = headers
+        self.session_ids = session_ids
+        self.args = args
+        self.wav = sample_wav()
+
+    async def upload(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        files = {"file": (f"report_{i}.pdf", sample_pdf(i, self.args.pdf_pages), "application/pdf")}
+        started = time.perf_counter()
+        response = await self.client.post(f"/doc/upload-document/{session_id}", files=files, headers=self.headers)
+        response.raise_for_status()
+        if "error" in response.json():
+            raise RuntimeError(response.json()["error"])
+        return time.perf_counter() - started, None
+
+    async def ask(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        started, first_byte = time.perf_counter(), None
+        async with self.client.stream(
+            "POST", f"/chat/ask/{session_id}",
+            data={"question": QUESTIONS[i % len(QUESTIONS)]},
+            headers=self.headers
+        ) as response:
+            response.raise_for_status()
+            body = ""
+            async for text in response.aiter_text():
+                if first_byte is None and text.strip():
+                    first_byte = time.perf_counter() - started
+                body += text
+        if "[Internal error" in body:
+            raise RuntimeError(body.strip()[-200:])
+        return time.perf_counter() - started, first_byte
+
+    async def ask_batch(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        started, first_byte = time.perf_counter(), None
+        done, errors = set(), []
+        async with self.client.stream(
+            "POST", f"/chat/ask-batch/{session_id}",
+            json={"questions": list(QUESTIONS)},
+            headers=self.headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+                event = json.loads(line)
+                if "error" in event:
+                    errors.append(event["error"])
+                elif event.get("done"):
+                    done.add(event["index"])
+        if errors or len(done) != len(QUESTIONS):
+            raise RuntimeError(f"{len(done)}/{len(QUESTIONS)} answered: {errors[:1]}")
+        return time.perf_counter() - started, first_byte
+
+    async def ask_disconnect(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        # Unique, so the saved message can be told apart from concurrent requests
+        question = f"{QUESTIONS[i % len(QUESTIONS)]} (request {i})"
+        started, first_byte = time.perf_counter(), None
+        async with self.client.stream("POST", f"/chat/ask/{session_id}", data={"question": question}, headers=self.headers) as response:
+            response.raise_for_status()
+            async for text in response.aiter_text():
+                if text.strip():
+                    first_byte = time.perf_counter() - started
+                    break
+        # Leaving the block closes the connection mid-answer
+
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            response = await self.client.get(f"/chat/history/{session_id}", headers=self.headers)
+            response.raise_for_status()
+            saved = [message for message in response.json()["messages"] if message["question"] == question]
+            if saved:
+                if not saved[-1].get("truncated"):
+                    raise RuntimeError("Answer saved without the truncated flag")
+                return time.perf_counter() - started, first_byte
+            await asyncio.sleep(0.05)
+        raise RuntimeError("Partial answer was not saved")
+
+    async def ask_voice(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        started = time.perf_counter()
+        response = await self.client.post(
+            f"/chat/ask/{session_id}",
+            files={"audio_file": ("question.wav", self.wav, "audio/wav")},
+            headers=self.headers
+        )
+        response.raise_for_status()
+        elapsed = time.perf_counter() - started
+        if "[Internal error" in response.json()["answer"]:
+            raise RuntimeError(response.json()["answer"].strip()[-200:])
+        # Not timed: the audio URL must be absolute and served by the app
+        (await self.client.get(response.json()["audio_url"])).raise_for_status()
+        return elapsed, None
+
+    async def search(self, i: int):
+        started = time.perf_counter()
+        response = await self.client.get(
+            "/doc/search",
+            params={"q": SEARCH_QUERIES[i % len(SEARCH_QUERIES)], "limit": 10},
+            headers=self.headers
+        )
+        response.raise_for_status()
+        if not response.json()["results"]:
+            raise RuntimeError("No search results")
+        return time.perf_counter() - started, None
+
+    async def summarize(self, i: int):
+        session_id = self.session_ids[i % len(self.session_ids)]
+        started, first_byte = time.perf_counter(), None
+        async with self.client.stream("POST", f"/chat/summarize/{session_id}", headers=self.headers) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - started
+        return time.perf_counter() - started, first_byte
+
+
+async def run_scenario(name: str, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_bytes, failures = [], [], []
+
+    async def one(i: int):
+        async with semaphore:
+            try:
+                latency, first_byte = await getattr(scenario, name)(i)
+            except Exception as e:
+                failures.append(f"{type(e).__name__}: {e}")
+                return
+            latencies.append(latency)
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    result = summarize_timings(name, latencies, first_bytes, len(failures), time.perf_counter() - started)
+    if failures:
+        result["first_errors"] = failures[:3]
+    return result
+
+
+def spawn(module: str, *arguments, env=None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", module, *map(str, arguments)], cwd=REPO_ROOT, env=env)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario")
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--app-port", type=int, default=8900)
+    parser.add_argument("--upstream-port", type=int, default=8901)
+    parser.add_argument("--app-url", help="Benchmark a running server instead of starting one")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    processes = []
+    workdir = tempfile.TemporaryDirectory(prefix="medichat-bench-")
+    upstream_url = None
+    try:
+        app_url = args.app_url
+        if app_url is None:
+            upstream_url = f"http://127.0.0.1:{args.upstream_port}"
+            processes.append(spawn(
+                "benchmarks.e2e.fake_upstream",
+                "--port", args.upstream_port,
+                "--llm-latency-ms", args.llm_latency_ms,
+                "--token-interval-ms", args.token_interval_ms,
+                "--answer-tokens", args.answer_tokens,
+                "--embedding-latency-ms", args.embedding_latency_ms,
+                "--stt-latency-ms", args.stt_latency_ms,
+                "--tts-latency-ms", args.tts_latency_ms
+            ))
+            await wait_until_up(f"{upstream_url}/health", processes[-1])
+
+            env = {**os.environ, "SECRET_KEY": SECRET_KEY}
+            app_url = f"http://127.0.0.1:{args.app_port}"
+            processes.append(spawn(
+                "benchmarks.e2e.serve",
+                "--port", args.app_port,
+                "--workdir", workdir.name,
+                "--upstream", upstream_url,
+                env=env
+            ))
+            await wait_until_up(f"{app_url}/", processes[-1])
+
+        session_ids = [f"bench-session-{i}" for i in range(args.sessions)]
+        timeout = httpx.Timeout(120.0)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+        results = []
+        async with httpx.AsyncClient(base_url=app_url, timeout=timeout, limits=limits) as client:
+            scenario = Scenario(client, auth_headers("bench@example.com"), session_ids, args)
+            if "upload" not in args.scenarios:
+                # Later scenarios need the sessions to exist
+                for i in range(len(session_ids)):
+                    await scenario.upload(i)
+            for name in SCENARIOS:
+                if name in args.scenarios:
+                    results.append(await run_scenario(name, scenario, args.requests, args.concurrency))
+            # Streamed completions the app abandoned, ask_disconnect should account for all of them
+            upstream = (await client.get(f"{upstream_url}/stats")).json() if upstream_url else None
+
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                key: getattr(args, key)
+                for key in ("concurrency", "requests", "sessions", "pdf_pages", "llm_latency_ms",
+                            "token_interval_ms", "answer_tokens", "embedding_latency_ms",
+                            "stt_latency_ms", "tts_latency_ms")
+            },
+            "scenarios": results,
+            "upstream": upstream
+        }
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            Path(args.output).write_text(output + "\n")
+
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+Run the API against the in-process Mongo stand-in and local file storage.
+
+    python -m benchmarks.e2e.serve --port 8900 --workdir /tmp/bench --upstream http://127.0.0.1:8901
+
+Everything the app writes (Chroma data, uploads, TTS cache) goes under
+--workdir, so a run never touches the checkout or a real account.
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+
+def configure_environment(workdir: Path, upstream: str):
+    defaults = {
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{upstream}/v1",
+        "DEEPGRAM_API_KEY": "benchmark",
+        "DEEPGRAM_API_URL": f"{upstream}/v1/listen",
+        "SPEAK_API_URL": f"{upstream}/speak",
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORAGE_DIR": str(workdir / "uploads"),
+        "TTS_CACHE_DIR": str(workdir / "tts_cache"),
+        "OTEL_TRACES_EXPORTER": "none",
+        # Use a cached tokenizer or the character estimate, never the network
+        "HF_HUB_OFFLINE": "1",
+        "ANONYMIZED_TELEMETRY": "False",
+        "SECRET_KEY": "benchmark-secret",
+        "DB_NAME": "benchmark"
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument("--upstream", default="http://127.0.0.1:8901")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    configure_environment(workdir, args.upstream)
+
+    # Relative paths in the app (./chroma_data) resolve inside the workdir
+    sys.path.insert(0, str(REPO_ROOT))
+    os.chdir(workdir)
+
+    import uvicorn
+    from tests.fake_mongo import FakeClient
+    from src.database import db as database
+
+    # connect_to_mongo reads this name at call time, so startup wires up the stand-in
+    database.AsyncIOMotorClient = lambda *args, **kwargs: FakeClient()
+
+    import main as app_module
+    uvicorn.run(app_module.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Cold-start cost of importing the app.
+
+    python -m benchmarks.import_time --runs 5 --top 15
+
+Imports `main` in fresh interpreters under `python -X importtime` and
+reports the median total import time, the slowest modules by cumulative
+time, and whether any library that should load lazily (on first use,
+through src/utils/services.py) was imported anyway. Exits non-zero if one
+was, so it can run in CI.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# Loaded on first use, importing main must not pull them in
+LAZY_MODULES = ("chromadb", "fpdf", "PyPDF2", "docx", "cloudinary", "openai", "onnxruntime")
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def import_main() -> list:
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"), "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append({"module": module, "self_us": int(self_us), "cumulative_us": int(cumulative_us), "depth": len(indent) // 2})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_main() for _ in range(args.runs)]
+    totals = [next(row["cumulative_us"] for row in rows if row["module"] == "main") / 1000 for rows in runs]
+
+    last = runs[-1]
+    # Top-level packages only, a submodule's time is already in its package
+    slowest = sorted((row for row in last if row["depth"] <= 1), key=lambda row: row["cumulative_us"], reverse=True)
+    imported = {row["module"].split(".")[0] for row in last}
+    eager = [module for module in LAZY_MODULES if module in imported]
+
+    print(json.dumps({
+        "runs": args.runs,
+        "import_main_ms": {"median": round(statistics.median(totals), 1), "min": round(min(totals), 1), "max": round(max(totals), 1)},
+        "slowest": [{"module": row["module"], "cumulative_ms": round(row["cumulative_us"] / 1000, 1)} for row in slowest[:args.top]],
+        "lazy_modules_imported": eager
+    }, indent=2))
+    sys.exit(1 if eager else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Event-loop stalls caused by password hashing during a login storm.
+
+    python -m benchmarks.login_storm --logins 64 --rounds 12
+
+A fake token stream (one token every 5 ms, like a chat answer) runs while a
+burst of logins verifies bcrypt hashes, first inline on the event loop and
+then through the bounded password_utils worker pool. Reports the stream's
+inter-token latency and the wall time of the login burst for both.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from fastapi import HTTPException
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def token_stream(stop: asyncio.Event, interval: float = 0.005):
+    gaps, last = [], time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        gaps.append((now - last) * 1000)
+        last = now
+    return gaps
+
+
+async def storm(verify, logins: int) -> dict:
+    stop = asyncio.Event()
+    stream = asyncio.create_task(token_stream(stop))
+    await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    gaps = await stream
+    rejected = sum(1 for r in results if isinstance(r, HTTPException) and r.status_code == 503)
+    return {
+        "login_burst_s": round(elapsed, 3),
+        "rejected_503": rejected,
+        "token_gap_ms": {
+            "p50": round(statistics.median(gaps), 2),
+            "p99": round(percentile(gaps, 0.99), 2),
+            "max": round(max(gaps), 2)
+        }
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from src.utils import password_utils
+
+    stored = password_utils.pwd_context.hash("correct horse battery staple")
+
+    async def inline():
+        # What login_user did before: verify directly inside the coroutine
+        return password_utils.pwd_context.verify("correct horse battery staple", stored)
+
+    async def pooled():
+        return await password_utils.verify_password("correct horse battery staple", stored)
+
+    report = {
+        "bcrypt_rounds": args.rounds,
+        "workers": password_utils.PASSWORD_HASH_WORKERS,
+        "queue_limit": password_utils.PASSWORD_HASH_QUEUE_LIMIT,
+        "inline": await storm(inline, args.logins),
+        "worker_pool": await storm(pooled, args.logins)
+    }
+    password_utils.shutdown_password_executor()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+PDF rendering throughput at different concurrency levels.
+
+    python -m benchmarks.pdf_throughput --pdfs 40 --concurrency 1 2 4 8
+
+"inline" renders on the event loop like the summarize routes used to, "pool"
+goes through the process pool in pdf_renderer. Besides PDFs per second it
+reports the worst event loop stall seen by a 10 ms heartbeat task, which is
+what every other request on the worker would have felt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from src.features.chats import pdf_renderer
+from src.features.chats.pdf import EnhancedConsultationSummary, generate_enhanced_consultation_pdf
+
+
+def sample_summary() -> EnhancedConsultationSummary:
+    return EnhancedConsultationSummary(
+        session_overview="Follow-up on blood work and persistent fatigue. " * 12,
+        conversation_highlights={
+            "patient_concerns": "Fatigue, poor sleep and occasional dizziness after meals. " * 4,
+            "doctor_inquiry": "Diet, sleep schedule, current medications and family history. " * 4,
+            "key_observations": "HbA1c 6.1%, fasting glucose 108 mg/dL, ferritin 12 ng/mL. " * 4,
+            "doctor_explanation": "Borderline glycaemic control and low iron stores. " * 4,
+            "recommendations_given": "Dietary changes, iron supplementation and a repeat panel. " * 4
+        },
+        doctor_assessment="Prediabetes with iron deficiency, no acute findings. " * 8,
+        investigations_suggested=[f"Repeat lab panel #{i}" for i in range(6)],
+        medications_treatment=[f"Ferrous sulfate 325 mg once daily, week {i}" for i in range(6)],
+        action_items=[f"Action item {i}: book the follow-up visit" for i in range(8)],
+        ai_summary_note="Generated for benchmarking. " * 10
+    )
+
+
+async def _heartbeat(stop: asyncio.Event, stalls: list):
+    interval = 0.01
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(time.perf_counter() - started - interval)
+
+
+async def run(mode: str, pdfs: int, concurrency: int) -> dict:
+    summary = sample_summary()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def render_one(i: int):
+        async with semaphore:
+            if mode == "inline":
+                generate_enhanced_consultation_pdf("bench-user", f"session-{i}", summary)
+            else:
+                await pdf_renderer.render_consultation_pdf("bench-user", f"session-{i}", summary)
+
+    stop, stalls = asyncio.Event(), []
+    heartbeat = asyncio.create_task(_heartbeat(stop, stalls))
+    started = time.perf_counter()
+    await asyncio.gather(*(render_one(i) for i in range(pdfs)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await heartbeat
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "pdfs": pdfs,
+        "seconds": round(elapsed, 3),
+        "pdfs_per_second": round(pdfs / elapsed, 2),
+        "max_loop_stall_ms": round(max(stalls, default=0) * 1000, 1)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdfs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--workers", type=int, default=pdf_renderer.PDF_RENDER_WORKERS)
+    args = parser.parse_args()
+
+    pdf_renderer.PDF_RENDER_WORKERS = args.workers
+    # Warm up the pool so process start-up isn't billed to the first level
+    await asyncio.gather(*(
+        pdf_renderer.render_consultation_pdf("warmup", "warmup", sample_summary())
+        for _ in range(args.workers)
+    ))
+
+    results = [await run("inline", args.pdfs, 1)]
+    for level in args.concurrency:
+        results.append(await run("pool", args.pdfs, level))
+
+    pdf_renderer.shutdown_pdf_executor()
+    print(json.dumps({"workers": args.workers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Per-session retrieval: numpy session matrices vs. Chroma.
+
+    python -m benchmarks.vector_engine --sessions 50 --chunks 300 --queries 200
+
+Builds the same corpus in an ephemeral Chroma collection (queried the way
+retrieve_chunks did: filter on metadata, top 20) and in SessionVectorStore
+with float16 and int8 storage. Reports recall@k against exact float32
+search, query latency percentiles and bytes on disk per vector.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+from src.database.session_vectors import SessionVectorStore
+
+MODEL = "openai:text-embedding-ada-002"
+
+
+def clustered_corpus(rng, sessions: int, chunks: int, dim: int):
+    # Chunks of one document sit near a shared topic vector, like real embeddings do
+    corpus = {}
+    for s in range(sessions):
+        topics = rng.standard_normal((8, dim)).astype(np.float32)
+        assignment = rng.integers(0, len(topics), size=chunks)
+        vectors = topics[assignment] + 0.6 * rng.standard_normal((chunks, dim)).astype(np.float32)
+        corpus[f"session-{s}"] = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return corpus
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return {"p50": round(float(np.percentile(ms, 50)), 3), "p95": round(float(np.percentile(ms, 95)), 3), "p99": round(float(np.percentile(ms, 99)), 3)}
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=300, help="Chunks per session")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--skip-chroma", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    corpus = clustered_corpus(rng, args.sessions, args.chunks, args.dim)
+    session_ids = list(corpus)
+    queries = []
+    for _ in range(args.queries):
+        session_id = session_ids[rng.integers(len(session_ids))]
+        anchor = corpus[session_id][rng.integers(args.chunks)]
+        query = anchor + 0.8 * rng.standard_normal(args.dim).astype(np.float32)
+        queries.append((session_id, query / np.linalg.norm(query)))
+
+    def exact(session_id, query):
+        scores = corpus[session_id] @ query
+        return set(np.argsort(-scores)[:args.k].tolist())
+
+    truth = [exact(session_id, query) for session_id, query in queries]
+    total_vectors = args.sessions * args.chunks
+    report = {"config": vars(args), "engines": {}}
+
+    with tempfile.TemporaryDirectory(prefix="vector-bench-") as workdir:
+        for dtype in ("float16", "int8"):
+            store = SessionVectorStore(root=os.path.join(workdir, dtype), dtype=dtype)
+            started = time.perf_counter()
+            for session_id, vectors in corpus.items():
+                ids = [f"{session_id}_chunk_{i}" for i in range(len(vectors))]
+                store.add(MODEL, "bench@example.com", session_id, ids, vectors, ids, [{"chunk_index": i} for i in range(len(vectors))])
+            build = time.perf_counter() - started
+
+            latencies, recalls = [], []
+            for (session_id, query), expected in zip(queries, truth):
+                started = time.perf_counter()
+                hits = store.query(MODEL, "bench@example.com", session_id, query, k=args.k)
+                latencies.append(time.perf_counter() - started)
+                recalls.append(len(expected & {hit["metadata"]["chunk_index"] for hit in hits}) / args.k)
+
+            report["engines"][f"numpy_{dtype}"] = {
+                "build_s": round(build, 3),
+                f"recall@{args.k}": round(float(np.mean(recalls)), 4),
+                "query_ms": percentiles(latencies),
+                "bytes_per_vector": round(directory_bytes(os.path.join(workdir, dtype)) / total_vectors, 1)
+            }
+
+        if not args.skip_chroma:
+            import chromadb
+
+            client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma"))
+            collection = client.get_or_create_collection("bench")
+            started = time.perf_counter()
+            for session_id, vectors in corpus.items():
+                collection.add(
+                    ids=[f"{session_id}_chunk_{i}" for i in range(len(vectors))],
+                    embeddings=vectors.tolist(),
+                    metadatas=[{"user_id": "bench@example.com", "session_id": session_id, "chunk_index": i} for i in range(len(vectors))]
+                )
+            build = time.perf_counter() - started
+
+            latencies, recalls = [], []
+            for (session_id, query), expected in zip(queries, truth):
+                started = time.perf_counter()
+                result = collection.query(
+                    query_embeddings=[query.tolist()],
+                    n_results=args.k,
+                    where={"$and": [{"user_id": "bench@example.com"}, {"session_id": session_id}]}
+                )
+                latencies.append(time.perf_counter() - started)
+                recalls.append(len(expected & {meta["chunk_index"] for meta in result["metadatas"][0]}) / args.k)
+
+            report["engines"]["chroma"] = {
+                "build_s": round(build, 3),
+                f"recall@{args.k}": round(float(np.mean(recalls)), 4),
+                "query_ms": percentiles(latencies),
+                "bytes_per_vector": round(directory_bytes(os.path.join(workdir, "chroma")) / total_vectors, 1)
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,23 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from src.database.db import connect_to_mongo, close_mongo_connection
+from src.database.db import connect_to_mongo, close_mongo_connection, get_database
 from src.features.users.Uroutes import router as user_router
 from src.features.docs.Droutes import router as doc_router
 from src.features.chats.chatRoutes import router as chat_router
 from src.features.sessions.sessionRoutes import router as session_router
+from src.features.sessions.deletion import ensure_deletion_indexes, start_deletion_worker, stop_deletion_worker
+from src.features.docs.dedup import ensure_signature_indexes
+from src.features.docs.storage import check_storage_settings
+from src.features.chats.message_writer import start_message_writer, stop_message_writer
+from src.features.chats.pdf_renderer import shutdown_pdf_executor
+from src.features.chats.token_budget import load_tokenizer
+from src.utils.password_utils import shutdown_password_executor
+from src.utils.tracing import setup_tracing, shutdown_tracing
+from src.utils.services import close_services
+from src.utils.metrics import MetricsMiddleware, metrics_endpoint
 app = FastAPI()
+setup_tracing(app)
+app.add_middleware(MetricsMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,13 +32,29 @@ app.add_middleware(
 async def root():
     return {"message": "Welcome to the server side"}
 
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 @app.on_event("startup")
 async def startup_db():
+    check_storage_settings()
     await connect_to_mongo()
+    await ensure_signature_indexes(get_database())
+    await ensure_deletion_indexes(get_database())
+    # Loads in the background, token counts are estimated until it is ready
+    load_tokenizer()
+    start_deletion_worker(get_database())
+    start_message_writer(get_database())
 
 @app.on_event("shutdown")
 async def shutdown_db():
+    await stop_deletion_worker()
+    # Queued chat messages are written before the connection goes
+    await stop_message_writer()
     await close_mongo_connection()
+    shutdown_pdf_executor()
+    shutdown_password_executor()
+    await close_services()
+    shutdown_tracing()
 
 
 
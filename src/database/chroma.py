@@ -0,0 +1,76 @@
+from urllib.parse import urlparse
+from src.utils.embeddings import embedding_model_name
+from src.utils.services import services
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_data")
+# Set to a shared Chroma server (`chroma run --path ./chroma_data --port 8001`) when running
+# several workers: each worker opening CHROMA_PATH itself keeps its own copy of the index in
+# memory and contends with the others on the same files
+CHROMA_SERVER_URL = os.getenv("CHROMA_SERVER_URL", "").strip()
+
+# Chunks embedded with ada-002 predate per-model collections and keep the original name
+LEGACY_COLLECTION = "doc_chunks"
+LEGACY_MODEL = "openai:text-embedding-ada-002"
+
+_collections = {}
+
+
+def _create_chroma_client():
+    # chromadb takes half a second to import, pay for it on the first query rather than at startup
+    from chromadb import HttpClient, PersistentClient
+    if CHROMA_SERVER_URL:
+        url = urlparse(CHROMA_SERVER_URL)
+        return HttpClient(host=url.hostname, port=url.port or (443 if url.scheme == "https" else 80), ssl=url.scheme == "https")
+
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logger.warning("Opening %s in every worker process, set CHROMA_SERVER_URL to share one Chroma server", CHROMA_PATH)
+    return PersistentClient(path=CHROMA_PATH)
+
+
+def _close_chroma_client(client):
+    _collections.clear()
+
+
+services.register("chroma", _create_chroma_client, close=_close_chroma_client)
+
+
+def get_chroma_client():
+    # One client for ingestion and retrieval, both must see the same data
+    return services.get("chroma")
+
+
+def collection_name(model_name: str) -> str:
+    if model_name == LEGACY_MODEL:
+        return LEGACY_COLLECTION
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "-", model_name).strip("-")
+    return f"{LEGACY_COLLECTION}__{slug}"[:63]
+
+
+def get_chunk_collection(model_name: str = None):
+    """Chunk collection for the configured embedding model, vectors of different models never share one."""
+    model_name = model_name or embedding_model_name()
+    if model_name not in _collections:
+        collection = get_chroma_client().get_or_create_collection(
+            name=collection_name(model_name),
+            metadata={"embedding_model": model_name}
+        )
+        recorded = (collection.metadata or {}).get("embedding_model")
+        if recorded and recorded != model_name:
+            raise RuntimeError(
+                f"Collection {collection.name} holds {recorded} vectors, refusing to use it for {model_name}"
+            )
+        _collections[model_name] = collection
+    return _collections[model_name]
+
+
+def chunk_collections():
+    """Every chunk collection on disk, whichever embedding model filled it."""
+    return [
+        collection for collection in get_chroma_client().list_collections()
+        if collection.name == LEGACY_COLLECTION or collection.name.startswith(f"{LEGACY_COLLECTION}__")
+    ]
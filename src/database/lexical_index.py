@@ -0,0 +1,229 @@
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+import json
+import math
+import os
+import re
+import threading
+
+from src.database.session_vectors import session_key
+from src.utils.file_lock import file_lock, file_stamp
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "./lexical_data")
+LEXICAL_CACHE_SESSIONS = int(os.getenv("LEXICAL_CACHE_SESSIONS", "256"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Keeps dosages, lab codes and drug names whole: "5mg", "hba1c", "10.5", "mg/dl", "co-amoxiclav"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+COMPOUND_SEPARATORS = re.compile(r"[\-/]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "what which who how do does my your i you me we our".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        # "co-amoxiclav" also matches a query for "amoxiclav"
+        if COMPOUND_SEPARATORS.search(token):
+            tokens.extend(part for part in COMPOUND_SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class SessionLexicalIndex:
+    """Inverted index over one session's chunks, scored with Okapi BM25."""
+
+    def __init__(self):
+        # term -> {chunk_id: term frequency}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.documents: Dict[str, str] = {}
+        self.doc_ids: Dict[str, str] = {}
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict]):
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            if chunk_id in self.lengths:
+                self._remove_chunk(chunk_id)
+            terms = Counter(tokenize(document))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+            self.lengths[chunk_id] = sum(terms.values())
+            self.documents[chunk_id] = document
+            self.doc_ids[chunk_id] = (metadata or {}).get("doc_id", "")
+
+    def _remove_chunk(self, chunk_id: str):
+        for term in set(tokenize(self.documents.get(chunk_id, ""))):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.lengths.pop(chunk_id, None)
+        self.documents.pop(chunk_id, None)
+        self.doc_ids.pop(chunk_id, None)
+
+    def remove_document(self, doc_id: str) -> int:
+        chunk_ids = [chunk_id for chunk_id, owner in self.doc_ids.items() if owner == doc_id]
+        for chunk_id in chunk_ids:
+            self._remove_chunk(chunk_id)
+        return len(chunk_ids)
+
+    def search(self, query: str, k: int = 20) -> List[Dict]:
+        if not self.lengths:
+            return []
+        total = len(self.lengths)
+        average_length = sum(self.lengths.values()) / total
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            {"id": chunk_id, "document": self.documents[chunk_id], "doc_id": self.doc_ids[chunk_id], "score": score}
+            for chunk_id, score in ranked
+        ]
+
+    def to_dict(self) -> dict:
+        # Postings are stored too: loading them is about three times faster than re-tokenizing every chunk
+        return {
+            "chunks": [[chunk_id, self.documents[chunk_id], self.doc_ids[chunk_id], length] for chunk_id, length in self.lengths.items()],
+            "postings": self.postings
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionLexicalIndex":
+        index = cls()
+        chunks = data.get("chunks", [])
+        if "postings" not in data:
+            # Written before postings were stored, rebuilt here and saved in full by the next update
+            index.add([c[0] for c in chunks], [c[1] for c in chunks], [{"doc_id": c[2]} for c in chunks])
+            return index
+        for chunk_id, document, doc_id, length in chunks:
+            index.documents[chunk_id] = document
+            index.doc_ids[chunk_id] = doc_id
+            index.lengths[chunk_id] = length
+        index.postings = data["postings"]
+        return index
+
+
+class LexicalIndexStore:
+    """
+    One JSON file per session, updated as documents are added and deleted.
+    The file is the source of truth, shared by every worker: a cached index
+    is used only while the file is unchanged, and updates reload it under
+    an inter-process lock, so a worker never writes back a stale copy.
+    """
+
+    def __init__(self, root: str = LEXICAL_INDEX_DIR, cache_size: int = LEXICAL_CACHE_SESSIONS):
+        self.root = root
+        self.cache_size = cache_size
+        # path -> (stamp of the file it was read from, index), least recently used first
+        self._open: "OrderedDict[str, Tuple[tuple, SessionLexicalIndex]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _path(self, user_id: str, session_id: str) -> str:
+        return os.path.join(self.root, f"{session_key(user_id, session_id)}.json")
+
+    def exists(self, user_id: str, session_id: str) -> bool:
+        return os.path.isfile(self._path(user_id, session_id))
+
+    def _load(self, path: str, remember: bool = True) -> Optional[SessionLexicalIndex]:
+        stamp = file_stamp(path)
+        if stamp is None:
+            self._open.pop(path, None)
+            return None
+        cached = self._open.get(path)
+        if cached is not None and cached[0] == stamp:
+            self._open.move_to_end(path)
+            return cached[1]
+        # Not read yet, or rewritten by another worker since
+        with open(path, encoding="utf-8") as f:
+            index = SessionLexicalIndex.from_dict(json.load(f))
+        if remember:
+            self._remember(path, stamp, index)
+        return index
+
+    def _remember(self, path: str, stamp: tuple, index: SessionLexicalIndex):
+        self._open[path] = (stamp, index)
+        self._open.move_to_end(path)
+        if len(self._open) > self.cache_size:
+            self._open.popitem(last=False)
+
+    def _save(self, path: str, index: SessionLexicalIndex):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp_path, path)
+        self._remember(path, file_stamp(path), index)
+
+    def add(self, user_id: str, session_id: str, ids: List[str], documents: List[str], metadatas: List[dict]):
+        path = self._path(user_id, session_id)
+        with self._lock, file_lock(path):
+            index = self._load(path) or SessionLexicalIndex()
+            try:
+                index.add(ids, documents, metadatas)
+                self._save(path, index)
+            except Exception:
+                # The cached copy may hold chunks the file doesn't
+                self._open.pop(path, None)
+                raise
+
+    def delete(self, user_id: str, session_id: str, doc_id: Optional[str] = None) -> int:
+        """Drop the chunks of one document, or the whole session when doc_id is None."""
+        path = self._path(user_id, session_id)
+        with self._lock, file_lock(path):
+            index = self._load(path)
+            if index is None:
+                return 0
+            if doc_id is None:
+                self._open.pop(path, None)
+                os.remove(path)
+                return len(index)
+            try:
+                removed = index.remove_document(doc_id)
+                if removed:
+                    self._save(path, index)
+            except Exception:
+                self._open.pop(path, None)
+                raise
+            return removed
+
+    def search(self, user_id: str, session_id: str, query: str, k: int = 20) -> List[Dict]:
+        with self._lock:
+            index = self._load(self._path(user_id, session_id))
+            return index.search(query, k) if index is not None else []
+
+    def search_sessions(self, user_id: str, session_ids: List[str], query: str, k: int = 20) -> List[Dict]:
+        """search() over several sessions, best k overall; each hit gains its session_id."""
+        # A user with more sessions than the cache holds would push every other open session out of it
+        # on each search (and their own first ones before the scan comes back round): past that size,
+        # the sessions that aren't open already are read for this search only
+        remember = len(session_ids) <= self.cache_size
+        hits = []
+        for session_id in session_ids:
+            with self._lock:
+                index = self._load(self._path(user_id, session_id), remember)
+                session_hits = index.search(query, k) if index is not None else []
+            for hit in session_hits:
+                hit["session_id"] = session_id
+                hits.append(hit)
+        return sorted(hits, key=lambda hit: hit["score"], reverse=True)[:k]
+
+
+lexical_index = LexicalIndexStore()
@@ -0,0 +1,211 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from src.database.chroma import collection_name
+from src.utils.file_lock import file_lock, file_stamp
+
+# chroma | numpy. numpy serves per-session queries from SessionVectorStore, Chroma keeps a full copy
+VECTOR_ENGINE = os.getenv("VECTOR_ENGINE", "chroma").strip().lower()
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", "./vector_data")
+# float16 halves the size of float32 with no measurable recall loss, int8 quarters it
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16").strip().lower()
+# Sessions kept open (memory-mapped) at once
+VECTOR_CACHE_SESSIONS = int(os.getenv("VECTOR_CACHE_SESSIONS", "256"))
+
+
+@dataclass
+class SessionIndex:
+    path: str
+    vectors: np.ndarray
+    scales: Optional[np.ndarray] = None
+    ids: List[str] = field(default_factory=list)
+    documents: List[str] = field(default_factory=list)
+    metadatas: List[dict] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def session_key(user_id: str, session_id: str) -> str:
+    # File-system safe: user ids are e-mail addresses and session ids come from clients
+    return hashlib.sha256(f"{user_id}\0{session_id}".encode("utf-8")).hexdigest()[:32]
+
+
+def _normalize(embeddings) -> np.ndarray:
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    return matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+
+def quantize(matrix: np.ndarray, dtype: str):
+    """float32 rows -> (stored matrix, per-row scales or None)."""
+    if dtype == "int8":
+        scales = np.clip(np.abs(matrix).max(axis=1), 1e-12, None) / 127.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    raise ValueError(f"Unsupported VECTOR_DTYPE {dtype!r}, expected 'float16' or 'int8'")
+
+
+def dequantize(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    matrix = vectors.astype(np.float32)
+    return matrix * scales[:, None] if scales is not None else matrix
+
+
+class SessionVectorStore:
+    """
+    One directory per (embedding model, user, session) with vectors.npy
+    (float16, or int8 plus scales.npy) and meta.json holding ids, documents
+    and metadatas in row order. Rows are L2-normalized on insert, so a query
+    is one matrix-vector product and a partial sort. Sessions hold a few
+    hundred chunks, small enough that exact search beats any index.
+
+    Every worker shares the directories: an open session is reused only
+    while its meta.json is the one it was read from, and updates reload
+    it under an inter-process lock before writing.
+    """
+
+    def __init__(self, root: str = VECTOR_STORE_DIR, dtype: str = VECTOR_DTYPE, cache_size: int = VECTOR_CACHE_SESSIONS):
+        self.root = root
+        self.dtype = dtype
+        self.cache_size = cache_size
+        # path -> (stamp of the meta.json it was read from, SessionIndex), least recently used first
+        self._open: "OrderedDict[str, Tuple[tuple, SessionIndex]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def session_path(self, model_name: str, user_id: str, session_id: str) -> str:
+        return os.path.join(self.root, collection_name(model_name), session_key(user_id, session_id))
+
+    def exists(self, model_name: str, user_id: str, session_id: str) -> bool:
+        return os.path.isfile(os.path.join(self.session_path(model_name, user_id, session_id), "meta.json"))
+
+    def _load(self, path: str) -> Optional[SessionIndex]:
+        # A write swaps the whole directory, so a new meta.json means new vectors too
+        stamp = file_stamp(os.path.join(path, "meta.json"))
+        if stamp is None:
+            self._open.pop(path, None)
+            return None
+        cached = self._open.get(path)
+        if cached is not None and cached[0] == stamp:
+            self._open.move_to_end(path)
+            return cached[1]
+
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        scales_path = os.path.join(path, "scales.npy")
+        index = SessionIndex(
+            path=path,
+            vectors=np.load(os.path.join(path, "vectors.npy"), mmap_mode="r"),
+            scales=np.load(scales_path) if os.path.isfile(scales_path) else None,
+            ids=meta["ids"],
+            documents=meta["documents"],
+            metadatas=meta["metadatas"]
+        )
+        self._open[path] = (stamp, index)
+        self._open.move_to_end(path)
+        if len(self._open) > self.cache_size:
+            self._open.popitem(last=False)
+        return index
+
+    def _write(self, path: str, matrix: np.ndarray, ids, documents, metadatas):
+        # Build the new version next to the old one and swap directories, readers never see a partial write
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        vectors, scales = quantize(matrix, self.dtype)
+        np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+        if scales is not None:
+            np.save(os.path.join(tmp_path, "scales.npy"), scales)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "documents": documents, "metadatas": metadatas, "dtype": self.dtype}, f)
+
+        self._open.pop(path, None)
+        old_path = f"{path}.old"
+        if os.path.isdir(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def add(self, model_name: str, user_id: str, session_id: str, ids: List[str], embeddings, documents: List[str], metadatas: List[dict]):
+        path = self.session_path(model_name, user_id, session_id)
+        with self._lock, file_lock(path):
+            index = self._load(path)
+            new_matrix = _normalize(embeddings)
+            if index is not None and len(index):
+                # Re-adding a chunk id replaces the old row
+                replaced = set(ids)
+                keep = [i for i, chunk_id in enumerate(index.ids) if chunk_id not in replaced]
+                matrix = np.vstack([dequantize(index.vectors[keep], index.scales[keep] if index.scales is not None else None), new_matrix])
+                ids = [index.ids[i] for i in keep] + list(ids)
+                documents = [index.documents[i] for i in keep] + list(documents)
+                metadatas = [index.metadatas[i] for i in keep] + list(metadatas)
+            else:
+                matrix = new_matrix
+            self._write(path, matrix, list(ids), list(documents), list(metadatas))
+
+    def delete(self, model_name: str, user_id: str, session_id: str, doc_id: Optional[str] = None) -> int:
+        """Drop the rows of one document, or the whole session when doc_id is None."""
+        return self._delete_path(self.session_path(model_name, user_id, session_id), doc_id)
+
+    def delete_all_models(self, user_id: str, session_id: str, doc_id: Optional[str] = None) -> int:
+        """delete() for every embedding model that has vectors on disk, not only the configured one."""
+        if not os.path.isdir(self.root):
+            return 0
+        key = session_key(user_id, session_id)
+        return sum(self._delete_path(os.path.join(self.root, model_dir, key), doc_id) for model_dir in os.listdir(self.root))
+
+    def _delete_path(self, path: str, doc_id: Optional[str]) -> int:
+        with self._lock, file_lock(path):
+            index = self._load(path)
+            if index is None:
+                return 0
+            if doc_id is None:
+                self._open.pop(path, None)
+                shutil.rmtree(path, ignore_errors=True)
+                return len(index)
+
+            keep = [i for i, meta in enumerate(index.metadatas) if meta.get("doc_id") != doc_id]
+            removed = len(index) - len(keep)
+            if removed:
+                scales = index.scales[keep] if index.scales is not None else None
+                self._write(
+                    path,
+                    dequantize(index.vectors[keep], scales),
+                    [index.ids[i] for i in keep],
+                    [index.documents[i] for i in keep],
+                    [index.metadatas[i] for i in keep]
+                )
+            return removed
+
+    def query(self, model_name: str, user_id: str, session_id: str, query_embedding, k: int = 20) -> List[Dict]:
+        path = self.session_path(model_name, user_id, session_id)
+        with self._lock:
+            index = self._load(path)
+        if index is None or not len(index):
+            return []
+
+        query = _normalize(query_embedding)[0]
+        scores = index.vectors.astype(np.float32, copy=False) @ query
+        if index.scales is not None:
+            scores *= index.scales
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": index.ids[i], "document": index.documents[i], "metadata": index.metadatas[i], "score": float(scores[i])}
+            for i in top
+        ]
+
+
+session_vectors = SessionVectorStore()
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+from opentelemetry import trace
+from src.database.chroma import chunk_collections, get_chunk_collection
+from src.utils.metrics import CHROMA_OPERATION_DURATION, VECTOR_QUERY_BATCH_SIZE, observe
+import asyncio
+import json
+import os
+
+tracer = trace.get_tracer(__name__)
+
+# How long a query waits for others with the same filter to share its Chroma call; 0 disables batching
+VECTOR_BATCH_WINDOW_MS = float(os.getenv("VECTOR_BATCH_WINDOW_MS", "2"))
+# Query embeddings sent in one call at most, a full batch goes out without waiting
+VECTOR_BATCH_MAX = int(os.getenv("VECTOR_BATCH_MAX", "64"))
+
+
+@dataclass
+class _QueryBatch:
+    model_name: str
+    n_results: int
+    where: dict
+    include: List[str]
+    embeddings: list = field(default_factory=list)
+    # (future, number of embeddings it asked for), in the order they were appended
+    waiters: List[Tuple[asyncio.Future, int]] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class VectorStore:
+    """
+    Async front for the chunk collections. Chroma calls run off the event
+    loop, and concurrent queries with the same filter (the questions of a
+    batch ask, several users of one session) are merged into a single
+    collection.query. Whether Chroma runs in-process or as a shared server
+    (CHROMA_SERVER_URL) is decided by the client in chroma.py, callers
+    don't change.
+    """
+
+    def __init__(self, window_ms: float = VECTOR_BATCH_WINDOW_MS, max_batch: int = VECTOR_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._batches: Dict[str, _QueryBatch] = {}
+
+    async def query(self, model_name: str, query_embeddings: Sequence, n_results: int, where: dict, include: Sequence[str] = ("documents",)) -> dict:
+        """collection.query for query_embeddings: ids, and whatever include asks for, one list per embedding."""
+        query_embeddings = list(query_embeddings)
+        if self.window <= 0:
+            return await asyncio.to_thread(self._query, model_name, query_embeddings, n_results, where, list(include))
+
+        key = json.dumps([model_name, n_results, where, sorted(include)], sort_keys=True)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _QueryBatch(model_name, n_results, where, list(include))
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.embeddings.extend(query_embeddings)
+        batch.waiters.append((future, len(query_embeddings)))
+        if len(batch.embeddings) >= self.max_batch:
+            batch.timer.cancel()
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: str):
+        batch = self._batches.pop(key, None)
+        if batch is not None:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: _QueryBatch):
+        VECTOR_QUERY_BATCH_SIZE.observe(len(batch.embeddings))
+        try:
+            with tracer.start_as_current_span("vector_store.query_batch", attributes={
+                "chroma.n_queries": len(batch.embeddings),
+                "chroma.n_callers": len(batch.waiters),
+                "chroma.n_results": batch.n_results
+            }):
+                results = await asyncio.to_thread(
+                    self._query, batch.model_name, batch.embeddings, batch.n_results, batch.where, batch.include
+                )
+        except Exception as e:
+            for future, _ in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Hand every caller the rows of its own embeddings
+        start = 0
+        for future, count in batch.waiters:
+            if not future.done():
+                future.set_result({
+                    name: rows[start:start + count] if rows is not None and name != "included" else rows
+                    for name, rows in results.items()
+                })
+            start += count
+
+    @staticmethod
+    def _query(model_name: str, query_embeddings: list, n_results: int, where: dict, include: List[str]) -> dict:
+        with observe(CHROMA_OPERATION_DURATION, operation="query"):
+            return get_chunk_collection(model_name).query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                include=include
+            )
+
+    async def get(self, model_name: Optional[str] = None, **kwargs) -> dict:
+        """collection.get with Chroma's keyword arguments (ids, where, limit, offset, include)."""
+        def run():
+            with observe(CHROMA_OPERATION_DURATION, operation="get"):
+                return get_chunk_collection(model_name).get(**kwargs)
+        return await asyncio.to_thread(run)
+
+    async def add(self, model_name: str, ids: List[str], documents: List[str], metadatas: List[dict], embeddings):
+        def run():
+            with observe(CHROMA_OPERATION_DURATION, operation="add"):
+                get_chunk_collection(model_name).add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        await asyncio.to_thread(run)
+
+    async def upsert(self, model_name: str, ids: List[str], documents: List[str], metadatas: List[dict], embeddings):
+        def run():
+            with observe(CHROMA_OPERATION_DURATION, operation="upsert"):
+                get_chunk_collection(model_name).upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        await asyncio.to_thread(run)
+
+    async def delete_where(self, where: dict, batch_size: int) -> int:
+        """Delete matching chunks from every collection, batch_size ids per round trip. Returns how many went."""
+        def run():
+            deleted = 0
+            for collection in chunk_collections():
+                while True:
+                    with observe(CHROMA_OPERATION_DURATION, operation="get"):
+                        ids = collection.get(where=where, limit=batch_size, include=[])["ids"]
+                    if not ids:
+                        break
+                    with observe(CHROMA_OPERATION_DURATION, operation="delete"):
+                        collection.delete(ids=ids)
+                    deleted += len(ids)
+            return deleted
+        return await asyncio.to_thread(run)
+
+
+vector_store = VectorStore()
@@ -0,0 +1,74 @@
+import asyncio
+import io
+import logging
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+import soxr
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# 16 kHz mono is what the speech models expect
+TARGET_SAMPLE_RATE = 16000
+
+
+def decode_to_mono(audio_bytes: bytes, sample_rate: int = TARGET_SAMPLE_RATE) -> np.ndarray:
+    """Decode with libsndfile (WAV, FLAC, OGG/Vorbis/Opus, MP3), downmix and resample."""
+    samples, source_rate = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+    mono = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+    if source_rate != sample_rate:
+        mono = soxr.resample(mono, source_rate, sample_rate, quality="HQ")
+    return mono
+
+
+def probe_duration(fileobj) -> Optional[float]:
+    """Duration from the container header only, None if libsndfile can't tell."""
+    try:
+        return sf.info(fileobj).duration
+    except Exception:
+        return None
+    finally:
+        fileobj.seek(0)
+
+
+def encode_wav(samples: np.ndarray, sample_rate: int = TARGET_SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def normalize_in_process(audio_bytes: bytes) -> bytes:
+    return encode_wav(decode_to_mono(audio_bytes))
+
+
+async def normalize_with_ffmpeg(audio_bytes: bytes) -> bytes:
+    # Containers libsndfile can't read (WebM, M4A/AAC, ...) go through ffmpeg pipes, no temp files
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-ar", str(TARGET_SAMPLE_RATE),
+            "-ac", "1",
+            "-f", "wav", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=400, detail="Audio conversion failed. Unsupported format and ffmpeg is not installed.")
+
+    wav_bytes, stderr = await process.communicate(audio_bytes)
+    if process.returncode != 0 or not wav_bytes:
+        logger.warning("ffmpeg could not convert the audio (exit code %s): %s", process.returncode, stderr.decode(errors="ignore").strip())
+        raise HTTPException(status_code=400, detail="Audio conversion failed. Unsupported format or ffmpeg error.")
+    return wav_bytes
+
+
+async def normalize_audio(audio_bytes: bytes) -> bytes:
+    """Return 16 kHz mono 16-bit WAV bytes for any supported upload."""
+    try:
+        return await asyncio.to_thread(normalize_in_process, audio_bytes)
+    except sf.SoundFileError:
+        return await normalize_with_ffmpeg(audio_bytes)
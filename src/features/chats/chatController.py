@@ -1,102 +1,292 @@
 from fastapi import HTTPException
 from datetime import datetime
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+from src.utils.metrics import LLM_TIME_TO_FIRST_TOKEN, STREAMS_CANCELLED, STREAMS_IN_FLIGHT
 from .chatSchema import ChatMessage
-from .utils import refine_question, retrieve_chunks, rerank_chunks, generate_answer_streaming
-from openai import OpenAI
-from fpdf import FPDF
-import os
-from datetime import datetime
-from dotenv import load_dotenv
-import unicodedata
+from .utils import refine_question, retrieve_chunks, retrieve_chunks_batch, rerank_chunks, generate_answer_streaming
+from .memory import build_conversation_context
+from .message_writer import message_writer
+from typing import List, Set
+import asyncio
+import json
 import logging
+import os
+import time
+
+tracer = trace.get_tracer(__name__)
+
+# Questions of one batch request refined, reranked and answered at the same time
+BATCH_ANSWER_CONCURRENCY = int(os.getenv("BATCH_ANSWER_CONCURRENCY", "4"))
+
+# The answer is streamed, so the pipeline span can't stay "current" across yields.
+# Each stage re-enters it explicitly with trace.use_span around code that doesn't yield.
+
+# When a client disconnects Starlette cancels the streaming response: the pending await in the
+# pipeline (retrieval, the OpenAI stream) raises CancelledError and the stack unwinds. Saves of
+# the partial answer run as tasks of their own, an await in the cancelled request would be
+# cancelled with it.
+_detached_saves: Set[asyncio.Task] = set()
+
+
+async def _load_session(user_id: str, session_id: str, db):
+    # Messages of the previous turn may still be queued
+    await message_writer.flush_session(user_id, session_id)
+    return await db["sessions"].find_one({"session_id": session_id, "user_id": user_id, "deleted_at": None})
+
+
+def _live_doc_ids(session: dict) -> Set[str]:
+    return {doc["doc_id"] for doc in session.get("documents", [])}
+
+
+async def _prepare_answer(user_id: str, session_id: str, question: str, db):
+    with tracer.start_as_current_span("chat.session_load"):
+        session = await _load_session(user_id, session_id, db)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    conversation = build_conversation_context(session)
 
-load_dotenv()
+    with tracer.start_as_current_span("chat.refine"):
+        refined_question = await refine_question(question, conversation.render())
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
+    with tracer.start_as_current_span("chat.retrieve") as span:
+        chunks = await retrieve_chunks(user_id, session_id, refined_question, _live_doc_ids(session))
+        span.set_attribute("chat.chunks_retrieved", len(chunks))
+
+    with tracer.start_as_current_span("chat.rerank") as span:
+        top_chunks = await rerank_chunks(refined_question, chunks)
+        span.set_attribute("chat.chunks_kept", len(top_chunks))
+
+    return conversation, refined_question, top_chunks
+
+
+async def _generate(pipeline_span, refined_question: str, top_chunks, conversation):
+    parent = trace.set_span_in_context(pipeline_span)
+    generate_span = tracer.start_span("chat.generate", context=parent)
+    first_token_span = tracer.start_span("chat.time_to_first_token", context=parent)
+    words = 0
+    started = time.perf_counter()
+    try:
+        async for word in generate_answer_streaming(refined_question, top_chunks, conversation):
+            if words == 0:
+                first_token_span.end()
+                LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+            words += 1
+            yield word
+    finally:
+        if words == 0:
+            first_token_span.end()
+        generate_span.set_attribute("chat.answer_words", words)
+        generate_span.end()
+
+
+async def _save_message(user_id: str, session_id: str, question: str, refined_question: str, answer: str, db):
+    message_obj = ChatMessage(
+        question=question,
+        refined_question=refined_question,
+        answer=answer.strip(),
+        timestamp=datetime.utcnow()
+    )
+    await _save_messages(user_id, session_id, [message_obj], db)
+
+
+async def _save_messages(user_id: str, session_id: str, messages: List[ChatMessage], db):
+    # Queued, the writer pushes them with other sessions' messages and then updates the memory
+    await message_writer.save(user_id, session_id, [message.dict() for message in messages], db)
+
+
+def _save_truncated(span, kind: str, user_id: str, session_id: str, messages: List[ChatMessage], db):
+    STREAMS_CANCELLED.labels(kind).inc()
+    span.set_attribute("chat.client_disconnected", True)
+    if not messages:
+        return
+
+    with trace.use_span(span, end_on_exit=False):
+        task = asyncio.create_task(_save_messages(user_id, session_id, messages, db))
+    _detached_saves.add(task)
+    task.add_done_callback(_detached_saves.discard)
+
+
+def _record_failure(span, e: Exception):
+    span.record_exception(e)
+    span.set_status(Status(StatusCode.ERROR, str(e)))
 
-client = OpenAI(api_key=openai_api_key)
 
 async def handle_user_query(user_id: str, session_id: str, question: str, db):
+    span = tracer.start_span("chat.query", attributes={"chat.session_id": session_id, "chat.mode": "text"})
+    STREAMS_IN_FLIGHT.labels("text").inc()
+    answer_accumulator = ""
+    answered = False
     try:
-        session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        # Step 2: Prepare inputs
-        history = session.get("messages", [])
-        refined_question = await refine_question(question, history)
-        chunks = await retrieve_chunks(user_id, session_id, refined_question)
-        top_chunks = await rerank_chunks(refined_question, chunks)
+        with trace.use_span(span, end_on_exit=False):
+            conversation, refined_question, top_chunks = await _prepare_answer(user_id, session_id, question, db)
 
-        # Step 3: Stream LLM answer word-by-word
-        answer_accumulator = ""
-        async for word in generate_answer_streaming(refined_question, top_chunks, history):
+        # Stream LLM answer word-by-word
+        async for word in _generate(span, refined_question, top_chunks, conversation):
             answer_accumulator += word
             yield word  # Stream to user
-
-        # Step 4: Save complete message to DB (after streaming is done)
-        message_obj = ChatMessage(
-            question=question,
-            refined_question=refined_question,
-            answer=answer_accumulator.strip(),
-            timestamp=datetime.utcnow()
-        )
-
-        await db["sessions"].update_one(
-            {"session_id": session_id, "user_id": user_id},
-            {
-                "$push": {"messages": message_obj.dict()},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
-
+        answered = True
+
+        # Save complete message to DB (after streaming is done)
+        with trace.use_span(span, end_on_exit=False):
+            await _save_message(user_id, session_id, question, refined_question, answer_accumulator, db)
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # Client disconnected. Whatever was generated is kept, marked as cut short.
+        if not answered:
+            messages = [ChatMessage(
+                question=question,
+                refined_question=refined_question,
+                answer=answer_accumulator.strip(),
+                timestamp=datetime.utcnow(),
+                truncated=True
+            )] if answer_accumulator else []
+            _save_truncated(span, "text", user_id, session_id, messages, db)
+        raise
     except Exception as e:
+        _record_failure(span, e)
         yield f"\n[Internal error: {str(e)}]"
+    finally:
+        STREAMS_IN_FLIGHT.labels("text").dec()
+        span.end()
 
 
 
 
 async def handle_voice_query(user_id: str, session_id: str, question: str, db):
+    span = tracer.start_span("chat.query", attributes={"chat.session_id": session_id, "chat.mode": "voice"})
     try:
-        session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        history = session.get("messages", [])
-        refined_question = await refine_question(question, history)
-        chunks = await retrieve_chunks(user_id, session_id, refined_question)
-        top_chunks = await rerank_chunks(refined_question, chunks)
+        with trace.use_span(span, end_on_exit=False):
+            conversation, refined_question, top_chunks = await _prepare_answer(user_id, session_id, question, db)
 
-        # Collect full answer from stream
-        answer_accumulator = ""
-        async for word in generate_answer_streaming(refined_question, top_chunks, history):
-            answer_accumulator += word
+            # Collect full answer from stream
+            answer_accumulator = ""
+            async for word in _generate(span, refined_question, top_chunks, conversation):
+                answer_accumulator += word
 
-        # Save to DB
-        message_obj = ChatMessage(
-            question=question,
-            refined_question=refined_question,
-            answer=answer_accumulator.strip(),
-            timestamp=datetime.utcnow()
-        )
-        await db["sessions"].update_one(
-            {"session_id": session_id, "user_id": user_id},
-            {
-                "$push": {"messages": message_obj.dict()},
-                "$set": {"updated_at": datetime.utcnow()}
-            }
-        )
+            await _save_message(user_id, session_id, question, refined_question, answer_accumulator, db)
 
         return answer_accumulator.strip()
 
     except Exception as e:
+        _record_failure(span, e)
         return f"\n[Internal error: {str(e)}]"
+    finally:
+        span.end()
+
+
+async def _prepare_batch(user_id: str, session_id: str, questions: List[str], semaphore: asyncio.Semaphore, db):
+    with tracer.start_as_current_span("chat.session_load"):
+        session = await _load_session(user_id, session_id, db)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    # Every question is answered against the conversation as it stood when the batch arrived
+    conversation = build_conversation_context(session)
+    rendered = conversation.render()
 
+    async def refine(question: str) -> str:
+        async with semaphore:
+            return await refine_question(question, rendered)
 
+    with tracer.start_as_current_span("chat.refine"):
+        refined_questions = await asyncio.gather(*(refine(question) for question in questions))
+
+    # One embeddings call and one vector query for the whole batch
+    with tracer.start_as_current_span("chat.retrieve") as span:
+        candidates = await retrieve_chunks_batch(user_id, session_id, refined_questions, _live_doc_ids(session))
+        span.set_attribute("chat.chunks_retrieved", sum(len(chunks) for chunks in candidates))
+
+    return conversation, refined_questions, candidates
+
+
+def _batch_event(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+
+async def handle_batch_query(user_id: str, session_id: str, questions: List[str], db):
+    """
+    Answers several questions about one session in a single request. Yields
+    NDJSON events tagged with the question's index: {"index", "delta"} while
+    an answer streams, then {"index", "done"} or {"index", "error"}.
+    Answers interleave as they are generated; successful ones are saved in
+    question order with one write once all are finished.
+    """
+    span = tracer.start_span("chat.batch_query", attributes={"chat.session_id": session_id, "chat.questions": len(questions)})
+    STREAMS_IN_FLIGHT.labels("batch").inc()
+    semaphore = asyncio.Semaphore(BATCH_ANSWER_CONCURRENCY)
+    tasks = []
+    answered = False
+    try:
+        with trace.use_span(span, end_on_exit=False):
+            conversation, refined_questions, candidates = await _prepare_batch(user_id, session_id, questions, semaphore, db)
+
+        events: asyncio.Queue = asyncio.Queue()
+        answers = [None] * len(questions)
+        partial = [""] * len(questions)
+
+        async def answer(index: int):
+            async with semaphore:
+                try:
+                    with trace.use_span(span, end_on_exit=False):
+                        top_chunks = await rerank_chunks(refined_questions[index], candidates[index])
+                    async for word in _generate(span, refined_questions[index], top_chunks, conversation):
+                        partial[index] += word
+                        events.put_nowait({"index": index, "delta": word})
+                    answers[index] = partial[index]
+                    events.put_nowait({"index": index, "done": True})
+                except Exception as e:
+                    _record_failure(span, e)
+                    events.put_nowait({"index": index, "error": str(e)})
+
+        tasks = [asyncio.create_task(answer(index)) for index in range(len(questions))]
+        finished = 0
+        while finished < len(tasks):
+            event = await events.get()
+            if "delta" not in event:
+                finished += 1
+            yield _batch_event(event)
+        answered = True
+
+        messages = [
+            ChatMessage(question=question, refined_question=refined, answer=text.strip(), timestamp=datetime.utcnow())
+            for question, refined, text in zip(questions, refined_questions, answers)
+            if text is not None
+        ]
+        if messages:
+            with trace.use_span(span, end_on_exit=False):
+                await _save_messages(user_id, session_id, messages, db)
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # Finished answers are kept as they are, the ones still streaming as far as they got
+        if tasks and not answered:
+            messages = [
+                ChatMessage(
+                    question=question,
+                    refined_question=refined,
+                    answer=(text if text is not None else cut).strip(),
+                    timestamp=datetime.utcnow(),
+                    truncated=text is None
+                )
+                for question, refined, text, cut in zip(questions, refined_questions, answers, partial)
+                if text is not None or cut
+            ]
+            _save_truncated(span, "batch", user_id, session_id, messages, db)
+        raise
+    except Exception as e:
+        _record_failure(span, e)
+        yield _batch_event({"error": f"Internal error: {str(e)}"})
+    finally:
+        # The client went away: stop generating answers nobody will read
+        for task in tasks:
+            task.cancel()
+        STREAMS_IN_FLIGHT.labels("batch").dec()
+        span.end()
 
 
-    
 async def get_all_chats(user_id: str, session_id: str, db):
-    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
+    session = await _load_session(user_id, session_id, db)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
@@ -107,8 +297,8 @@ async def get_all_chats(user_id: str, session_id: str, db):
 
 
 
-async def generate_chat_summary_text(user_id: str, session_id: str, db):
-    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
+async def get_chat_transcript(user_id: str, session_id: str, db) -> str:
+    session = await _load_session(user_id, session_id, db)
     if not session or not session.get("messages"):
         raise ValueError("Session not found or has no messages.")
 
@@ -122,51 +312,4 @@ async def generate_chat_summary_text(user_id: str, session_id: str, db):
         if answer:
             chat_history += f"AI: {answer}\n\n"
 
-    prompt = f"""
-You are an AI assistant summarizing a conversation between a student and an AI tutor.
-
-Based on the following conversation:
-
-{chat_history}
-
-Generate a well-structured, friendly, and engaging summary using the format below:
-
-1. 🧭 **Objective of the Chat** – Briefly explain what the student was trying to learn or achieve.
-2. 📚 **Topics Discussed** – Use bullet points to list the main topics or questions covered during the chat.
-3. 💡 **Key Insights from the AI** – Summarize the most valuable responses or explanations from the AI, using bullet points for clarity.
-4. ✅ **Recommendations & Actionable Tips** – Provide concrete suggestions or next steps the student can follow, in bullet point format.
-5. 🌟 **Final Takeaway** – End with a short, motivational or friendly message that encourages the student to keep learning.
-
-Ensure the summary is clear, concise, and enjoyable to read in a PDF. Use bullet points wherever applicable to improve readability and structure.
-"""
-
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a helpful AI assistant that summarizes chat sessions for students."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.5,
-        max_tokens=600
-    )
-
-    return response.choices[0].message.content.strip()
-
-
-
-
-def summarize_with_gpt(raw_text: str) -> str:
-    if not raw_text.strip():
-        return "No text provided for summarization."
-
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant who summarizes texts."},
-            {"role": "user", "content": f"Summarize the following:\n\n{raw_text}"}
-        ],
-        temperature=0.5,
-        max_tokens=300
-    )
-
-    return response.choices[0].message.content.strip()
\ No newline at end of file
+    return chat_history.strip()
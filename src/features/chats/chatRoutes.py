@@ -1,17 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Header, WebSocket, Query, Request
 from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from opentelemetry import trace
 from src.database.db import get_database
-from .chatController import handle_user_query, get_all_chats, generate_chat_summary_text, handle_voice_query, summarize_with_gpt
-from src.utils.auth_utils import get_user_id_from_token
-from .utils import convert_speech_to_text, convert_text_to_speech, convert_any_audio_to_wav
-from .pdf import generate_enhanced_consultation_pdf
+from .chatController import handle_user_query, handle_batch_query, get_all_chats, get_chat_transcript, handle_voice_query
+from .chatSchema import BatchAskRequest
+from src.utils.auth_utils import get_user_id_from_token, get_current_user_id
+from .utils import convert_speech_to_text
+from .tts_cache import speak_cached, get_tts_cache, CACHE_FILENAME
+from .summary import generate_consultation_summary
+from .pdf_renderer import render_consultation_pdf, stream_pdf_bytes
+from .voice_stream import run_voice_session
 from datetime import datetime
-import subprocess
-import tempfile
-import requests
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
 # @router.post("/ask/{session_id}/{is_voice}")
@@ -57,28 +62,28 @@ router = APIRouter(prefix="/chat", tags=["Chat"])
 @router.post("/ask/{session_id}")
 async def unified_ask_handler(
     session_id: str,
-    authorization: str = Header(None),
+    request: Request,
+    user_id: str = Depends(get_current_user_id),
     question: str = Form(None),  # Optional
     audio_file: UploadFile = File(None),  # Optional
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    user_id = get_user_id_from_token(authorization)
-    print(f"🔐 User ID: {user_id}")
-    
+    # Shape of the request only: the user, the question and the answer are health data
+    span = trace.get_current_span()
+
     if audio_file:  # 🎙️ Voice-based query
-        print("🎙️ Voice query received")
-        print(f"📁 File: {audio_file.filename}, Content type: {audio_file.content_type}")
+        span.set_attribute("chat.input", "voice")
+        span.set_attribute("chat.audio_content_type", audio_file.content_type or "")
 
         text_query = await convert_speech_to_text(audio_file)
-        print(f"📄 Transcribed Text: {text_query}")
+        span.set_attribute("chat.transcript_chars", len(text_query))
 
         if not text_query.strip():
             raise HTTPException(status_code=400, detail="Transcription failed or empty")
 
         answer_text = await handle_voice_query(user_id, session_id, text_query, db)
-        print(f"🤖 Answer: {answer_text}")
 
-        tts_result = convert_text_to_speech(answer_text)
+        tts_result = await speak_cached(answer_text, request.base_url)
         if "error" in tts_result:
             raise HTTPException(status_code=500, detail=tts_result["error"])
 
@@ -90,7 +95,7 @@ async def unified_ask_handler(
         }
     
     elif question:  # 📄 Text-based query
-        print(f"💬 Text query: {question}")
+        span.set_attribute("chat.input", "text")
         return StreamingResponse(
             handle_user_query(user_id, session_id, question, db),
             media_type="text/plain"
@@ -108,29 +113,69 @@ async def unified_ask_handler(
 
 
 
+@router.post("/ask-batch/{session_id}")
+async def batch_ask_handler(
+    session_id: str,
+    payload: BatchAskRequest,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    questions = [question.strip() for question in payload.questions]
+    if not all(questions):
+        raise HTTPException(status_code=400, detail="Empty query not allowed")
+
+    return StreamingResponse(
+        handle_batch_query(user_id, session_id, questions, db),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.websocket("/voice-stream/{session_id}")
+async def voice_stream(
+    websocket: WebSocket,
+    session_id: str,
+    token: str = Query(None)  # Browsers can't set headers on a WebSocket handshake
+):
+    try:
+        user_id = get_user_id_from_token(websocket.headers.get("authorization") or f"Bearer {token}")
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    db = get_database()
+    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id, "deleted_at": None})
+    if not session:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    await run_voice_session(websocket, user_id, session_id, db)
+
+
 @router.post("/summarize/{session_id}")
 async def summarize_session_chat(
     session_id: str,
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db=Depends(get_database)
 ):
     try:
-        user_id = get_user_id_from_token(authorization)
-        summary_text = await generate_chat_summary_text(user_id, session_id, db)
-        pdf_stream = generate_enhanced_consultation_pdf(user_id, session_id, summary_text)
+        transcript = await get_chat_transcript(user_id, session_id, db)
+        summary = await generate_consultation_summary(user_id, session_id, transcript)
+        pdf_bytes = await render_consultation_pdf(user_id, session_id, summary)
 
         return StreamingResponse(
-            pdf_stream,
+            stream_pdf_bytes(pdf_bytes),
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f"attachment; filename=Summary_Of_Chat_{session_id}.pdf"
+                "Content-Disposition": f"attachment; filename=Summary_Of_Chat_{session_id}.pdf",
+                "Content-Length": str(len(pdf_bytes))
             }
         )
 
     except ValueError as ve:
         raise HTTPException(status_code=404, detail=str(ve))
     except Exception as e:
-        print(f"Summary generation error: {e}")
+        logger.exception("Summary generation failed")
         raise HTTPException(status_code=500, detail="Failed to generate chat summary PDF.")
         
 
@@ -138,40 +183,48 @@ async def summarize_session_chat(
 async def summarize_audio_file(
     session_id: str,
     audio_file: UploadFile = File(...),
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
     try:
-        user_id = get_user_id_from_token(authorization)
-
         transcript = await convert_speech_to_text(audio_file)
         if not transcript.strip():
             raise HTTPException(status_code=400, detail="Transcription failed or empty")
 
-        summary_text = summarize_with_gpt(raw_text=transcript)
-
-        pdf_stream = generate_enhanced_consultation_pdf(user_id, session_id, transcript)
+        summary = await generate_consultation_summary(user_id, session_id, transcript)
+        pdf_bytes = await render_consultation_pdf(user_id, session_id, summary)
 
         return StreamingResponse(
-            pdf_stream,
+            stream_pdf_bytes(pdf_bytes),
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f"attachment; filename=Summary_{session_id}.pdf"
+                "Content-Disposition": f"attachment; filename=Summary_{session_id}.pdf",
+                "Content-Length": str(len(pdf_bytes))
             }
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Audio summary error: {str(e)}")
 
 
 
+@router.get("/tts-audio/{filename}")
+async def tts_audio(filename: str):
+    # Cache entries are named by content hash, nothing else in the directory is reachable
+    path = get_tts_cache().path(filename)
+    if not CACHE_FILENAME.match(filename) or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return FileResponse(path)
+
+
 @router.get("/history/{session_id}")
 async def chat_history(
     session_id: str,
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_database)
 ):
-    user_id = get_user_id_from_token(authorization)
     return await get_all_chats(user_id, session_id, db)
 
 
@@ -1,11 +1,27 @@
 ### 📁 chatSchema.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
+from uuid import uuid4
 
 class ChatMessage(BaseModel):
     # user_id: str
     # session_id: str
+    # Lets a retried or replayed write recognise a message it already stored
+    message_id: str = Field(default_factory=lambda: uuid4().hex)
     question: str
     refined_question: str
     answer: str
-    timestamp: datetime 
\ No newline at end of file
+    timestamp: datetime 
+    # The client disconnected mid-answer, `answer` is what had been generated until then
+    truncated: bool = False
+
+class ConversationMemory(BaseModel):
+    # Running summary of every message before messages[summarized_count:]
+    summary: str = ""
+    summarized_count: int = 0
+    updated_at: Optional[datetime] = None
+
+
+class BatchAskRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=20)
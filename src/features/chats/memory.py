@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List
+
+from src.utils.metrics import LLM_REQUEST_DURATION, observe, record_token_usage, register_gauge
+from src.utils.services import get_openai_client
+from .chatSchema import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+# Number of most recent turns that are always sent verbatim
+MEMORY_RECENT_TURNS = int(os.getenv("MEMORY_RECENT_TURNS", "3"))
+# Long answers are clipped in the verbatim window, the summary keeps the gist
+MEMORY_MAX_ANSWER_CHARS = int(os.getenv("MEMORY_MAX_ANSWER_CHARS", "1200"))
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4o-mini")
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "400"))
+
+# One in-flight update per session; a new request waits for the previous one
+_memory_tasks: Dict[str, asyncio.Task] = {}
+register_gauge("memory_updates_pending", "Sessions with a conversation summary update queued", lambda: len(_memory_tasks))
+
+
+@dataclass
+class ConversationContext:
+    summary: str = ""
+    recent_turns: List[str] = field(default_factory=list)
+
+    def render(self) -> str:
+        if not self.summary and not self.recent_turns:
+            return "No previous chats."
+
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation:\n{self.summary}")
+        if self.recent_turns:
+            parts.append("Most recent turns:\n" + "\n".join(self.recent_turns))
+        return "\n\n".join(parts)
+
+
+def format_turn(message: dict) -> str:
+    question = message.get("question", "").strip()
+    answer = message.get("answer", "").strip()
+    if len(answer) > MEMORY_MAX_ANSWER_CHARS:
+        answer = answer[:MEMORY_MAX_ANSWER_CHARS].rstrip() + " …"
+    return f"User: {question}\nAI: {answer}"
+
+
+def build_conversation_context(session: dict) -> ConversationContext:
+    messages = session.get("messages", [])
+    memory = ConversationMemory(**(session.get("memory") or {}))
+
+    # Everything the summary hasn't absorbed yet stays verbatim, so a lagging
+    # background update never drops turns. The window is still capped.
+    start = min(memory.summarized_count, len(messages) - MEMORY_RECENT_TURNS)
+    start = max(start, len(messages) - 2 * MEMORY_RECENT_TURNS, 0)
+
+    return ConversationContext(
+        summary=memory.summary.strip(),
+        recent_turns=[format_turn(msg) for msg in messages[start:]]
+    )
+
+
+async def _fold_into_summary(previous_summary: str, messages: List[dict]) -> str:
+    transcript = "\n\n".join(format_turn(msg) for msg in messages)
+    prompt = f"""
+Update the running summary of a patient's conversation with a medical document assistant.
+
+Current summary:
+{previous_summary or "(empty)"}
+
+New turns to fold in:
+{transcript}
+
+Return only the updated summary in under 200 words. Keep facts the patient shared, documents and findings that were discussed, medications, dosages, lab values and open questions. Drop pleasantries and repetition.
+""".strip()
+
+    with observe(LLM_REQUEST_DURATION, model=MEMORY_SUMMARY_MODEL, operation="memory"):
+        response = await get_openai_client().chat.completions.create(
+            model=MEMORY_SUMMARY_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=MEMORY_SUMMARY_MAX_TOKENS
+        )
+    record_token_usage(MEMORY_SUMMARY_MODEL, "memory", response.usage)
+    return response.choices[0].message.content.strip()
+
+
+async def update_conversation_memory(user_id: str, session_id: str, db):
+    session = await db["sessions"].find_one(
+        {"session_id": session_id, "user_id": user_id},
+        {"messages": 1, "memory": 1}
+    )
+    if not session:
+        return
+
+    messages = session.get("messages", [])
+    memory = ConversationMemory(**(session.get("memory") or {}))
+
+    fold_until = len(messages) - MEMORY_RECENT_TURNS
+    if fold_until <= memory.summarized_count:
+        return
+
+    summary = await _fold_into_summary(memory.summary, messages[memory.summarized_count:fold_until])
+
+    updated = ConversationMemory(
+        summary=summary,
+        summarized_count=fold_until,
+        updated_at=datetime.utcnow()
+    )
+    await db["sessions"].update_one(
+        {"session_id": session_id, "user_id": user_id},
+        {"$set": {"memory": updated.dict()}}
+    )
+
+
+async def _run_after(previous: asyncio.Task, user_id: str, session_id: str, db):
+    if previous and not previous.done():
+        await asyncio.wait([previous])
+
+    try:
+        await update_conversation_memory(user_id, session_id, db)
+    except Exception as e:
+        logger.warning("Conversation memory update failed for session %s: %s", session_id, e)
+
+
+def schedule_memory_update(user_id: str, session_id: str, db):
+    """Refresh the session summary in the background once a turn is persisted."""
+    key = f"{user_id}:{session_id}"
+    task = asyncio.create_task(_run_after(_memory_tasks.get(key), user_id, session_id, db))
+    _memory_tasks[key] = task
+
+    def _forget(done: asyncio.Task):
+        if _memory_tasks.get(key) is done:
+            del _memory_tasks[key]
+
+    task.add_done_callback(_forget)
+    return task
@@ -0,0 +1,356 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+from opentelemetry import trace
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from src.utils.file_lock import lock_handle
+from src.utils.metrics import MESSAGE_FLUSH_SIZE, register_gauge
+from .memory import schedule_memory_update
+import asyncio
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# Worker processes serving the app (uvicorn and gunicorn both read it)
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# Chat messages are queued and written to their sessions in one bulk_write per interval; 0 writes each save through.
+# A read flushes only the queue of its own process, so with several workers the next turn of a session can
+# reach a worker that doesn't see the last one yet. There saves write through unless this is set, which
+# needs sticky sessions: the load balancer sends every request of a session to the same worker.
+MESSAGE_FLUSH_INTERVAL_MS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "250" if WEB_CONCURRENCY <= 1 else "0"))
+# Queued messages that trigger a flush without waiting for the interval
+MESSAGE_FLUSH_MAX = int(os.getenv("MESSAGE_FLUSH_MAX", "200"))
+MESSAGE_FLUSH_MAX_ATTEMPTS = int(os.getenv("MESSAGE_FLUSH_MAX_ATTEMPTS", "5"))
+# Directory for the write-ahead log, empty to keep queued messages in memory only.
+# With it a crash loses nothing: unflushed messages are replayed on the next startup.
+MESSAGE_WAL_DIR = os.getenv("MESSAGE_WAL_DIR", "").strip()
+MESSAGE_WAL_FSYNC = os.getenv("MESSAGE_WAL_FSYNC", "true").strip().lower() in ("1", "true", "yes")
+
+
+@dataclass
+class PendingMessage:
+    user_id: str
+    session_id: str
+    message: dict
+    attempts: int = 0
+    replayed: bool = False
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.user_id, self.session_id
+
+    @property
+    def group(self) -> tuple:
+        # A failed or crashed write may have gone through: such a message gets a push of its own,
+        # guarded by its id. Messages never written before share their session's push.
+        if self.attempts or self.replayed:
+            return self.user_id, self.session_id, self.message["message_id"]
+        return self.key
+
+
+class WriteAheadLog:
+    """
+    Queued messages as JSON lines, in segments. A flush seals the segment
+    being written and deletes it once Mongo has its messages. Each process
+    locks its own segments, so a worker starting next to running ones only
+    replays the segments of a process that died.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.prefix = f"messages-{os.getpid()}-{uuid4().hex[:8]}"
+        self.fsync = MESSAGE_WAL_FSYNC
+        self._sequence = 0
+        self._active = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, records: List[dict]):
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with self._lock:
+            if self._active is None:
+                self._sequence += 1
+                self._active = open(os.path.join(self.directory, f"{self.prefix}-{self._sequence:06d}.wal"), "a", encoding="utf-8")
+                lock_handle(self._active)
+            self._active.write(lines)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+
+    def seal(self):
+        """The segment written so far; later appends go to a new one."""
+        with self._lock:
+            segment, self._active = self._active, None
+        return segment
+
+    @staticmethod
+    def discard(segments):
+        for segment in segments:
+            segment.close()
+            try:
+                os.remove(segment.name)
+            except FileNotFoundError:
+                pass
+
+    def recover(self) -> Tuple[List[dict], list]:
+        """Records of segments left behind by dead processes, and the segments (locked by us until discarded)."""
+        records, segments = [], []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".wal") or name.startswith(self.prefix):
+                continue
+            segment = open(os.path.join(self.directory, name), "r+", encoding="utf-8")
+            if not lock_handle(segment, blocking=False):
+                segment.close()
+                continue
+            for line in segment:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line of a segment may have been cut off mid-write by the crash
+                    logger.warning("Skipping a damaged line in %s", name)
+            segments.append(segment)
+        return records, segments
+
+
+def _from_record(record: dict) -> PendingMessage:
+    message = dict(record["message"])
+    message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+    return PendingMessage(record["user_id"], record["session_id"], message, replayed=True)
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages. A save returns once the message
+    is queued (and logged, with MESSAGE_WAL_DIR), and every interval the
+    queue goes to Mongo as one bulk_write with a single $push per session.
+    Pushes are guarded by message_id, so a retried or replayed flush never
+    adds a message twice. Conversation memory is updated after the flush,
+    and readers of a session's messages call flush_session first.
+
+    The queue is per process: across workers a read sees queued messages
+    only if the session sticks to one worker (see MESSAGE_FLUSH_INTERVAL_MS).
+    """
+
+    def __init__(self, interval_ms: float = MESSAGE_FLUSH_INTERVAL_MS, max_pending: int = MESSAGE_FLUSH_MAX, wal_dir: str = MESSAGE_WAL_DIR):
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.wal = WriteAheadLog(wal_dir) if wal_dir else None
+        self._pending: List[PendingMessage] = []
+        # Segments whose messages are still pending after a failed flush
+        self._segments = []
+        # Sessions, and number of messages, of the flush being written
+        self._in_flight: set = set()
+        self._in_flight_count = 0
+        self._db = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def pending_count(self) -> int:
+        return len(self._pending) + self._in_flight_count
+
+    async def save(self, user_id: str, session_id: str, messages: List[dict], db):
+        entries = [PendingMessage(user_id, session_id, message) for message in messages]
+        if not self.running:
+            if await self._write(entries, db):
+                raise RuntimeError("Could not save the chat messages")
+            return
+
+        # Queued before it is logged: a flush that starts in between still writes it to Mongo,
+        # and a record landing in the next segment is harmless on replay
+        self._pending.extend(entries)
+        if self.wal is not None:
+            records = [{"user_id": user_id, "session_id": session_id, "message": message} for message in messages]
+            await asyncio.to_thread(self.wal.append, records)
+        if len(self._pending) >= self.max_pending:
+            self._wake.set()
+
+    async def flush_session(self, user_id: str, session_id: Optional[str] = None):
+        """
+        Make queued messages of the session (every session of the user without
+        one) visible to a read that follows. Only this process's queue.
+        """
+        keys = self._in_flight | {entry.key for entry in self._pending}
+        if any(user == user_id and session_id in (None, session) for user, session in keys):
+            await self.flush()
+
+    async def flush(self):
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._pending:
+                # Nothing queued, so whatever was logged meanwhile belongs to messages already written
+                # (a save queues its message before logging it, a flush may have taken it in between)
+                self._seal_segment()
+                await self._discard_segments()
+                return
+            # Taken together, without an await in between: every message in a sealed segment is in this batch
+            batch, self._pending = self._pending, []
+            self._seal_segment()
+            self._in_flight, self._in_flight_count = {entry.key for entry in batch}, len(batch)
+            try:
+                failed = await self._write(batch, self._db)
+            finally:
+                self._in_flight, self._in_flight_count = set(), 0
+
+            retry = []
+            for entry in failed:
+                entry.attempts += 1
+                if entry.attempts >= MESSAGE_FLUSH_MAX_ATTEMPTS:
+                    logger.error("Dropping message %s of session %s after %s failed writes", entry.message.get("message_id"), entry.session_id, entry.attempts)
+                else:
+                    retry.append(entry)
+            self._pending = retry + self._pending
+            if not retry:
+                # Everything sealed so far is in Mongo now
+                await self._discard_segments()
+
+    def _seal_segment(self):
+        if self.wal is not None:
+            segment = self.wal.seal()
+            if segment is not None:
+                self._segments.append(segment)
+
+    async def _discard_segments(self):
+        if self._segments:
+            segments, self._segments = self._segments, []
+            await asyncio.to_thread(WriteAheadLog.discard, segments)
+
+    async def _write(self, entries: List[PendingMessage], db) -> List[PendingMessage]:
+        """
+        One $push per session, and one per message for retries. A session's
+        pushes land in queue order. Returns the entries that didn't make it.
+        """
+        # Consecutive messages of a session share a push, the session's pushes keep their order
+        sessions: Dict[Tuple[str, str], List[List[PendingMessage]]] = {}
+        for entry in entries:
+            groups = sessions.setdefault(entry.key, [])
+            if groups and groups[-1][-1].group == entry.group:
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+
+        # Sessions with one push go out together, unordered. One with several (a retried message ahead of
+        # new ones) gets an ordered bulk_write of its own: a push that fails stops the later ones, instead
+        # of letting them land first.
+        single = [groups[0] for groups in sessions.values() if len(groups) == 1]
+        batches = [(single, False)] if single else []
+        batches += [(groups, True) for groups in sessions.values() if len(groups) > 1]
+
+        MESSAGE_FLUSH_SIZE.observe(len(entries))
+        operations = sum(len(groups) for groups, _ in batches)
+        with tracer.start_as_current_span("chat.persist", attributes={"chat.messages": len(entries), "chat.operations": operations}):
+            results = await asyncio.gather(*(self._push(groups, ordered, db) for groups, ordered in batches))
+
+        failed = [group for result in results for group in result]
+        failed_ids = {id(group) for group in failed}
+        written = {group[0].key for groups, _ in batches for group in groups if id(group) not in failed_ids}
+        for user_id, session_id in written:
+            schedule_memory_update(user_id, session_id, db)
+        return [entry for group in failed for entry in group]
+
+    async def _push(self, groups: List[List[PendingMessage]], ordered: bool, db) -> List[List[PendingMessage]]:
+        """One bulk_write, a $push per group. Returns the groups that didn't make it."""
+        operations = [
+            UpdateOne(
+                {
+                    "session_id": group[0].session_id,
+                    "user_id": group[0].user_id,
+                    "deleted_at": None,
+                    # Idempotent: skipped if an earlier attempt already pushed these messages
+                    "messages.message_id": {"$nin": [entry.message["message_id"] for entry in group]}
+                },
+                {
+                    "$push": {"messages": {"$each": [entry.message for entry in group]}},
+                    "$set": {"updated_at": datetime.utcnow()}
+                }
+            )
+            for group in groups
+        ]
+
+        failed = set()
+        try:
+            await db["sessions"].bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            if ordered and failed:
+                # An ordered write stops at its first error, the pushes after it never ran
+                failed = set(range(min(failed), len(operations)))
+            logger.warning("Writing chat messages failed for %s of %s operations", len(failed), len(operations))
+        except Exception as e:
+            failed = set(range(len(operations)))
+            logger.warning("Writing chat messages failed: %s", e)
+        return [groups[i] for i in sorted(failed)]
+
+    async def _recover(self):
+        records, segments = await asyncio.to_thread(self.wal.recover)
+        if not records:
+            await asyncio.to_thread(WriteAheadLog.discard, segments)
+            return
+        logger.info("Replaying %s chat messages from the write-ahead log", len(records))
+        # Queued, then re-logged under this process before the old segments go: a crash now loses nothing either
+        self._pending = [_from_record(record) for record in records] + self._pending
+        await asyncio.to_thread(self.wal.append, records)
+        await asyncio.to_thread(WriteAheadLog.discard, segments)
+
+    async def _run(self):
+        if self.wal is not None:
+            try:
+                await self._recover()
+            except Exception as e:
+                logger.warning("Replaying the message write-ahead log failed: %s", e)
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Flushing chat messages failed: %s", e)
+
+    def start(self, db):
+        if self._task is None and self.interval > 0:
+            if WEB_CONCURRENCY > 1:
+                logger.info("Chat messages are written behind in each of %s workers, sessions must be sticky to a worker", WEB_CONCURRENCY)
+            self._db = db
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush what is queued. Anything that still fails stays in the write-ahead log, if there is one."""
+        if self._task is None:
+            return
+        # Not cancelled: a flush being written finishes first
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error("%s chat messages could not be written at shutdown", len(self._pending))
+
+
+message_writer = MessageWriter()
+register_gauge("chat_messages_pending", "Chat messages queued for the next flush", message_writer.pending_count)
+
+
+def start_message_writer(db):
+    message_writer.start(db)
+
+
+async def stop_message_writer():
+    await message_writer.stop()
@@ -1,119 +1,52 @@
 import os
-import json
-import logging
-import re
+import copy
 from datetime import datetime
-from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from fontTools import ttLib
 from fpdf import FPDF
-from openai import OpenAI
+from fpdf.fonts import TTFFont, SubsetMap
 from io import BytesIO
+from .summary import EnhancedConsultationSummary
 
-# === CONFIG ===
-openai_api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=openai_api_key)
+# Layout only: fpdf is heavy, so this module is imported by the PDF worker processes, not the web app.
+# The summary itself comes from summary.py.
 
-# === DATA MODEL ===
-@dataclass
-class EnhancedConsultationSummary:
-    session_overview: str
-    conversation_highlights: Dict[str, str]
-    doctor_assessment: str
-    investigations_suggested: List[str]
-    medications_treatment: List[str]
-    action_items: List[str]
-    ai_summary_note: str
+# === FONT CACHE ===
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+FONT_FILES = {
+    '': 'DejaVuSans.ttf',
+    'B': 'DejaVuSans-Bold.ttf',
+    'I': 'DejaVuSans-Oblique.ttf',
+}
 
-# === OPENAI WRAPPER ===
-class OpenAISummaryGenerator:
-    def __init__(self, client: OpenAI):
-        self.client = client
+# fontkey -> (parsed TTFFont, raw font bytes), filled once per process
+_font_cache: Dict[str, Tuple[TTFFont, bytes]] = {}
 
-    def generate_consultation_summary(self, conversation_text: str, user_id: str, session_id: str) -> EnhancedConsultationSummary:
-        prompt = f"""
-        Please analyze the following patient-doctor conversation and generate a structured medical summary.
 
-        ⚠️ IMPORTANT: Only return a valid JSON response. DO NOT include any explanation, markdown, or commentary. No ```json or extra lines.
+def load_fonts() -> Dict[str, Tuple[TTFFont, bytes]]:
+    if not _font_cache:
+        loader = FPDF()
+        for style, filename in FONT_FILES.items():
+            path = os.path.join(FONT_DIR, filename)
+            loader.add_font('DejaVu', style, path)
+            with open(path, "rb") as f:
+                _font_cache[f"dejavu{style}"] = (loader.fonts[f"dejavu{style}"], f.read())
+    return _font_cache
 
-        Format strictly as:
-
-        {{
-            "session_overview": "...",
-            "conversation_highlights": {{
-                "patient_concerns": "...",
-                "doctor_inquiry": "...",
-                "key_observations": "...",
-                "doctor_explanation": "...",
-                "recommendations_given": "..."
-            }},
-            "doctor_assessment": "...",
-            "investigations_suggested": ["..."],
-            "medications_treatment": ["..."],
-            "action_items": ["..."],
-            "ai_summary_note": "..."
-        }}
-
-        If any section has no info, write: "No specific information discussed in this session".
-
-        CONVERSATION:
-        {conversation_text}
-        """
-
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a medical documentation assistant."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.3
-            )
-
-            raw_response = response.choices[0].message.content.strip()
-            print("\n🔍 Raw AI response:\n", raw_response)
-
-            match = re.search(r'\{[\s\S]*\}', raw_response)
-            if match:
-                try:
-                    summary_json = json.loads(match.group())
-                    return EnhancedConsultationSummary(**summary_json)
-                except json.JSONDecodeError as json_err:
-                    logging.error(f"❌ JSON decoding failed: {json_err}")
-            else:
-                logging.error("❌ No JSON object detected in OpenAI response.")
-
-        except Exception as e:
-            logging.error(f"❌ OpenAI API error: {e}")
-
-        return self._create_fallback_summary()
-
-    def _create_fallback_summary(self) -> EnhancedConsultationSummary:
-        return EnhancedConsultationSummary(
-            session_overview="This consultation session covered the patient's health concerns and the doctor's professional recommendations.",
-            conversation_highlights={
-                "patient_concerns": "Patient presented with general health concerns.",
-                "doctor_inquiry": "Doctor asked standard diagnostic questions.",
-                "key_observations": "No specific clinical observations documented.",
-                "doctor_explanation": "Doctor provided general guidance.",
-                "recommendations_given": "Standard advice shared."
-            },
-            doctor_assessment="General assessment based on symptoms.",
-            investigations_suggested=["No specific investigations mentioned"],
-            medications_treatment=["No specific medications discussed"],
-            action_items=["Follow general medical advice"],
-            ai_summary_note="This summary was auto-generated based on the input conversation."
-        )
 
 # === PDF GENERATOR ===
 class EnhancedConsultationPDF(FPDF):
     def __init__(self):
         super().__init__()
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        font_dir = os.path.join(base_dir, "fonts")
-        self.add_font('DejaVu', '', os.path.join(font_dir, 'DejaVuSans.ttf'), uni=True)
-        self.add_font('DejaVu', 'B', os.path.join(font_dir, 'DejaVuSans-Bold.ttf'), uni=True)
-        self.add_font('DejaVu', 'I', os.path.join(font_dir, 'DejaVuSans-Oblique.ttf'), uni=True)
+        # Reuse the metrics parsed by load_fonts(). output() subsets the fontTools
+        # object in place, so each document still gets its own lazy handle on the bytes.
+        for fontkey, (cached, font_bytes) in load_fonts().items():
+            font = copy.copy(cached)
+            font.i = len(self.fonts) + 1
+            font.ttfont = ttLib.TTFont(BytesIO(font_bytes), recalcTimestamp=False, fontNumber=0, lazy=True)
+            font.subset = SubsetMap(font)
+            font.missing_glyphs = []
+            self.fonts[fontkey] = font
         self.set_font("DejaVu", '', 10)
 
     def header(self):
@@ -231,12 +164,7 @@ class EnhancedConsultationPDF(FPDF):
 
 
 # === FINAL PDF WRAPPER ===
-def generate_enhanced_consultation_pdf(user_id: str, session_id: str, conversation_summary: str) -> BytesIO:
-    generator = OpenAISummaryGenerator(client)
-    summary: EnhancedConsultationSummary = generator.generate_consultation_summary(
-        conversation_summary, user_id, session_id
-    )
-
+def generate_enhanced_consultation_pdf(user_id: str, session_id: str, summary: EnhancedConsultationSummary) -> BytesIO:
     pdf = EnhancedConsultationPDF()
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=25)
@@ -0,0 +1,53 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Optional
+
+from .summary import EnhancedConsultationSummary
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _init_worker():
+    # fpdf is only imported here, in the workers. Parse the DejaVu fonts once, every PDF rendered by this worker reuses them
+    from .pdf import load_fonts
+    load_fonts()
+
+
+def _render(user_id: str, session_id: str, summary: EnhancedConsultationSummary) -> bytes:
+    from .pdf import generate_enhanced_consultation_pdf
+    return generate_enhanced_consultation_pdf(user_id, session_id, summary).getvalue()
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+    return _executor
+
+
+def shutdown_pdf_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def render_consultation_pdf(user_id: str, session_id: str, summary: EnhancedConsultationSummary) -> bytes:
+    """Lay out the PDF in a worker process so the event loop stays free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pdf_executor(), _render, user_id, session_id, summary)
+
+
+async def stream_pdf_bytes(pdf_bytes: bytes) -> AsyncIterator[bytes]:
+    view = memoryview(pdf_bytes)
+    for start in range(0, len(view), PDF_STREAM_CHUNK_SIZE):
+        yield bytes(view[start:start + PDF_STREAM_CHUNK_SIZE])
@@ -0,0 +1,103 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import List, Dict
+from pydantic import TypeAdapter, ValidationError
+from src.utils.metrics import LLM_REQUEST_DURATION, observe, record_token_usage
+from src.utils.services import get_openai_client
+
+# === CONFIG ===
+# JSON mode needs a model that supports response_format (gpt-4 does not)
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o")
+
+# === DATA MODEL ===
+@dataclass
+class EnhancedConsultationSummary:
+    session_overview: str
+    conversation_highlights: Dict[str, str]
+    doctor_assessment: str
+    investigations_suggested: List[str]
+    medications_treatment: List[str]
+    action_items: List[str]
+    ai_summary_note: str
+
+_summary_adapter = TypeAdapter(EnhancedConsultationSummary)
+
+# === OPENAI WRAPPER ===
+class OpenAISummaryGenerator:
+    def __init__(self, client):
+        self.client = client
+
+    async def generate_consultation_summary(self, conversation_text: str, user_id: str, session_id: str) -> EnhancedConsultationSummary:
+        prompt = f"""
+        Please analyze the following patient-doctor conversation and generate a structured medical summary.
+
+        Respond with a single JSON object with exactly these keys:
+
+        {{
+            "session_overview": "...",
+            "conversation_highlights": {{
+                "patient_concerns": "...",
+                "doctor_inquiry": "...",
+                "key_observations": "...",
+                "doctor_explanation": "...",
+                "recommendations_given": "..."
+            }},
+            "doctor_assessment": "...",
+            "investigations_suggested": ["..."],
+            "medications_treatment": ["..."],
+            "action_items": ["..."],
+            "ai_summary_note": "..."
+        }}
+
+        If any section has no info, write: "No specific information discussed in this session".
+
+        CONVERSATION:
+        {conversation_text}
+        """
+
+        try:
+            with observe(LLM_REQUEST_DURATION, model=SUMMARY_MODEL, operation="summary"):
+                response = await self.client.chat.completions.create(
+                    model=SUMMARY_MODEL,
+                    messages=[
+                        {"role": "system", "content": "You are a medical documentation assistant. You always answer in JSON."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format={"type": "json_object"},
+                    max_tokens=1500,
+                    temperature=0.3
+                )
+            record_token_usage(SUMMARY_MODEL, "summary", response.usage)
+
+            raw_response = response.choices[0].message.content
+            return _summary_adapter.validate_json(raw_response)
+
+        except ValidationError as e:
+            logging.error(f"❌ Summary JSON did not match the expected schema: {e}")
+        except Exception as e:
+            logging.error(f"❌ OpenAI API error: {e}")
+
+        return self._create_fallback_summary()
+
+    def _create_fallback_summary(self) -> EnhancedConsultationSummary:
+        return EnhancedConsultationSummary(
+            session_overview="This consultation session covered the patient's health concerns and the doctor's professional recommendations.",
+            conversation_highlights={
+                "patient_concerns": "Patient presented with general health concerns.",
+                "doctor_inquiry": "Doctor asked standard diagnostic questions.",
+                "key_observations": "No specific clinical observations documented.",
+                "doctor_explanation": "Doctor provided general guidance.",
+                "recommendations_given": "Standard advice shared."
+            },
+            doctor_assessment="General assessment based on symptoms.",
+            investigations_suggested=["No specific investigations mentioned"],
+            medications_treatment=["No specific medications discussed"],
+            action_items=["Follow general medical advice"],
+            ai_summary_note="This summary was auto-generated based on the input conversation."
+        )
+
+
+async def generate_consultation_summary(user_id: str, session_id: str, conversation_text: str) -> EnhancedConsultationSummary:
+    generator = OpenAISummaryGenerator(get_openai_client())
+    return await generator.generate_consultation_summary(conversation_text, user_id, session_id)
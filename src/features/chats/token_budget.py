@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+# tokenizer.json on disk takes precedence over a Hugging Face Hub id. Set it in production:
+# the Hub id is downloaded on first start, and counts are estimated until that finishes.
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", "").strip()
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "Xenova/gpt-4o")
+# Seconds before a failed tokenizer load is tried again
+TOKENIZER_RETRY_SECONDS = float(os.getenv("TOKENIZER_RETRY_SECONDS", "300"))
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "4000"))
+RERANK_CHUNK_MAX_TOKENS = int(os.getenv("RERANK_CHUNK_MAX_TOKENS", "200"))
+
+# A chunk is only cut to fit if at least this much of it survives
+MIN_PARTIAL_TOKENS = 64
+CHARS_PER_TOKEN = 4
+
+
+_tokenizer: Optional[Tokenizer] = None
+_loading = False
+_failed_at: Optional[float] = None
+_load_lock = threading.Lock()
+
+
+def _load_tokenizer():
+    global _tokenizer, _loading, _failed_at
+    source = TOKENIZER_PATH or TOKENIZER_NAME
+    try:
+        tokenizer = Tokenizer.from_file(TOKENIZER_PATH) if TOKENIZER_PATH else Tokenizer.from_pretrained(TOKENIZER_NAME)
+    except Exception as e:
+        logger.warning("Tokenizer %s unavailable (%s), estimating tokens from characters, retrying in %ss", source, e, TOKENIZER_RETRY_SECONDS)
+        with _load_lock:
+            _failed_at, _loading = time.monotonic(), False
+        return
+    with _load_lock:
+        _tokenizer, _failed_at, _loading = tokenizer, None, False
+    logger.info("Tokenizer %s loaded", source)
+
+
+def load_tokenizer():
+    """
+    Start loading the tokenizer on a background thread, unless it is loaded,
+    being loaded, or failed less than TOKENIZER_RETRY_SECONDS ago. Called at
+    startup; a download never runs on the event loop.
+    """
+    global _loading
+    with _load_lock:
+        if _tokenizer is not None or _loading:
+            return
+        if _failed_at is not None and time.monotonic() - _failed_at < TOKENIZER_RETRY_SECONDS:
+            return
+        _loading = True
+    threading.Thread(target=_load_tokenizer, name="tokenizer-load", daemon=True).start()
+
+
+def get_tokenizer() -> Optional[Tokenizer]:
+    """The tokenizer, or None while it isn't loaded: callers estimate tokens from characters meanwhile."""
+    if _tokenizer is None:
+        load_tokenizer()
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return [count_tokens(text) for text in texts]
+    return [len(enc.ids) for enc in tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+    encoding = tokenizer.encode(text, add_special_tokens=False)
+    if len(encoding.ids) <= max_tokens:
+        return text
+    return text[:encoding.offsets[max_tokens - 1][1]]
+
+
+@dataclass
+class BudgetedContext:
+    query: str
+    chunks: List[str] = field(default_factory=list)
+    recent_turns: List[str] = field(default_factory=list)
+    summary: str = ""
+    token_counts: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.token_counts.values())
+
+
+def assemble_context(
+    query: str,
+    chunks: List[str],
+    recent_turns: List[str],
+    summary: str,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    overhead: int = 0
+) -> BudgetedContext:
+    """
+    Fill `budget` tokens in priority order: query, chunks (in rank order),
+    recent turns (newest first) and finally the summary of older turns.
+    `overhead` is the cost of the prompt template around these parts.
+    """
+    remaining = budget - overhead
+
+    query_tokens = count_tokens(query)
+    if query_tokens > remaining:
+        query = truncate_to_tokens(query, remaining)
+        query_tokens = count_tokens(query)
+    remaining -= query_tokens
+
+    kept_chunks, chunk_tokens = [], 0
+    for chunk, tokens in zip(chunks, count_tokens_batch(chunks)):
+        if tokens > remaining:
+            if remaining >= MIN_PARTIAL_TOKENS:
+                chunk = truncate_to_tokens(chunk, remaining)
+                kept_chunks.append(chunk)
+                tokens = count_tokens(chunk)
+                chunk_tokens += tokens
+                remaining -= tokens
+            break
+        kept_chunks.append(chunk)
+        chunk_tokens += tokens
+        remaining -= tokens
+
+    kept_turns, turn_tokens = [], 0
+    for turn, tokens in reversed(list(zip(recent_turns, count_tokens_batch(recent_turns)))):
+        if tokens > remaining:
+            break
+        kept_turns.insert(0, turn)
+        turn_tokens += tokens
+        remaining -= tokens
+
+    summary_tokens = count_tokens(summary)
+    if summary_tokens > remaining:
+        summary = truncate_to_tokens(summary, remaining) if remaining >= MIN_PARTIAL_TOKENS else ""
+        summary_tokens = count_tokens(summary)
+
+    context = BudgetedContext(
+        query=query,
+        chunks=kept_chunks,
+        recent_turns=kept_turns,
+        summary=summary,
+        token_counts={
+            "overhead": overhead,
+            "query": query_tokens,
+            "chunks": chunk_tokens,
+            "recent_history": turn_tokens,
+            "older_history": summary_tokens
+        }
+    )
+
+    logger.info(
+        "Prompt tokens %d/%d (query=%d, chunks=%d [%d/%d kept], recent=%d [%d/%d kept], older=%d)",
+        context.total_tokens, budget, query_tokens,
+        chunk_tokens, len(kept_chunks), len(chunks),
+        turn_tokens, len(kept_turns), len(recent_turns),
+        summary_tokens
+    )
+    return context
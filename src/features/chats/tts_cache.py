@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from src.utils.metrics import register_gauge
+from src.utils.services import services
+from .utils import get_tts_http_client, synthesize_speech
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "./tts_cache")
+TTS_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024)
+# Voice configured on the /speak server, part of the key so a voice change never serves stale audio
+TTS_VOICE = os.getenv("TTS_VOICE", "default")
+# Prefix for the audio URLs handed to clients, e.g. https://api.example.com. Without it they
+# point at the host the client called, which is wrong only behind a proxy that rewrites it.
+TTS_PUBLIC_BASE_URL = os.getenv("TTS_PUBLIC_BASE_URL", "").rstrip("/")
+
+CACHE_FILENAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text: str, voice: str = TTS_VOICE) -> str:
+    return hashlib.sha256(f"{voice}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Content-addressed audio store on local disk with size-bounded LRU eviction."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (filename, size), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self._load_index()
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and CACHE_FILENAME.match(entry.name):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, filename, size in sorted(files):
+            self._entries[filename.split(".", 1)[0]] = (filename, size)
+            self._total_bytes += size
+        self._evict()
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def touch(self, filename: str) -> bool:
+        # Disk half of lookup(), safe to run in a worker thread. mtime doubles as the
+        # recency order when the index is rebuilt on start-up. False if the file is gone.
+        try:
+            os.utime(self.path(filename))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def discard(self, key: str, filename: str):
+        # Only if the entry still names that file, a new synthesis may have replaced it meanwhile
+        entry = self._entries.get(key)
+        if entry and entry[0] == filename:
+            self._forget(key)
+
+    def write_file(self, filename: str, audio: bytes):
+        # Disk half of store(), safe to run in a worker thread
+        tmp_path = self.path(f".{filename}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, self.path(filename))
+
+    def add(self, key: str, filename: str, size: int):
+        self._forget(key)
+        self._entries[key] = (filename, size)
+        self._total_bytes += size
+        self._evict()
+
+    def store(self, key: str, audio: bytes, extension: str) -> str:
+        filename = f"{key}.{extension}"
+        self.write_file(filename, audio)
+        self.add(key, filename, len(audio))
+        return filename
+
+    def _forget(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            _, (filename, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.path(filename))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+# Created on first use: the directory scan doesn't run, and the directory isn't created, on import
+services.register("tts_cache", lambda: TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES))
+
+
+def get_tts_cache() -> TTSCache:
+    return services.get("tts_cache")
+
+
+def _cache_stat(stat: str) -> int:
+    return get_tts_cache().stats()[stat] if "tts_cache" in services.created() else 0
+
+
+for _stat in ("hits", "misses", "evictions", "entries", "bytes"):
+    register_gauge(f"tts_cache_{_stat}", f"TTS cache {_stat} since start-up", lambda stat=_stat: _cache_stat(stat))
+
+
+def audio_url(filename: str, base_url) -> str:
+    """Absolute URL of a cached file, under TTS_PUBLIC_BASE_URL or the base URL of the client's request."""
+    base = TTS_PUBLIC_BASE_URL or str(base_url).rstrip("/")
+    if base.startswith("ws"):
+        # Asked over a WebSocket (ws:// or wss://), fetched over plain HTTP(S)
+        base = "http" + base[2:]
+    return f"{base}/chat/tts-audio/{filename}"
+
+
+def _cached_result(filename: str, cached: bool, base_url) -> dict:
+    return {
+        "message": "Speech generated successfully",
+        "file": filename,
+        "url": audio_url(filename, base_url),
+        "cached": cached
+    }
+
+
+async def _synthesize_into_cache(key: str, text: str) -> dict:
+    """{"file": cached filename} or {"error": ...}; shared by every caller asking for the same text."""
+    cache = get_tts_cache()
+    try:
+        result = await synthesize_speech(text)
+        if "error" in result:
+            return result
+
+        response = await get_tts_http_client().get(result["url"])
+        if response.status_code != 200:
+            return {"error": f"Audio download returned {response.status_code}"}
+
+        extension = os.path.splitext(result["file"])[1].lstrip(".").lower() or "wav"
+        filename = f"{key}.{extension}"
+        await asyncio.to_thread(cache.write_file, filename, response.content)
+        cache.add(key, filename, len(response.content))
+        return {"file": filename}
+
+    except Exception as e:
+        logger.warning("TTS synthesis failed: %s", e)
+        return {"error": str(e)}
+
+
+async def speak_cached(text: str, base_url) -> dict:
+    """
+    convert_text_to_speech with a disk cache in front of /speak. base_url
+    is that of the client's request (request.base_url), the audio URL in
+    the result is absolute.
+    """
+    cache = get_tts_cache()
+    key = cache_key(text)
+
+    filename = cache.lookup(key)
+    if filename:
+        if await asyncio.to_thread(cache.touch, filename):
+            cache.hits += 1
+            return _cached_result(filename, True, base_url)
+        # Removed from disk behind the cache's back, synthesize it again
+        cache.discard(key, filename)
+
+    # Identical phrases requested at the same time share one synthesis
+    inflight = cache.inflight.get(key)
+    if inflight is None:
+        cache.misses += 1
+        inflight = asyncio.ensure_future(_synthesize_into_cache(key, text))
+        cache.inflight[key] = inflight
+        inflight.add_done_callback(lambda _: cache.inflight.pop(key, None))
+    else:
+        cache.hits += 1
+
+    result = await asyncio.shield(inflight)
+    if "error" in result:
+        return result
+    return _cached_result(result["file"], False, base_url)
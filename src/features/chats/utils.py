@@ -1,36 +1,63 @@
 from fastapi import UploadFile, HTTPException
 from datetime import datetime
-from typing import List
-from openai import AsyncOpenAI
-from chromadb import Client
-from chromadb.config import Settings
+from typing import Collection, List, Optional, Tuple
 import os
 import requests
-import tempfile
 import base64
 import io
 import asyncio
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
-from openai.types.chat import ChatCompletionChunk
 import time
-import subprocess
 import mimetypes
 import httpx
-import requests
+import logging
+from dataclasses import replace
+from opentelemetry import trace
+from src.database.lexical_index import lexical_index
+from src.database.session_vectors import VECTOR_ENGINE, session_vectors
+from src.database.vector_store import vector_store
+from src.utils.embeddings import get_embedding_backend
+from src.utils.services import get_openai_client, services
+from src.utils.metrics import (
+    LLM_REQUEST_DURATION,
+    UPLOAD_SIZE,
+    observe,
+    record_token_usage
+)
+from .audio import probe_duration
+from .token_budget import (
+    RERANK_TOKEN_BUDGET,
+    RERANK_CHUNK_MAX_TOKENS,
+    assemble_context,
+    count_tokens,
+    truncate_to_tokens
+)
 
 load_dotenv()
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
 
-SPEAK_API_URL = "https://c96a-13-126-144-181.ngrok-free.app/speak"
+SPEAK_API_URL = os.getenv("SPEAK_API_URL", "https://c96a-13-126-144-181.ngrok-free.app/speak")
+DEEPGRAM_API_URL = os.getenv("DEEPGRAM_API_URL", "https://api.deepgram.com/v1/listen")
 
 RESEMBLE_API_KEY = os.getenv("RESEMBLE_API_KEY", "").strip()
 RESEMBLE_VOICE_UUID = os.getenv("RESEMBLE_VOICE_UUID", "").strip()
 RESEMBLE_PROJECT_UUID = os.getenv("RESEMBLE_PROJECT_UUID", "").strip()
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY", "").strip()
 
-chroma_client = Client(Settings())
-collection = chroma_client.get_or_create_collection("doc_chunks")
+STT_MAX_UPLOAD_BYTES = int(float(os.getenv("STT_MAX_UPLOAD_MB", "200")) * 1024 * 1024)
+STT_MAX_DURATION_SECONDS = float(os.getenv("STT_MAX_DURATION_SECONDS", "3600"))
+STT_READ_TIMEOUT_SECONDS = float(os.getenv("STT_READ_TIMEOUT_SECONDS", "300"))
+STT_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# hybrid fuses vector and BM25 rankings, vector is embeddings only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").strip().lower()
+VECTOR_CANDIDATES = 20
+LEXICAL_CANDIDATES = 20
+# Fused candidates handed to the reranker
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "8"))
+RRF_K = 60
 
 
 async def get_chat_history(user_id: str, session_id: str, db):
@@ -42,61 +69,172 @@ async def get_chat_history(user_id: str, session_id: str, db):
     return history
 
 
-async def refine_question(original_question: str, history: List[dict]) -> str:
-    chat_context = "\n".join([f"User: {msg['question']}\nAI: {msg['answer']}" for msg in history[-5:]])
+async def refine_question(original_question: str, chat_context: str) -> str:
     prompt = f"Refine the question based on previous conversation:\n{chat_context}\nUser: {original_question}"
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}]
-    )
+    with observe(LLM_REQUEST_DURATION, model="gpt-4o", operation="refine"):
+        response = await get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": prompt}]
+        )
+    record_token_usage("gpt-4o", "refine", response.usage)
     return response.choices[0].message.content.strip()
 
 
-async def retrieve_chunks(user_id: str, session_id: str, query: str):
-    query_embedding = (await client.embeddings.create(
-        input=query,
-        model="text-embedding-ada-002"
-    )).data[0].embedding
+async def _vector_search(model_name: str, user_id: str, session_id: str, query_embeddings) -> List[List[Tuple[str, str, str]]]:
+    """(chunk id, text, doc id) per query embedding, best match first."""
+    if VECTOR_ENGINE == "numpy":
+        if not await asyncio.to_thread(session_vectors.exists, model_name, user_id, session_id):
+            # Sessions ingested before the numpy engine was turned on are copied over from Chroma on first use
+            rows = await vector_store.get(
+                model_name,
+                where={"$and": [{"user_id": user_id}, {"session_id": session_id}]},
+                include=["embeddings", "documents", "metadatas"]
+            )
+            if len(rows["ids"]):
+                await asyncio.to_thread(
+                    session_vectors.add, model_name, user_id, session_id, rows["ids"], rows["embeddings"], rows["documents"], rows["metadatas"]
+                )
+        # Exact search over the session's own matrix, no metadata filtering needed
+        with tracer.start_as_current_span("session_vectors.query"):
+            return await asyncio.to_thread(_session_rankings, model_name, user_id, session_id, query_embeddings)
+
+    # Every query shares the session filter, so Chroma answers them all in one call,
+    # together with whatever other requests for this session arrive at the same time
+    with tracer.start_as_current_span("chroma.query", attributes={"chroma.n_results": VECTOR_CANDIDATES, "chroma.n_queries": len(query_embeddings)}):
+        raw_results = await vector_store.query(
+            model_name,
+            query_embeddings,
+            n_results=VECTOR_CANDIDATES,
+            where={"$and": [{"user_id": user_id}, {"session_id": session_id}]},
+            include=["documents", "metadatas"]
+        )
 
-    raw_results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=20,
-        where={"user_id": user_id}
+    return [
+        [(chunk_id, document, (meta or {}).get("doc_id")) for chunk_id, document, meta in zip(ids, documents, metadatas)]
+        for ids, documents, metadatas in zip(raw_results["ids"], raw_results["documents"], raw_results["metadatas"])
+    ]
+
+
+def _session_rankings(model_name: str, user_id: str, session_id: str, query_embeddings) -> List[List[Tuple[str, str, str]]]:
+    return [
+        [
+            (hit["id"], hit["document"], hit["metadata"].get("doc_id"))
+            for hit in session_vectors.query(model_name, user_id, session_id, embedding, k=VECTOR_CANDIDATES)
+        ]
+        for embedding in query_embeddings
+    ]
+
+
+async def _lexical_search(user_id: str, session_id: str, queries: List[str]) -> List[List[Tuple[str, str, str]]]:
+    if not await asyncio.to_thread(lexical_index.exists, user_id, session_id):
+        # Sessions ingested before the lexical index existed are indexed on first use
+        rows = await vector_store.get(where={"$and": [{"user_id": user_id}, {"session_id": session_id}]})
+        await asyncio.to_thread(lexical_index.add, user_id, session_id, rows["ids"], rows["documents"], rows["metadatas"])
+
+    return await asyncio.to_thread(_lexical_rankings, user_id, session_id, queries)
+
+
+def _lexical_rankings(user_id: str, session_id: str, queries: List[str]) -> List[List[Tuple[str, str, str]]]:
+    return [
+        [(hit["id"], hit["document"], hit["doc_id"]) for hit in lexical_index.search(user_id, session_id, query, k=LEXICAL_CANDIDATES)]
+        for query in queries
+    ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _live_hits(hits: List[Tuple[str, str, str]], live_doc_ids: Optional[Collection[str]]) -> List[Tuple[str, str, str]]:
+    # Chunks of a deleted document stay in the indexes until the purge job gets to them.
+    # Chunks without a doc_id predate per-document deletes and are always kept.
+    if live_doc_ids is None:
+        return hits
+    return [hit for hit in hits if hit[2] is None or hit[2] in live_doc_ids]
+
+
+async def search_session_chunks(
+    user_id: str,
+    session_id: str,
+    queries: List[str],
+    query_embeddings,
+    model_name: str,
+    live_doc_ids: Optional[Collection[str]] = None
+) -> List[List[str]]:
+    """Candidate chunks for each query, in query order, from the documents in live_doc_ids when given."""
+    if RETRIEVAL_MODE != "hybrid":
+        vector_results = await _vector_search(model_name, user_id, session_id, query_embeddings)
+        return [[document for _, document, _ in _live_hits(hits, live_doc_ids)] for hits in vector_results]
+
+    async def lexical():
+        with tracer.start_as_current_span("lexical.query"):
+            return await _lexical_search(user_id, session_id, queries)
+
+    vector_results, lexical_results = await asyncio.gather(
+        _vector_search(model_name, user_id, session_id, query_embeddings),
+        lexical()
     )
 
-    filtered_docs = []
-    metadatas = raw_results.get("metadatas", [[]])[0]
-    documents = raw_results.get("documents", [[]])[0]
+    # BM25 catches exact drug names, lab codes and dosages that embeddings blur
+    candidates = []
+    for vector_hits, lexical_hits in zip(vector_results, lexical_results):
+        vector_hits, lexical_hits = _live_hits(vector_hits, live_doc_ids), _live_hits(lexical_hits, live_doc_ids)
+        fused = reciprocal_rank_fusion([[chunk_id for chunk_id, _, _ in vector_hits], [chunk_id for chunk_id, _, _ in lexical_hits]])
+        documents = {chunk_id: document for chunk_id, document, _ in vector_hits + lexical_hits}
+        candidates.append([documents[chunk_id] for chunk_id in fused[:HYBRID_TOP_K]])
+    return candidates
 
-    for meta, doc in zip(metadatas, documents):
-        if meta.get("session_id") == session_id:
-            filtered_docs.append(doc)
 
-    return filtered_docs
+async def retrieve_chunks(user_id: str, session_id: str, query: str, live_doc_ids: Optional[Collection[str]] = None):
+    return (await retrieve_chunks_batch(user_id, session_id, [query], live_doc_ids))[0]
 
 
-async def rerank_chunks(query: str, chunks: List[str]) -> List[str]:
-    rerank_prompt = f"Query: {query}\n\nBelow are retrieved text chunks:\n\n" + "\n\n".join([f"[{i+1}] {c}" for i, c in enumerate(chunks)])
-    rerank_prompt += "\n\nRank the most relevant chunks by numbers (comma-separated):"
+async def retrieve_chunks_batch(user_id: str, session_id: str, queries: List[str], live_doc_ids: Optional[Collection[str]] = None) -> List[List[str]]:
+    backend = get_embedding_backend()
+    with tracer.start_as_current_span("chat.embed_query", attributes={"chat.queries": len(queries)}):
+        query_embeddings = await backend.embed(queries, operation="query")
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": rerank_prompt}]
-    )
-    ranked_indexes = [int(i.strip()) - 1 for i in response.choices[0].message.content.split(",") if i.strip().isdigit()]
+    return await search_session_chunks(user_id, session_id, queries, query_embeddings, backend.name, live_doc_ids)
 
-    return [chunks[i] for i in ranked_indexes[:3]]
 
+async def rerank_chunks(query: str, chunks: List[str]) -> List[str]:
+    if not chunks:
+        return []
+
+    header = f"Query: {query}\n\nBelow are retrieved text chunks:\n\n"
+    footer = "\n\nRank the most relevant chunks by numbers (comma-separated):"
+
+    # Ranking only needs the gist of each chunk, so clip them and stop once the budget is spent
+    remaining = RERANK_TOKEN_BUDGET - count_tokens(header + footer)
+    numbered = []
+    for i, chunk in enumerate(chunks):
+        entry = f"[{i+1}] {truncate_to_tokens(chunk, RERANK_CHUNK_MAX_TOKENS)}"
+        tokens = count_tokens(entry)
+        if tokens > remaining:
+            break
+        numbered.append(entry)
+        remaining -= tokens
+
+    rerank_prompt = header + "\n\n".join(numbered) + footer
+    logger.info("Rerank prompt tokens %d/%d (%d/%d chunks)", RERANK_TOKEN_BUDGET - remaining, RERANK_TOKEN_BUDGET, len(numbered), len(chunks))
+
+    with observe(LLM_REQUEST_DURATION, model="gpt-4o", operation="rerank"):
+        response = await get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "user", "content": rerank_prompt}]
+        )
+    record_token_usage("gpt-4o", "rerank", response.usage)
+    ranked_indexes = [int(i.strip()) - 1 for i in response.choices[0].message.content.split(",") if i.strip().isdigit()]
 
-async def generate_answer_streaming(query: str, context_chunks: List[str], history: List[dict]):
-    chat_context = "\n".join([
-        f"User: {msg['question']}\nAI: {msg['answer']}" for msg in history[-5:]
-    ]) if history else "No previous chats."
+    return [chunks[i] for i in ranked_indexes if 0 <= i < len(numbered)][:3]
 
-    document_context = "\n\n".join(context_chunks) if context_chunks else "No documents found."
 
-    prompt = f"""
+ANSWER_PROMPT_TEMPLATE = """
 You are a helpful AI assistant. Answer the user's question by considering both the prior conversation and relevant document context.
 
 ---
@@ -111,16 +249,43 @@ You are a helpful AI assistant. Answer the user's question by considering both t
 {query}
 """.strip()
 
+
+async def generate_answer_streaming(query: str, context_chunks: List[str], conversation):
+    """`conversation` is the session's ConversationContext (summary + recent turns)."""
+    overhead = count_tokens(ANSWER_PROMPT_TEMPLATE.format(chat_context="", document_context="", query=""))
+    budgeted = assemble_context(
+        query,
+        context_chunks,
+        conversation.recent_turns,
+        conversation.summary,
+        overhead=overhead
+    )
+
+    chat_context = replace(conversation, summary=budgeted.summary, recent_turns=budgeted.recent_turns).render()
+    document_context = "\n\n".join(budgeted.chunks) if budgeted.chunks else "No documents found."
+
+    prompt = ANSWER_PROMPT_TEMPLATE.format(
+        chat_context=chat_context,
+        document_context=document_context,
+        query=budgeted.query
+    )
+
     buffer = ""
+    started = time.perf_counter()
+    stream = None
 
     try:
-        stream = await client.chat.completions.create(
+        stream = await get_openai_client().chat.completions.create(
             model="gpt-4o",
             messages=[{"role": "user", "content": prompt}],
             stream=True,
+            stream_options={"include_usage": True}
         )
 
         async for chunk in stream:
+            # With include_usage the last chunk carries token counts and no choices
+            if chunk.usage:
+                record_token_usage("gpt-4o", "answer", chunk.usage)
             if not chunk.choices:
                 continue
 
@@ -138,6 +303,22 @@ You are a helpful AI assistant. Answer the user's question by considering both t
 
     except Exception as e:
         yield f"\n[Internal error: {str(e)}]"
+    finally:
+        LLM_REQUEST_DURATION.labels("gpt-4o", "answer").observe(time.perf_counter() - started)
+        if stream is not None:
+            # Dropping the connection is what stops OpenAI generating (and billing) the rest of an
+            # abandoned answer. Shielded: when the request is cancelled this await is cancelled too.
+            await asyncio.shield(stream.close())
+
+
+async def _iter_upload(audio_file: UploadFile):
+    sent = 0
+    while chunk := await audio_file.read(STT_UPLOAD_CHUNK_SIZE):
+        sent += len(chunk)
+        if sent > STT_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Audio file exceeds {STT_MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+        yield chunk
+    UPLOAD_SIZE.labels("audio").observe(sent)
 
 
 async def convert_speech_to_text(audio_file: UploadFile) -> str:
@@ -146,20 +327,27 @@ async def convert_speech_to_text(audio_file: UploadFile) -> str:
     if not mime_type:
         mime_type = "audio/wav"  # fallback
 
-    # Read file bytes
-    audio_bytes = await audio_file.read()
+    # Reject oversized or overlong recordings before anything is sent
+    if audio_file.size is not None and audio_file.size > STT_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio file exceeds {STT_MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
 
-    # Send to Deepgram
+    duration = probe_duration(audio_file.file)
+    if duration is not None and duration > STT_MAX_DURATION_SECONDS:
+        raise HTTPException(status_code=413, detail=f"Audio is longer than {int(STT_MAX_DURATION_SECONDS)} seconds")
+
+    await audio_file.seek(0)
+
+    # Send to Deepgram, streamed from the upload spool chunk by chunk
     headers = {
         "Authorization": f"Token {DEEPGRAM_API_KEY}",
         "Content-Type": mime_type
     }
 
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=STT_READ_TIMEOUT_SECONDS)) as client:
         response = await client.post(
-            "https://api.deepgram.com/v1/listen",
+            DEEPGRAM_API_URL,
             headers=headers,
-            content=audio_bytes
+            content=_iter_upload(audio_file)
         )
 
     if response.status_code != 200:
@@ -171,62 +359,50 @@ async def convert_speech_to_text(audio_file: UploadFile) -> str:
 
 
 
-def convert_text_to_speech(text: str) -> dict:
-    try:
-        # 🛰️ Send the text to your own FastAPI /speak endpoint (hosted on EC2)
-        response = requests.post(SPEAK_API_URL, json={"text": text})
+def _speech_result(status_code: int, text: str, data) -> dict:
+    if status_code != 200:
+        return {"error": f"API returned {status_code}: {text}"}
+
+    filename = data.get("file")
 
-        if response.status_code != 200:
-            return {"error": f"API returned {response.status_code}: {response.text}"}
+    if not filename:
+        return {"error": "No audio file returned by /speak API"}
 
-        data = response.json()
-        filename = data.get("file")
+    # 🧠 Construct audio URL
+    base_url = SPEAK_API_URL.rsplit("/speak", 1)[0]
+    download_url = f"{base_url}/static/{filename}"
 
-        if not filename:
-            return {"error": "No audio file returned by /speak API"}
+    return {
+        "message": "Speech generated successfully",
+        "file": filename,
+        "url": download_url
+    }
 
-        # 🧠 Construct audio URL
-        base_url = SPEAK_API_URL.rsplit("/speak", 1)[0]
-        download_url = f"{base_url}/static/{filename}"
 
-        return {
-            "message": "Speech generated successfully",
-            "file": filename,
-            "url": download_url
-        }
+def convert_text_to_speech(text: str) -> dict:
+    try:
+        # 🛰️ Send the text to your own FastAPI /speak endpoint (hosted on EC2)
+        response = requests.post(SPEAK_API_URL, json={"text": text})
+        data = response.json() if response.status_code == 200 else {}
+        return _speech_result(response.status_code, response.text, data)
 
     except Exception as e:
         print(f"Error during TTS forwarding: {e}")
         return {"error": str(e)}
 
 
+def get_tts_http_client() -> httpx.AsyncClient:
+    # Shared so sentence-by-sentence synthesis reuses one keep-alive connection
+    return services.get("tts_http")
 
-async def convert_any_audio_to_wav(audio_file: UploadFile) -> str:
-    try:
-        # Get extension (e.g., "webm", "mp3", "m4a")
-        original_ext = audio_file.filename.split('.')[-1].lower()
-
-        # Save uploaded file to temp path
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{original_ext}") as tmp_input:
-            tmp_input.write(await audio_file.read())
-            tmp_input_path = tmp_input.name
-
-        # Output .wav path
-        tmp_wav_path = tmp_input_path.rsplit(".", 1)[0] + ".wav"
-
-        # Convert using ffmpeg to 16kHz mono .wav (perfect for Whisper)
-        subprocess.run([
-            "ffmpeg", "-y",
-            "-i", tmp_input_path,
-            "-ar", "16000",
-            "-ac", "1",
-            tmp_wav_path
-        ], check=True)
-
-        # Clean input after conversion (optional)
-        os.remove(tmp_input_path)
 
-        return tmp_wav_path  # You can now use this for Whisper
+async def synthesize_speech(text: str) -> dict:
+    """Async twin of convert_text_to_speech, safe to call from the event loop."""
+    try:
+        response = await get_tts_http_client().post(SPEAK_API_URL, json={"text": text})
+        data = response.json() if response.status_code == 200 else {}
+        return _speech_result(response.status_code, response.text, data)
 
-    except subprocess.CalledProcessError:
-        raise HTTPException(status_code=400, detail="Audio conversion failed. Unsupported format or ffmpeg error.")
\ No newline at end of file
+    except Exception as e:
+        logger.warning("TTS forwarding failed: %s", e)
+        return {"error": str(e)}
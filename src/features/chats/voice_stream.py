@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from urllib.parse import urlencode
+
+import websockets
+from fastapi import WebSocket
+
+from src.utils.metrics import STREAMS_IN_FLIGHT
+from .chatController import handle_user_query
+from .utils import DEEPGRAM_API_KEY
+from .tts_cache import speak_cached
+
+logger = logging.getLogger(__name__)
+
+DEEPGRAM_STREAM_URL = os.getenv("DEEPGRAM_STREAM_URL", "wss://api.deepgram.com/v1/listen")
+DEEPGRAM_STREAM_PARAMS = {
+    "model": os.getenv("DEEPGRAM_STREAM_MODEL", "nova-2"),
+    "smart_format": "true",
+    "interim_results": "true",
+    "vad_events": "true",
+    "utterance_end_ms": os.getenv("DEEPGRAM_UTTERANCE_END_MS", "1000"),
+}
+# Deepgram drops idle streams after ~10 s without audio or a KeepAlive
+STT_KEEPALIVE_SECONDS = 5
+
+# Very short fragments ("Yes.", "2.") are merged with the next sentence before TTS
+MIN_TTS_CHARS = 24
+SENTENCE_END = re.compile(r"[.!?…]['\")\]]*\s")
+
+
+class ClientChannel:
+    """Serializes writes to the browser socket, several tasks push events into it."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self._lock = asyncio.Lock()
+
+    async def send(self, event_type: str, **payload):
+        async with self._lock:
+            await self.websocket.send_json({"type": event_type, **payload})
+
+
+def split_sentences(buffer: str):
+    """Return (complete sentences, remainder) for a growing answer buffer."""
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        if len(candidate) >= MIN_TTS_CHARS:
+            sentences.append(candidate)
+            start = match.end()
+    return sentences, buffer[start:]
+
+
+async def _send_audio_in_order(channel: ClientChannel, pending: asyncio.Queue):
+    # TTS for later sentences runs concurrently, playback order is kept here
+    while True:
+        item = await pending.get()
+        if item is None:
+            return
+        index, sentence, task = item
+        result = await task
+        if "error" in result:
+            await channel.send("error", detail=result["error"], sentence_index=index)
+        else:
+            await channel.send("audio", index=index, text=sentence, url=result["url"], file=result["file"])
+
+
+async def answer_utterance(channel: ClientChannel, question: str, user_id: str, session_id: str, db):
+    await channel.send("answer_start", question=question)
+
+    pending = asyncio.Queue()
+    sender = asyncio.create_task(_send_audio_in_order(channel, pending))
+    answer, buffer, index = "", "", 0
+
+    def speak(sentence: str):
+        nonlocal index
+        pending.put_nowait((index, sentence, asyncio.create_task(speak_cached(sentence, channel.websocket.base_url))))
+        index += 1
+
+    try:
+        async for word in handle_user_query(user_id, session_id, question, db):
+            answer += word
+            buffer += word
+            await channel.send("token", text=word)
+
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+                speak(sentence)
+
+        if buffer.strip():
+            speak(buffer.strip())
+
+        pending.put_nowait(None)
+        await sender
+    finally:
+        if not sender.done():
+            sender.cancel()
+
+    await channel.send("answer_end", answer=answer.strip())
+
+
+async def _answer_utterances(channel: ClientChannel, utterances: asyncio.Queue, user_id: str, session_id: str, db):
+    while True:
+        question = await utterances.get()
+        if question is None:
+            return
+        await answer_utterance(channel, question, user_id, session_id, db)
+
+
+async def _forward_transcripts(stt, channel: ClientChannel, utterances: asyncio.Queue):
+    finalized = []
+
+    def end_of_utterance():
+        question = " ".join(finalized).strip()
+        finalized.clear()
+        if question:
+            utterances.put_nowait(question)
+
+    async for raw in stt:
+        message = json.loads(raw)
+        message_type = message.get("type")
+
+        if message_type == "Results":
+            alternatives = message.get("channel", {}).get("alternatives", [])
+            text = alternatives[0].get("transcript", "") if alternatives else ""
+            is_final = message.get("is_final", False)
+            if text:
+                await channel.send("transcript", text=text, is_final=is_final)
+            if is_final and text:
+                finalized.append(text)
+            if message.get("speech_final"):
+                end_of_utterance()
+
+        elif message_type == "UtteranceEnd":
+            end_of_utterance()
+
+    # Stream closed, whatever was still being said counts as the last utterance
+    end_of_utterance()
+
+
+async def _forward_audio(websocket: WebSocket, stt) -> bool:
+    """Pump microphone frames to the STT stream. Returns False if the client vanished."""
+    while True:
+        try:
+            message = await asyncio.wait_for(websocket.receive(), timeout=STT_KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            await stt.send(json.dumps({"type": "KeepAlive"}))
+            continue
+
+        if message["type"] == "websocket.disconnect":
+            return False
+
+        if message.get("bytes"):
+            await stt.send(message["bytes"])
+        elif message.get("text"):
+            try:
+                control = json.loads(message["text"])
+            except json.JSONDecodeError:
+                continue
+            if control.get("type") == "stop":
+                await stt.send(json.dumps({"type": "CloseStream"}))
+                return True
+
+
+async def run_voice_session(websocket: WebSocket, user_id: str, session_id: str, db):
+    """
+    Full-duplex voice turn loop: microphone audio in, live transcripts out,
+    answer tokens and per-sentence TTS audio out as soon as each is ready.
+    """
+    channel = ClientChannel(websocket)
+    utterances = asyncio.Queue()
+    stt_url = f"{DEEPGRAM_STREAM_URL}?{urlencode(DEEPGRAM_STREAM_PARAMS)}"
+    STREAMS_IN_FLIGHT.labels("voice_session").inc()
+
+    try:
+        async with websockets.connect(stt_url, additional_headers={"Authorization": f"Token {DEEPGRAM_API_KEY}"}) as stt:
+            transcripts = asyncio.create_task(_forward_transcripts(stt, channel, utterances))
+            answers = asyncio.create_task(_answer_utterances(channel, utterances, user_id, session_id, db))
+
+            try:
+                client_connected = await _forward_audio(websocket, stt)
+                if not client_connected:
+                    return
+
+                await transcripts
+                utterances.put_nowait(None)
+                await answers
+            finally:
+                for task in (transcripts, answers):
+                    task.cancel()
+
+        await channel.send("done")
+        await websocket.close()
+
+    except Exception as e:
+        logger.warning("Voice stream for session %s failed: %s", session_id, e)
+        try:
+            await channel.send("error", detail=str(e))
+            await websocket.close(code=1011)
+        except Exception:
+            pass
+    finally:
+        STREAMS_IN_FLIGHT.labels("voice_session").dec()
@@ -1,34 +1,40 @@
-import cloudinary
-import cloudinary.uploader
-
-cloudinary.config(
-    cloud_name="dnd6asdiw",
-    api_key="284753554659585",
-    api_secret="661gxpTMdI_51oNw4YGacj6xqBg"
-)
-
 import hashlib
 from datetime import datetime
-from PyPDF2 import PdfReader
-from docx import Document as DocxReader
 from .Dschema import DocumentModel, DocumentMetadata
-from openai import OpenAI
+from .storage import get_storage
+from .dedup import deduplicate_chunks, save_signatures
 from io import BytesIO
-import chromadb
-from chromadb import PersistentClient
+from typing import List, Tuple
+from bisect import bisect_right
+from itertools import accumulate
 from bson import ObjectId
 from fastapi import HTTPException
 from dotenv import load_dotenv
+from opentelemetry import trace
+from src.database.lexical_index import lexical_index
+from src.database.session_vectors import VECTOR_ENGINE, session_vectors
+from src.database.vector_store import vector_store
+from src.features.sessions.deletion import pending_deletion
+from src.utils.embeddings import get_embedding_backend
+from src.utils.metrics import UPLOAD_SIZE
+import asyncio
+import json
 import os
 
 load_dotenv()
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
+tracer = trace.get_tracer(__name__)
+
+
+# PyPDF2 and python-docx are imported on the first upload, not at startup
+def _read_pdf(file_bytes: bytes):
+    from PyPDF2 import PdfReader
+    return PdfReader(BytesIO(file_bytes))
 
-client = OpenAI(api_key=openai_api_key)
 
-chroma_client = PersistentClient(path="./chroma_data")
-collection = chroma_client.get_or_create_collection(name="doc_chunks")
+def _read_docx(file_bytes: bytes):
+    from docx import Document as DocxReader
+    return DocxReader(BytesIO(file_bytes))
 
 
 async def generate_doc_id(file_bytes: bytes) -> str:
@@ -37,65 +43,77 @@ async def generate_doc_id(file_bytes: bytes) -> str:
 
 def get_page_count(file_bytes: bytes, file_type: str) -> int:
     if file_type == "application/pdf":
-        reader = PdfReader(BytesIO(file_bytes))
+        reader = _read_pdf(file_bytes)
         return len(reader.pages)
     elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        doc = DocxReader(BytesIO(file_bytes))
+        doc = _read_docx(file_bytes)
         return len(doc.paragraphs)
     return None
 
 
-def extract_text_chunks(file_bytes: bytes, file_type: str, chunk_size=500):
-    text = ""
+def extract_pages(file_bytes: bytes, file_type: str) -> List[str]:
+    """Text per page; a .docx has no pages and comes back as one."""
     if file_type == "application/pdf":
-        reader = PdfReader(BytesIO(file_bytes))
-        for page in reader.pages:
-            text += page.extract_text() or ""
+        reader = _read_pdf(file_bytes)
+        return [page.extract_text() or "" for page in reader.pages]
     elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        doc = DocxReader(BytesIO(file_bytes))
-        for para in doc.paragraphs:
-            text += para.text + "\n"
+        doc = _read_docx(file_bytes)
+        return ["".join(para.text + "\n" for para in doc.paragraphs)]
+    return []
+
+
+def chunk_pages(pages: List[str], chunk_size=500) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """Fixed-size chunks of the concatenated text, with the 1-based pages each one spans."""
+    text = "".join(pages)
+    page_starts = list(accumulate((len(page) for page in pages[:-1]), initial=0))
+    chunks, spans = [], []
+    for start in range(0, len(text), chunk_size):
+        chunk = text[start:start + chunk_size]
+        chunks.append(chunk)
+        spans.append((bisect_right(page_starts, start), bisect_right(page_starts, start + len(chunk) - 1)))
+    return chunks, spans
 
-    chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+
+def extract_text_chunks(file_bytes: bytes, file_type: str, chunk_size=500):
+    chunks, _ = chunk_pages(extract_pages(file_bytes, file_type), chunk_size)
     return chunks
 
 
 async def embed_chunks(chunks):
-    response = client.embeddings.create(
-        input=chunks,
-        model="text-embedding-ada-002"
-    )
-    embeddings = [item.embedding for item in response.data]
-    return embeddings
+    with tracer.start_as_current_span("doc.embed", attributes={"doc.chunk_count": len(chunks)}):
+        return await get_embedding_backend().embed(chunks)
 
+@tracer.start_as_current_span("doc.ingest")
 async def process_document(file, user_id: str, session_id: str, db):
-    file_bytes = await file.read()
-    doc_id = await generate_doc_id(file_bytes)
+    with tracer.start_as_current_span("doc.read_upload") as span:
+        file_bytes = await file.read()
+        doc_id = await generate_doc_id(file_bytes)
+        span.set_attribute("doc.file_size", len(file_bytes))
+        span.set_attribute("doc.content_type", file.content_type or "")
+    UPLOAD_SIZE.labels("document").observe(len(file_bytes))
 
     
     try:
-        if file.content_type == "application/pdf":
-            PdfReader(BytesIO(file_bytes))  
-        elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            DocxReader(BytesIO(file_bytes)) 
+        with tracer.start_as_current_span("doc.validate"):
+            if file.content_type == "application/pdf":
+                _read_pdf(file_bytes)  
+            elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+                _read_docx(file_bytes) 
     except Exception as e:
         return {"error": "Uploaded document is corrupted or unreadable.", "details": str(e)}
 
     
-    resource_type = "raw" if file.content_type in [
-        "application/pdf",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    ] else "auto"
-
-    upload_result = cloudinary.uploader.upload(
-        file=file_bytes,
-        folder=f"users/{user_id}/sessions/{session_id}",
-        public_id=doc_id,
-        resource_type=resource_type,
-        format="pdf" if file.content_type == "application/pdf" else None
-    )
-
-    cloudinary_url = upload_result.get("secure_url")
+    # Chunk ids are derived from the file, a purge still running would delete the new copy's chunks
+    if await pending_deletion(user_id, session_id, db, doc_id):
+        raise HTTPException(status_code=409, detail="This session or document is being deleted, try again shortly")
+
+    with tracer.start_as_current_span("doc.store_file"):
+        cloudinary_url = await get_storage().save(
+            file_bytes,
+            folder=f"users/{user_id}/sessions/{session_id}",
+            public_id=doc_id,
+            content_type=file.content_type
+        )
 
     
     metadata = DocumentMetadata(
@@ -115,34 +133,37 @@ async def process_document(file, user_id: str, session_id: str, db):
     )
 
     
-    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
-    if not session:
+    with tracer.start_as_current_span("doc.session_update"):
+        session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
+        if not session:
        
-        session_data = {
-            "session_id": session_id,
-            "user_id": user_id,
-            "documents": [document.dict()],
-            "messages": [],
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
-        await db["sessions"].insert_one(session_data)
-        doc_in_session = False
-    else:
+            session_data = {
+                "session_id": session_id,
+                "user_id": user_id,
+                "documents": [document.dict()],
+                "messages": [],
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+            await db["sessions"].insert_one(session_data)
+            doc_in_session = False
+        else:
         
-        doc_in_session = any(doc["doc_id"] == doc_id for doc in session.get("documents", []))
-        if not doc_in_session:
-            await db["sessions"].update_one(
-                {"session_id": session_id, "user_id": user_id},
-                {
-                    "$push": {"documents": document.dict()},
-                    "$set": {"updated_at": datetime.utcnow()}
-                }
-            )
+            doc_in_session = any(doc["doc_id"] == doc_id for doc in session.get("documents", []))
+            if not doc_in_session:
+                await db["sessions"].update_one(
+                    {"session_id": session_id, "user_id": user_id},
+                    {
+                        "$push": {"documents": document.dict()},
+                        "$set": {"updated_at": datetime.utcnow()}
+                    }
+                )
 
     if not doc_in_session:
         
-        chunks = extract_text_chunks(file_bytes, file.content_type)
+        with tracer.start_as_current_span("doc.extract_text") as span:
+            chunks, page_spans = chunk_pages(extract_pages(file_bytes, file.content_type))
+            span.set_attribute("doc.chunk_count", len(chunks))
 
         if not chunks or all(chunk.strip() == "" for chunk in chunks):
             return {
@@ -153,27 +174,52 @@ async def process_document(file, user_id: str, session_id: str, db):
                 "chunk_ids": []
             }
 
-        embeddings = await embed_chunks(chunks)
         chunk_ids = [f"{doc_id}_chunk_{i}_session_{session_id}" for i in range(len(chunks))]
+        with tracer.start_as_current_span("doc.dedup") as span:
+            dedup = await deduplicate_chunks(user_id, session_id, chunk_ids, chunks, db)
+            span.set_attribute("doc.duplicate_chunks", len(dedup.duplicates))
 
-        collection.add(
-            ids=chunk_ids,
-            documents=chunks,
-            metadatas=[{
-                "doc_id": doc_id,
-                "user_id": user_id,
-                "session_id": session_id,
-                "chunk_index": i
-            } for i in range(len(chunks))],
-            embeddings=embeddings
-        )
+        embedding_model = get_embedding_backend().name
+        chunk_metadatas = [{
+            "doc_id": doc_id,
+            "user_id": user_id,
+            "session_id": session_id,
+            "chunk_index": i,
+            "embedding_model": embedding_model,
+            **({"page": page_spans[i][0], "page_end": page_spans[i][1]} if file.content_type == "application/pdf" else {})
+        } for i in range(len(chunks))]
+
+        # Near-duplicates of chunks already in the session are linked, not embedded again
+        kept_ids = [chunk_ids[i] for i in dedup.kept]
+        kept_chunks = [chunks[i] for i in dedup.kept]
+        kept_metadatas = [chunk_metadatas[i] for i in dedup.kept]
+
+        if kept_chunks:
+            embeddings = await embed_chunks(kept_chunks)
+
+            with tracer.start_as_current_span("chroma.add", attributes={"doc.chunk_count": len(kept_chunks)}):
+                await vector_store.add(embedding_model, kept_ids, kept_chunks, kept_metadatas, embeddings)
+
+            with tracer.start_as_current_span("lexical.add"):
+                await asyncio.to_thread(lexical_index.add, user_id, session_id, kept_ids, kept_chunks, kept_metadatas)
+
+            if VECTOR_ENGINE == "numpy":
+                with tracer.start_as_current_span("session_vectors.add"):
+                    await asyncio.to_thread(
+                        session_vectors.add,
+                        embedding_model, user_id, session_id, kept_ids, embeddings, kept_chunks, kept_metadatas
+                    )
+
+        await save_signatures(user_id, session_id, doc_id, embedding_model, dedup, chunks, chunk_metadatas, db)
 
         return {
             "message": "Document processed and embedded",
             "doc_id": doc_id,
             "cloudinary_url": cloudinary_url,
-            "chunk_count": len(chunks),
-            "chunk_ids": chunk_ids
+            "chunk_count": len(kept_ids),
+            "chunk_ids": kept_ids,
+            "duplicate_chunk_count": len(dedup.duplicates),
+            "dedup_ratio": dedup.ratio
         }
     else:
         
@@ -188,49 +234,72 @@ async def process_document(file, user_id: str, session_id: str, db):
 
 
 
-async def delete_document(doc_id: str, session_id: str, db):
-    session = await db["sessions"].find_one({"session_id": session_id})
+async def get_documents_by_user(user_id: str, session_id: str, db):
+    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id, "deleted_at": None})
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    document = next((doc for doc in session.get("documents", []) if doc["doc_id"] == doc_id), None)
-    if not document:
-        raise HTTPException(status_code=404, detail="Document not found in session")
+    return session.get("documents", [])
 
-    try:
-        cloudinary.uploader.destroy(
-            public_id=f"users/{session['user_id']}/sessions/{session_id}/{doc_id}",
-            resource_type="raw"
-        )
-    except Exception as e:
-        print(f"Error deleting from Cloudinary: {e}")
 
-    await db["sessions"].update_one(
-        {"session_id": session_id},
-        {
-            "$pull": {"documents": {"doc_id": doc_id}},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
+async def _chunk_page(doc_id: str, user_id: str, session_id: str, offset: int, limit: int, include_text: bool) -> List[dict]:
+    # Chroma applies the filter and the window, only the requested rows leave the store
+    include = ["metadatas", "documents"] if include_text else ["metadatas"]
+    rows = await vector_store.get(
+        where={"$and": [{"doc_id": doc_id}, {"user_id": user_id}, {"session_id": session_id}]},
+        offset=offset,
+        limit=limit,
+        include=include
     )
 
-    raw_chunks = collection.get(where={"doc_id": doc_id})
-    delete_ids = [
-        raw_chunks["ids"][i]
-        for i, meta in enumerate(raw_chunks["metadatas"])
-        if meta.get("session_id") == session_id
-    ]
-    if delete_ids:
-        collection.delete(ids=delete_ids)
+    chunks = []
+    for i, chunk_id in enumerate(rows["ids"]):
+        chunk = {"chunk_id": chunk_id, "metadata": rows["metadatas"][i]}
+        if include_text:
+            chunk["document"] = rows["documents"][i]
+        chunks.append(chunk)
+    return chunks
+
+
+async def _require_document(doc_id: str, user_id: str, session_id: str, db):
+    session = await db["sessions"].find_one(
+        {"session_id": session_id, "user_id": user_id, "deleted_at": None, "documents.doc_id": doc_id},
+        {"_id": 1}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Document not found in session")
+
+
+async def get_document_chunks(doc_id: str, user_id: str, session_id: str, offset: int, limit: int, include_text: bool, db) -> dict:
+    await _require_document(doc_id, user_id, session_id, db)
+
+    # One extra row tells us whether another page follows
+    chunks = await _chunk_page(doc_id, user_id, session_id, offset, limit + 1, include_text)
+    has_more = len(chunks) > limit
+    chunks = chunks[:limit]
 
     return {
-        "message": f"Deleted document and {len(delete_ids)} chunks",
-        "doc_id": doc_id
+        "doc_id": doc_id,
+        "offset": offset,
+        "limit": limit,
+        "chunk_count": len(chunks),
+        "next_offset": offset + limit if has_more else None,
+        "chunks": chunks
     }
 
 
-async def get_documents_by_user(user_id: str, session_id: str, db):
-    session = await db["sessions"].find_one({"session_id": session_id, "user_id": user_id})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def stream_document_chunks(doc_id: str, user_id: str, session_id: str, offset: int, batch_size: int, include_text: bool, db):
+    """Every chunk from offset on as NDJSON, read from the store batch_size at a time."""
+    await _require_document(doc_id, user_id, session_id, db)
 
-    return session.get("documents", [])
+    async def lines():
+        position = offset
+        while True:
+            chunks = await _chunk_page(doc_id, user_id, session_id, position, batch_size, include_text)
+            for chunk in chunks:
+                yield json.dumps(chunk) + "\n"
+            if len(chunks) < batch_size:
+                return
+            position += batch_size
+
+    return lines()
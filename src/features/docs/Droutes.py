@@ -1,10 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Header
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from .Dcontroller import process_document, delete_document, get_documents_by_user, collection
-from src.utils.auth_utils import get_user_id_from_token
+from .Dcontroller import process_document, get_documents_by_user, get_document_chunks, stream_document_chunks
+from .search import search_user_documents
+from src.features.sessions.deletion import request_document_deletion
+from src.utils.auth_utils import get_current_user_id
+from src.utils.metrics import INGESTION_DURATION, observe
 
 router = APIRouter(prefix="/doc", tags=["Doc"])
 
+CHUNK_PAGE_MAX = 500
+
 
 def get_db():
     from src.database.db import get_database
@@ -15,76 +21,70 @@ def get_db():
 async def upload_document(
     session_id: str,
     file: UploadFile = File(...),
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    user_id = get_user_id_from_token(authorization)
-
     if file.content_type not in [
         "application/pdf",
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     ]:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
-    return await process_document(file, user_id, session_id, db)
+    with observe(INGESTION_DURATION):
+        return await process_document(file, user_id, session_id, db)
 
 
-@router.delete("/delete-document/{doc_id}/{session_id}")
+@router.delete("/delete-document/{doc_id}/{session_id}", status_code=202)
 async def delete_doc(
     doc_id: str,
     session_id: str,
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    _ = get_user_id_from_token(authorization)
-    return await delete_document(doc_id, session_id, db)
+    return await request_document_deletion(user_id, session_id, doc_id, db)
 
 
 @router.get("/list-documents/{session_id}")
 async def list_documents(
     session_id: str,
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    user_id = get_user_id_from_token(authorization)
     docs = await get_documents_by_user(user_id, session_id, db)
     return {"documents": docs}
 
-@router.get("/debug-chunks/{doc_id}/{session_id}")
-async def debug_chunks(
-    doc_id: str,
-    session_id: str,
-    authorization: str = Header(None)
+@router.get("/search")
+async def search_documents(
+    q: str = Query(..., min_length=1, max_length=500),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(10, ge=1, le=50),
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    user_id = get_user_id_from_token(authorization)
-
-    try:
-        results = collection.get(where={"doc_id": doc_id})
-
-        filtered_chunks = []
-        for i, metadata in enumerate(results.get("metadatas", [])):
-            if (
-                metadata.get("session_id") == session_id
-                and metadata.get("user_id") == user_id
-            ):
-                filtered_chunks.append({
-                    "chunk_id": results["ids"][i],
-                    "document": results["documents"][i],
-                    "metadata": metadata
-                })
-
-        if not filtered_chunks:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No chunks found for doc_id: {doc_id}, session_id: {session_id}, and user_id: {user_id}"
-            )
-
-        return {
-            "chunk_count": len(filtered_chunks),
-            "chunks": filtered_chunks
-        }
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    """Search all of the user's documents, across sessions."""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty query not allowed")
+    return await search_user_documents(user_id, q.strip(), offset, limit, db)
 
 
+@router.get("/chunks/{doc_id}/{session_id}")
+async def document_chunks(
+    doc_id: str,
+    session_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=CHUNK_PAGE_MAX),
+    include_text: bool = True,
+    stream: bool = False,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Indexed chunks of one document, `limit` at a time from `offset`.
+    With stream=true every chunk from `offset` on is sent as NDJSON,
+    fetched `limit` at a time, instead of a single page.
+    """
+    if stream:
+        lines = await stream_document_chunks(doc_id, user_id, session_id, offset, limit, include_text, db)
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    return await get_document_chunks(doc_id, user_id, session_id, offset, limit, include_text, db)
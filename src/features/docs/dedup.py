@@ -0,0 +1,233 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+from src.database.lexical_index import lexical_index
+from src.database.session_vectors import VECTOR_ENGINE, session_vectors
+from src.database.vector_store import vector_store
+import asyncio
+import os
+import re
+
+import mmh3
+import numpy as np
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Estimated Jaccard similarity of word 3-gram sets above which a chunk counts as a duplicate
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+
+MINHASH_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above ~0.7 similarity share a band with high probability
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 3
+_PRIME = np.uint64(4294967311)
+
+_rng = np.random.default_rng(20240611)
+_A = _rng.integers(1, 2 ** 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+WORD_PATTERN = re.compile(r"\w+")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+@dataclass
+class ChunkSignature:
+    index: int
+    chunk_id: str
+    signature: Optional[np.ndarray]
+    bands: List[str] = field(default_factory=list)
+    # Hash of the numbers in the chunk: a report with different lab values is never a duplicate
+    numbers: int = 0
+    duplicate_of: Optional[str] = None
+
+
+@dataclass
+class DedupResult:
+    signatures: List[ChunkSignature]
+
+    @property
+    def kept(self) -> List[int]:
+        return [s.index for s in self.signatures if s.duplicate_of is None]
+
+    @property
+    def duplicates(self) -> List[ChunkSignature]:
+        return [s for s in self.signatures if s.duplicate_of is not None]
+
+    @property
+    def ratio(self) -> float:
+        return round(len(self.duplicates) / len(self.signatures), 4) if self.signatures else 0.0
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    words = WORD_PATTERN.findall(text.lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((mmh3.hash(s, signed=False) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # (a * h + b) mod p for every permutation at once; a, h < 2**32 keeps the product inside uint64
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def band_keys(signature: np.ndarray) -> List[str]:
+    return [
+        f"{band}:{mmh3.hash_bytes(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()).hex()}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+def number_fingerprint(text: str) -> int:
+    return mmh3.hash(" ".join(sorted(NUMBER_PATTERN.findall(text))), signed=False)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+
+def sign_chunks(chunk_ids: List[str], chunks: List[str]) -> List[ChunkSignature]:
+    signatures = []
+    for index, (chunk_id, text) in enumerate(zip(chunk_ids, chunks)):
+        signature = minhash(text)
+        signatures.append(ChunkSignature(
+            index=index,
+            chunk_id=chunk_id,
+            signature=signature,
+            bands=band_keys(signature) if signature is not None else [],
+            numbers=number_fingerprint(text)
+        ))
+    return signatures
+
+
+def _link_duplicates(signatures: List[ChunkSignature], existing: List[dict]):
+    # band key -> canonical chunks seen so far, from earlier uploads and then from this one
+    buckets: Dict[str, List[ChunkSignature]] = {}
+    for record in existing:
+        canonical = ChunkSignature(
+            index=-1,
+            chunk_id=record["chunk_id"],
+            signature=np.array(record["signature"], dtype=np.uint64),
+            numbers=record["numbers"]
+        )
+        for key in record["bands"]:
+            buckets.setdefault(key, []).append(canonical)
+
+    for chunk in signatures:
+        if chunk.signature is None:
+            continue
+        candidates = {c.chunk_id: c for key in chunk.bands for c in buckets.get(key, [])}
+        match = next((
+            c for c in candidates.values()
+            if c.numbers == chunk.numbers and similarity(c.signature, chunk.signature) >= DEDUP_THRESHOLD
+        ), None)
+        if match is not None:
+            chunk.duplicate_of = match.chunk_id
+            continue
+        for key in chunk.bands:
+            buckets.setdefault(key, []).append(chunk)
+
+
+async def deduplicate_chunks(user_id: str, session_id: str, chunk_ids: List[str], chunks: List[str], db) -> DedupResult:
+    """
+    MinHash every chunk and link near-duplicates to a chunk already in the
+    session (or earlier in this upload). Only chunks left unlinked need to
+    be embedded and indexed.
+    """
+    signatures = await asyncio.to_thread(sign_chunks, chunk_ids, chunks)
+    if not DEDUP_ENABLED:
+        return DedupResult(signatures)
+
+    keys = sorted({key for s in signatures for key in s.bands})
+    existing = await db["chunk_signatures"].find(
+        {"user_id": user_id, "session_id": session_id, "duplicate_of": None, "bands": {"$in": keys}},
+        {"chunk_id": 1, "signature": 1, "bands": 1, "numbers": 1}
+    ).to_list(length=None) if keys else []
+
+    _link_duplicates(signatures, existing)
+    return DedupResult(signatures)
+
+
+async def save_signatures(user_id: str, session_id: str, doc_id: str, embedding_model: str, result: DedupResult, chunks: List[str], metadatas: List[dict], db):
+    records = [{
+        "user_id": user_id,
+        "session_id": session_id,
+        "doc_id": doc_id,
+        "chunk_id": s.chunk_id,
+        "signature": s.signature.tolist() if s.signature is not None else [],
+        "bands": s.bands,
+        "numbers": s.numbers,
+        "duplicate_of": s.duplicate_of,
+        # Linked chunks keep their own text and metadata, they take over if the original is deleted
+        "document": chunks[s.index] if s.duplicate_of else None,
+        "metadata": metadatas[s.index] if s.duplicate_of else None,
+        "embedding_model": embedding_model,
+        "created_at": datetime.utcnow()
+    } for s in result.signatures]
+    if records:
+        await db["chunk_signatures"].insert_many(records)
+
+
+async def promote_duplicates(user_id: str, session_id: str, doc_ids: List[str], db) -> int:
+    """
+    Before doc_ids are deleted, give chunks of other documents that were
+    linked to theirs a place in the indexes, reusing the original's vector.
+    """
+    signatures = db["chunk_signatures"]
+    originals = await signatures.find(
+        {"user_id": user_id, "session_id": session_id, "doc_id": {"$in": doc_ids}, "duplicate_of": None},
+        {"chunk_id": 1}
+    ).to_list(length=None)
+    if not originals:
+        return 0
+
+    links = await signatures.find({
+        "user_id": user_id,
+        "session_id": session_id,
+        "doc_id": {"$nin": doc_ids},
+        "duplicate_of": {"$in": [record["chunk_id"] for record in originals]}
+    }).to_list(length=None)
+
+    by_model: Dict[str, List[dict]] = {}
+    for link in links:
+        by_model.setdefault(link["embedding_model"], []).append(link)
+
+    for model, model_links in by_model.items():
+        found = await vector_store.get(model, ids=sorted({link["duplicate_of"] for link in model_links}), include=["embeddings"])
+        vectors = dict(zip(found["ids"], found["embeddings"]))
+        model_links = [link for link in model_links if link["duplicate_of"] in vectors]
+        if not model_links:
+            continue
+
+        ids = [link["chunk_id"] for link in model_links]
+        documents = [link["document"] for link in model_links]
+        metadatas = [link["metadata"] for link in model_links]
+        embeddings = [vectors[link["duplicate_of"]] for link in model_links]
+        # upsert: a retried deletion job may have promoted some of these already
+        await vector_store.upsert(model, ids, documents, metadatas, embeddings)
+        await asyncio.to_thread(lexical_index.add, user_id, session_id, ids, documents, metadatas)
+        if VECTOR_ENGINE == "numpy":
+            await asyncio.to_thread(session_vectors.add, model, user_id, session_id, ids, embeddings, documents, metadatas)
+
+        await signatures.update_many(
+            {"user_id": user_id, "session_id": session_id, "chunk_id": {"$in": ids}},
+            {"$set": {"duplicate_of": None, "document": None, "metadata": None}}
+        )
+    return len(links)
+
+
+async def delete_signatures(user_id: str, session_id: str, db, doc_ids: Optional[List[str]] = None):
+    query = {"user_id": user_id, "session_id": session_id}
+    if doc_ids is not None:
+        query["doc_id"] = {"$in": doc_ids}
+    await db["chunk_signatures"].delete_many(query)
+
+
+async def ensure_signature_indexes(db):
+    """
+    Index chunk_signatures so dedup lookups stay cheap as a session fills up.
+    (user_id, session_id, bands) is multikey over the LSH band keys, the query
+    every upload runs to find near-duplicate candidates. (user_id, session_id,
+    doc_id) serves promote_duplicates and delete_signatures, which select one
+    document's signatures when it is deleted.
+    """
+    signatures = db["chunk_signatures"]
+    await signatures.create_index([("user_id", 1), ("session_id", 1), ("bands", 1)])
+    await signatures.create_index([("user_id", 1), ("session_id", 1), ("doc_id", 1)])
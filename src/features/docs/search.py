@@ -0,0 +1,144 @@
+from html import escape
+from typing import Dict, List, Set, Tuple
+from opentelemetry import trace
+from src.database.lexical_index import COMPOUND_SEPARATORS, TOKEN_PATTERN, lexical_index, tokenize
+from src.database.session_vectors import VECTOR_ENGINE, session_vectors
+from src.database.vector_store import vector_store
+from src.features.chats.utils import RETRIEVAL_MODE, reciprocal_rank_fusion
+from src.utils.embeddings import get_embedding_backend
+import asyncio
+import os
+
+tracer = trace.get_tracer(__name__)
+
+# Candidates taken from each ranking before fusion, and so the deepest result a client can page to
+USER_SEARCH_CANDIDATES = int(os.getenv("USER_SEARCH_CANDIDATES", "100"))
+SNIPPET_CHARS = 240
+
+
+async def _live_documents(user_id: str, db) -> Dict[str, Dict[str, str]]:
+    """session_id -> {doc_id: file name} for the user's sessions that aren't being deleted."""
+    sessions = {}
+    async for session in db["sessions"].find({"user_id": user_id, "deleted_at": None}, {"session_id": 1, "documents": 1}):
+        sessions[session["session_id"]] = {
+            doc["doc_id"]: doc.get("metadata", {}).get("file_name", "") for doc in session.get("documents", [])
+        }
+    return sessions
+
+
+def _session_vector_candidates(model_name: str, user_id: str, session_ids: List[str], query_embedding) -> List[Tuple[str, str, str]]:
+    hits = [
+        hit for session_id in session_ids
+        for hit in session_vectors.query(model_name, user_id, session_id, query_embedding, k=USER_SEARCH_CANDIDATES)
+    ]
+    hits.sort(key=lambda hit: hit["score"], reverse=True)
+    return [(hit["id"], hit["metadata"]["session_id"], hit["metadata"]["doc_id"]) for hit in hits[:USER_SEARCH_CANDIDATES]]
+
+
+async def _vector_candidates(model_name: str, user_id: str, session_ids: List[str], query_embedding) -> List[Tuple[str, str, str]]:
+    """(chunk id, session id, doc id) across all of the user's sessions, best match first."""
+    if VECTOR_ENGINE == "numpy":
+        return await asyncio.to_thread(_session_vector_candidates, model_name, user_id, session_ids, query_embedding)
+
+    rows = await vector_store.query(
+        model_name,
+        [query_embedding],
+        n_results=USER_SEARCH_CANDIDATES,
+        where={"user_id": user_id},
+        include=["metadatas"]
+    )
+    return [(chunk_id, meta["session_id"], meta["doc_id"]) for chunk_id, meta in zip(rows["ids"][0], rows["metadatas"][0])]
+
+
+def _lexical_candidates(user_id: str, session_ids: List[str], query: str) -> List[Tuple[str, str, str]]:
+    hits = lexical_index.search_sessions(user_id, session_ids, query, k=USER_SEARCH_CANDIDATES)
+    return [(hit["id"], hit["session_id"], hit["doc_id"]) for hit in hits]
+
+
+async def _hydrate(chunk_ids: List[str]) -> Dict[str, Tuple[str, dict]]:
+    if not chunk_ids:
+        return {}
+    rows = await vector_store.get(ids=chunk_ids, include=["documents", "metadatas"])
+    return {chunk_id: (document, meta) for chunk_id, document, meta in zip(rows["ids"], rows["documents"], rows["metadatas"])}
+
+
+def highlight(text: str, terms: Set[str]) -> str:
+    """A window of the chunk around the first query term, HTML-escaped, matches wrapped in <mark>."""
+    matches = [
+        (m.start(), m.end()) for m in TOKEN_PATTERN.finditer(text.lower())
+        if m.group() in terms or any(part in terms for part in COMPOUND_SEPARATORS.split(m.group()))
+    ]
+    start = max(0, matches[0][0] - SNIPPET_CHARS // 3) if matches else 0
+    end = min(len(text), start + SNIPPET_CHARS)
+
+    parts = ["…" if start > 0 else ""]
+    cursor = start
+    for match_start, match_end in matches:
+        if match_start < cursor or match_end > end:
+            continue
+        parts.append(escape(text[cursor:match_start]))
+        parts.append(f"<mark>{escape(text[match_start:match_end])}</mark>")
+        cursor = match_end
+    parts.append(escape(text[cursor:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts).strip()
+
+
+async def search_user_documents(user_id: str, query: str, offset: int, limit: int, db) -> dict:
+    """
+    Search every document the user uploaded, in all live sessions, ranked
+    the way per-session retrieval ranks: vector and BM25 fused with RRF.
+    Both rankings are scoped to the user inside the index (a metadata
+    filter in Chroma, the user's own session files otherwise), so the cost
+    stays that of one session's retrieval.
+    """
+    with tracer.start_as_current_span("doc.search_user", attributes={"search.offset": offset, "search.limit": limit}):
+        live = await _live_documents(user_id, db)
+        session_ids = list(live)
+
+        backend = get_embedding_backend()
+        with tracer.start_as_current_span("chat.embed_query"):
+            query_embedding = await backend.embed_query(query)
+
+        with tracer.start_as_current_span("doc.search_candidates"):
+            rankings = [_vector_candidates(backend.name, user_id, session_ids, query_embedding)]
+            if RETRIEVAL_MODE == "hybrid":
+                rankings.append(asyncio.to_thread(_lexical_candidates, user_id, session_ids, query))
+            rankings = await asyncio.gather(*rankings)
+
+        # Chunks of sessions or documents still being purged are skipped
+        owners = {}
+        for ranking in rankings:
+            for chunk_id, session_id, doc_id in ranking:
+                if doc_id in live.get(session_id, {}):
+                    owners[chunk_id] = (session_id, doc_id)
+        fused = [chunk_id for chunk_id in reciprocal_rank_fusion([[c for c, _, _ in r] for r in rankings]) if chunk_id in owners]
+
+        page = fused[offset:offset + limit]
+        rows = await _hydrate(page)
+        terms = set(tokenize(query))
+
+        results = []
+        for rank, chunk_id in enumerate(page, start=offset + 1):
+            if chunk_id not in rows:
+                continue
+            document, meta = rows[chunk_id]
+            session_id, doc_id = owners[chunk_id]
+            results.append({
+                "rank": rank,
+                "chunk_id": chunk_id,
+                "session_id": session_id,
+                "doc_id": doc_id,
+                "file_name": live[session_id][doc_id],
+                "page": meta.get("page"),
+                "page_end": meta.get("page_end"),
+                "snippet": highlight(document, terms)
+            })
+
+    return {
+        "query": query,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if len(fused) > offset + limit else None,
+        "results": results
+    }
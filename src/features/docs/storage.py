@@ -0,0 +1,95 @@
+import asyncio
+import os
+from pathlib import Path
+
+from src.utils.services import services
+
+# cloudinary | local. local keeps uploads on disk, for development and offline benchmarks
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cloudinary").strip().lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "./uploads")
+# Account credentials, required with the cloudinary backend and never defaulted
+CLOUDINARY_SETTINGS = ("CLOUDINARY_CLOUD_NAME", "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET")
+
+DOCUMENT_TYPES = [
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+]
+
+
+class CloudinaryStorage:
+    def __init__(self):
+        import cloudinary
+        cloudinary.config(
+            cloud_name=os.environ["CLOUDINARY_CLOUD_NAME"],
+            api_key=os.environ["CLOUDINARY_API_KEY"],
+            api_secret=os.environ["CLOUDINARY_API_SECRET"]
+        )
+
+    async def save(self, file_bytes: bytes, folder: str, public_id: str, content_type: str) -> str:
+        import cloudinary.uploader
+        # The SDK is blocking, keep the upload off the event loop
+        upload_result = await asyncio.to_thread(
+            cloudinary.uploader.upload,
+            file=file_bytes,
+            folder=folder,
+            public_id=public_id,
+            resource_type="raw" if content_type in DOCUMENT_TYPES else "auto",
+            format="pdf" if content_type == "application/pdf" else None
+        )
+        return upload_result.get("secure_url")
+
+    async def delete(self, folder: str, public_id: str):
+        import cloudinary.uploader
+        await asyncio.to_thread(
+            cloudinary.uploader.destroy,
+            public_id=f"{folder}/{public_id}",
+            resource_type="raw"
+        )
+
+
+class LocalStorage:
+    def __init__(self, root: str = LOCAL_STORAGE_DIR):
+        self.root = Path(root).resolve()
+
+    def _path(self, folder: str, public_id: str) -> Path:
+        path = (self.root / folder / public_id).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"Refusing to store outside {self.root}: {folder}/{public_id}")
+        return path
+
+    def _write(self, path: Path, file_bytes: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(file_bytes)
+
+    async def save(self, file_bytes: bytes, folder: str, public_id: str, content_type: str) -> str:
+        path = self._path(folder, public_id)
+        await asyncio.to_thread(self._write, path, file_bytes)
+        return path.as_uri()
+
+    async def delete(self, folder: str, public_id: str):
+        await asyncio.to_thread(self._path(folder, public_id).unlink, missing_ok=True)
+
+
+def check_storage_settings():
+    """Run at start-up, so a misconfigured backend stops the server instead of failing the first upload."""
+    if STORAGE_BACKEND not in ("cloudinary", "local"):
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'cloudinary' or 'local'")
+    if STORAGE_BACKEND == "cloudinary":
+        missing = [name for name in CLOUDINARY_SETTINGS if not os.getenv(name)]
+        if missing:
+            raise RuntimeError(f"STORAGE_BACKEND=cloudinary needs {', '.join(missing)} set in the environment")
+
+
+def _create_storage():
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if STORAGE_BACKEND != "cloudinary":
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}, expected 'cloudinary' or 'local'")
+    return CloudinaryStorage()
+
+
+services.register("storage", _create_storage)
+
+
+def get_storage():
+    return services.get("storage")
@@ -0,0 +1,269 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import HTTPException
+from opentelemetry import trace
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from src.database.lexical_index import lexical_index
+from src.database.session_vectors import session_vectors
+from src.database.vector_store import vector_store
+from src.features.docs.dedup import delete_signatures, promote_duplicates
+from src.features.docs.storage import get_storage
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+tracer = trace.get_tracer(__name__)
+
+# Chunk ids fetched and deleted per Chroma round trip
+DELETION_BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", "200"))
+DELETION_POLL_SECONDS = float(os.getenv("DELETION_POLL_SECONDS", "10"))
+# A running job whose lease ran out lost its worker (crash, redeploy) and is picked up again
+DELETION_LEASE_SECONDS = float(os.getenv("DELETION_LEASE_SECONDS", "300"))
+DELETION_MAX_ATTEMPTS = int(os.getenv("DELETION_MAX_ATTEMPTS", "5"))
+# Finished jobs are removed by a TTL index this long after they are done; failed ones stay for inspection
+DELETION_JOB_RETENTION_DAYS = float(os.getenv("DELETION_JOB_RETENTION_DAYS", "7"))
+STORAGE_DELETE_CONCURRENCY = 8
+
+# Run in this order and recorded as they finish, a resumed job skips the steps already done.
+# links first: chunks of other documents deduplicated against these ones must be indexed before they go.
+# Mongo records go last so a session is never forgotten while it still owns data elsewhere.
+STEPS = ("links", "vectors", "indexes", "files", "records")
+
+_worker: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+
+
+async def _create_job(db, kind: str, user_id: str, session_id: str, doc_ids: List[str]) -> str:
+    now = datetime.utcnow()
+    result = await db["deletion_jobs"].insert_one({
+        "kind": kind,
+        "user_id": user_id,
+        "session_id": session_id,
+        "doc_ids": doc_ids,
+        "status": "pending",
+        "completed_steps": [],
+        "attempts": 0,
+        "lease_until": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    })
+    if _wake is not None:
+        _wake.set()
+    return str(result.inserted_id)
+
+
+async def request_session_deletion(user_id: str, session_id: str, db) -> dict:
+    """Hide the session right away and leave the cleanup to the background worker."""
+    session = await db["sessions"].find_one(
+        {"session_id": session_id, "user_id": user_id, "deleted_at": None},
+        {"documents": 1}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    doc_ids = [doc["doc_id"] for doc in session.get("documents", [])]
+    # The job is written first: if we crash before marking, the worker still finishes the delete
+    job_id = await _create_job(db, "session", user_id, session_id, doc_ids)
+    await db["sessions"].update_one(
+        {"session_id": session_id, "user_id": user_id},
+        {"$set": {"deleted_at": datetime.utcnow()}}
+    )
+    return {"message": "Session scheduled for deletion", "session_id": session_id, "job_id": job_id}
+
+
+async def request_document_deletion(user_id: str, session_id: str, doc_id: str, db) -> dict:
+    session = await db["sessions"].find_one(
+        {"session_id": session_id, "user_id": user_id, "deleted_at": None},
+        {"documents": 1}
+    )
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if not any(doc["doc_id"] == doc_id for doc in session.get("documents", [])):
+        raise HTTPException(status_code=404, detail="Document not found in session")
+
+    job_id = await _create_job(db, "document", user_id, session_id, [doc_id])
+    await _pull_document(db, user_id, session_id, doc_id)
+    return {"message": "Document scheduled for deletion", "doc_id": doc_id, "job_id": job_id}
+
+
+async def pending_deletion(user_id: str, session_id: str, db, doc_id: Optional[str] = None) -> bool:
+    """True while a session delete, or a delete of doc_id, is still running."""
+    query = {"user_id": user_id, "session_id": session_id, "status": {"$in": ["pending", "running"]}}
+    if doc_id is not None:
+        query["$or"] = [{"kind": "session"}, {"doc_ids": doc_id}]
+    return await db["deletion_jobs"].find_one(query, {"_id": 1}) is not None
+
+
+async def _pull_document(db, user_id: str, session_id: str, doc_id: str):
+    await db["sessions"].update_one(
+        {"session_id": session_id, "user_id": user_id},
+        {
+            "$pull": {"documents": {"doc_id": doc_id}},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+
+def _chunk_filter(job: dict) -> dict:
+    clauses = [{"user_id": job["user_id"]}, {"session_id": job["session_id"]}]
+    if job["kind"] == "document":
+        clauses.append({"doc_id": {"$in": job["doc_ids"]}})
+    return {"$and": clauses}
+
+
+def _delete_indexes(job: dict):
+    for doc_id in (job["doc_ids"] if job["kind"] == "document" else [None]):
+        lexical_index.delete(job["user_id"], job["session_id"], doc_id)
+        session_vectors.delete_all_models(job["user_id"], job["session_id"], doc_id)
+
+
+async def _delete_files(job: dict):
+    storage = get_storage()
+    folder = f"users/{job['user_id']}/sessions/{job['session_id']}"
+    doc_ids = job["doc_ids"]
+    for start in range(0, len(doc_ids), STORAGE_DELETE_CONCURRENCY):
+        await asyncio.gather(*(storage.delete(folder, doc_id) for doc_id in doc_ids[start:start + STORAGE_DELETE_CONCURRENCY]))
+
+
+async def _delete_records(job: dict, db):
+    user_id, session_id = job["user_id"], job["session_id"]
+    if job["kind"] == "document":
+        await delete_signatures(user_id, session_id, db, job["doc_ids"])
+        for doc_id in job["doc_ids"]:
+            await _pull_document(db, user_id, session_id, doc_id)
+        return
+    await delete_signatures(user_id, session_id, db)
+    await db["chats"].delete_many({"user_id": user_id, "session_id": session_id})
+    await db["sessions"].delete_one({"session_id": session_id, "user_id": user_id, "deleted_at": {"$ne": None}})
+
+
+async def _run_step(step: str, job: dict, db):
+    if step == "links":
+        if job["kind"] == "document":
+            promoted = await promote_duplicates(job["user_id"], job["session_id"], job["doc_ids"], db)
+            trace.get_current_span().set_attribute("deletion.chunks_promoted", promoted)
+    elif step == "vectors":
+        deleted = await vector_store.delete_where(_chunk_filter(job), DELETION_BATCH_SIZE)
+        trace.get_current_span().set_attribute("deletion.chunks_deleted", deleted)
+    elif step == "indexes":
+        await asyncio.to_thread(_delete_indexes, job)
+    elif step == "files":
+        await _delete_files(job)
+    elif step == "records":
+        await _delete_records(job, db)
+
+
+def _lease() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=DELETION_LEASE_SECONDS)
+
+
+async def _claim_job(db) -> Optional[dict]:
+    now = datetime.utcnow()
+    return await db["deletion_jobs"].find_one_and_update(
+        {
+            "status": {"$in": ["pending", "running"]},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": {"status": "running", "lease_until": _lease(), "updated_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _process_job(job: dict, db):
+    jobs = db["deletion_jobs"]
+    attributes = {"deletion.kind": job["kind"], "deletion.session_id": job["session_id"], "deletion.attempt": job["attempts"]}
+    with tracer.start_as_current_span("deletion.job", attributes=attributes):
+        try:
+            for step in STEPS:
+                if step in job["completed_steps"]:
+                    continue
+                with tracer.start_as_current_span(f"deletion.{step}"):
+                    await _run_step(step, job, db)
+                await jobs.update_one(
+                    {"_id": job["_id"]},
+                    {"$push": {"completed_steps": step}, "$set": {"lease_until": _lease(), "updated_at": datetime.utcnow()}}
+                )
+        except Exception as e:
+            failed = job["attempts"] >= DELETION_MAX_ATTEMPTS
+            logger.warning("Deletion job %s failed (attempt %s): %s", job["_id"], job["attempts"], e)
+            # Retried once the back-off lease runs out, unless it keeps failing
+            await jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {
+                    "status": "failed" if failed else "pending",
+                    "lease_until": datetime.utcnow() + timedelta(seconds=30 * 2 ** job["attempts"]),
+                    "error": str(e),
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            return
+
+        await jobs.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done", "lease_until": None, "error": None, "updated_at": datetime.utcnow(), "finished_at": datetime.utcnow()}}
+        )
+
+
+async def _run_worker(db):
+    while True:
+        try:
+            job = await _claim_job(db)
+        except Exception as e:
+            logger.warning("Could not claim a deletion job: %s", e)
+            job = None
+
+        if job is not None:
+            await _process_job(job, db)
+            continue
+
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=DELETION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+
+
+async def ensure_deletion_indexes(db):
+    """
+    Index the job queue for its two hot queries and expire finished jobs.
+    Workers poll with _claim_job, which asks for open jobs with no live lease,
+    oldest first: (status, lease_until, created_at). Every document
+    upload asks pending_deletion whether its session is being deleted:
+    (user_id, session_id, status). A TTL index on finished_at drops done jobs
+    after DELETION_JOB_RETENTION_DAYS, so the collection stays the size of
+    the backlog rather than of all history.
+    """
+    jobs = db["deletion_jobs"]
+    await jobs.create_index([("status", 1), ("lease_until", 1), ("created_at", 1)])
+    await jobs.create_index([("user_id", 1), ("session_id", 1), ("status", 1)])
+
+    ttl = int(DELETION_JOB_RETENTION_DAYS * 86400)
+    try:
+        await jobs.create_index("finished_at", expireAfterSeconds=ttl)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict: the retention setting changed since the index was built
+            raise
+        await db.command("collMod", "deletion_jobs", index={"keyPattern": {"finished_at": 1}, "expireAfterSeconds": ttl})
+
+
+def start_deletion_worker(db):
+    """Work through deletion_jobs in the background, including jobs left over from before a restart."""
+    global _worker, _wake
+    if _worker is None:
+        _wake = asyncio.Event()
+        _worker = asyncio.create_task(_run_worker(db))
+
+
+async def stop_deletion_worker():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, Header
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import List
-from src.utils.auth_utils import get_user_id_from_token
+from src.utils.auth_utils import get_current_user_id
 from .sessionSchema import SessionModel
+from .deletion import request_session_deletion
+from src.features.chats.message_writer import message_writer
 from src.database.db import get_db
 
 router = APIRouter()
@@ -11,12 +13,11 @@ router = APIRouter(prefix="/session", tags=["Session"])
 
 @router.get("/get-user-sessions", response_model=List[SessionModel])
 async def get_user_sessions(
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    user_id = get_user_id_from_token(authorization)
-
-    cursor = db.sessions.find({"user_id": user_id})
+    await message_writer.flush_session(user_id)
+    cursor = db.sessions.find({"user_id": user_id, "deleted_at": None})
     sessions = []
     async for session in cursor:
         session["_id"] = str(session["_id"]) 
@@ -27,15 +28,24 @@ async def get_user_sessions(
 
 @router.get("/get-next-session-id")
 async def get_next_session_id(
-    authorization: str = Header(None),
+    user_id: str = Depends(get_current_user_id),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    user_id = get_user_id_from_token(authorization)
+    # Highest numeric id + 1, a count would hand out an existing id again once a session is deleted
+    highest = 0
+    async for session in db.sessions.find({"user_id": user_id}, {"session_id": 1}):
+        if str(session.get("session_id", "")).isdigit():
+            highest = max(highest, int(session["session_id"]))
 
+    next_session_id = str(highest + 1)
 
-    session_count = await db.sessions.count_documents({"user_id": user_id})
+    return {"next_session_id": next_session_id}
 
-    # Next session ID will be count + 1
-    next_session_id = str(session_count + 1)
 
-    return {"next_session_id": next_session_id}
\ No newline at end of file
+@router.delete("/{session_id}", status_code=202)
+async def delete_session(
+    session_id: str,
+    user_id: str = Depends(get_current_user_id),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    return await request_session_deletion(user_id, session_id, db)
@@ -2,13 +2,14 @@ from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from src.features.docs.Dschema import DocumentModel
-from src.features.chats.chatSchema import ChatMessage
+from src.features.chats.chatSchema import ChatMessage, ConversationMemory
 
 class SessionModel(BaseModel):
     session_id: str                   
     user_id: str
     documents: List[DocumentModel] = []
     messages: List[ChatMessage] = []
+    memory: Optional[ConversationMemory] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
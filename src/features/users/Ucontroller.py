@@ -1,29 +1,8 @@
 from fastapi import HTTPException
 from pymongo.collection import Collection
 from .Uschema import UserLogin, UserCreate
-from passlib.context import CryptContext
-from jose import jwt
-from datetime import datetime, timedelta
-
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-SECRET_KEY = "your-secret-key"  
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
-
-def create_access_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+from src.utils.auth_utils import create_access_token
+from src.utils.password_utils import hash_password, verify_password
 
 
 async def register_user(user_data: UserCreate, user_collection: Collection):
@@ -31,7 +10,7 @@ async def register_user(user_data: UserCreate, user_collection: Collection):
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user_dict = user_data.dict()
     user_dict["password"] = hashed_password
     await user_collection.insert_one(user_dict)
@@ -45,9 +24,17 @@ async def register_user(user_data: UserCreate, user_collection: Collection):
 
 async def login_user(user_data: UserLogin, user_collection: Collection):
     user = await user_collection.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    valid, new_hash = await verify_password(user_data.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
+    # Stored hash used outdated bcrypt parameters, upgrade it while we have the plain password
+    if new_hash:
+        await user_collection.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+
     token = create_access_token(data={"user_id": user["email"]})
 
     return {
@@ -1,21 +1,65 @@
-from fastapi import HTTPException
+from fastapi import HTTPException, Header
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Tuple
 import jwt
 import os
+import time
 
+# Single source for signing and verifying tokens
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+# token -> (user_id, exp), least recently used first
+_verified_tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+
+def create_access_token(data: dict) -> str:
+    to_encode = data.copy()
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def _remember_token(token: str, user_id: str, exp: float):
+    _verified_tokens[token] = (user_id, exp)
+    if len(_verified_tokens) > TOKEN_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+
 
 def get_user_id_from_token(authorization: str) -> str:
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Authorization token missing or invalid")
 
     token = authorization.split(" ")[1]
+
+    cached = _verified_tokens.get(token)
+    if cached:
+        user_id, exp = cached
+        if exp > time.time():
+            _verified_tokens.move_to_end(token)
+            return user_id
+        del _verified_tokens[token]
+        raise HTTPException(status_code=401, detail="Token has expired")
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("user_id")
         if not user_id:
             raise HTTPException(status_code=401, detail="User ID not found in token")
+        # Only tokens with an expiry are cached, the entry must never outlive the token
+        if payload.get("exp") is not None:
+            _remember_token(token, user_id, float(payload["exp"]))
         return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+async def get_current_user_id(authorization: str = Header(None)) -> str:
+    # async so FastAPI runs it on the event loop instead of hopping to the threadpool
+    return get_user_id_from_token(authorization)
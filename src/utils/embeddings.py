@@ -0,0 +1,180 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+from src.utils.metrics import EMBEDDING_REQUEST_DURATION, observe
+from src.utils.services import get_openai_client, services
+import asyncio
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# openai | onnx
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").strip().lower()
+OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
+# Hugging Face repo with an ONNX export (onnx/model.onnx + tokenizer.json), or a local directory holding them
+ONNX_EMBEDDING_MODEL = os.getenv("ONNX_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Hub repo id of a local ONNX_EMBEDDING_MODEL directory outside the Hugging Face cache,
+# so its vectors share the index of the same model downloaded from the Hub
+ONNX_EMBEDDING_MODEL_ID = os.getenv("ONNX_EMBEDDING_MODEL_ID", "").strip()
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "onnx/model.onnx")
+ONNX_MAX_TOKENS = int(os.getenv("ONNX_MAX_TOKENS", "256"))
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Intra-op threads per inference; 0 lets onnxruntime use every core
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+# Batches running at once; each already fans out over EMBEDDING_THREADS cores
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+
+# The OpenAI API accepts up to 2048 inputs per request
+OPENAI_MAX_BATCH = 2048
+
+
+class EmbeddingBackend(ABC):
+    """
+    Turns text into vectors. `name` identifies the model and is stored with
+    every vector, so indexes built by different models are never mixed.
+    """
+
+    name: str
+
+    @abstractmethod
+    async def embed(self, texts: List[str], operation: str = "ingest") -> List[List[float]]:
+        ...
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed([text], operation="query"))[0]
+
+    def close(self):
+        pass
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model: str = OPENAI_EMBEDDING_MODEL):
+        self.model = model
+        self.name = f"openai:{model}"
+
+    async def embed(self, texts: List[str], operation: str = "ingest") -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), OPENAI_MAX_BATCH):
+            with observe(EMBEDDING_REQUEST_DURATION, model=self.name, operation=operation):
+                response = await get_openai_client().embeddings.create(
+                    input=texts[start:start + OPENAI_MAX_BATCH],
+                    model=self.model
+                )
+            embeddings.extend(item.embedding for item in response.data)
+        return embeddings
+
+
+def _onnx_model_name(model: str) -> str:
+    # The full repo id, whether the model comes from the Hub or a local copy of it: two repos
+    # with the same model directory name (org-a/bge-small, org-b/bge-small) never share an index
+    if not os.path.isdir(model):
+        return f"onnx:{model.strip('/')}"
+    if ONNX_EMBEDDING_MODEL_ID:
+        return f"onnx:{ONNX_EMBEDDING_MODEL_ID}"
+    path = Path(model).resolve()
+    for part in path.parts:
+        # A Hugging Face cache snapshot, .../models--org--name/snapshots/<revision>
+        if part.startswith("models--"):
+            return f"onnx:{part[len('models--'):].replace('--', '/')}"
+    return f"onnx:{path}"
+
+
+class OnnxEmbeddingBackend(EmbeddingBackend):
+    """Sentence embeddings from an ONNX transformer on CPU: mean pooling over tokens, L2-normalized."""
+
+    def __init__(self, model: str = ONNX_EMBEDDING_MODEL):
+        self.model = model
+        self.name = _onnx_model_name(model)
+        self._session = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embed")
+
+    def _model_dir(self) -> str:
+        if os.path.isdir(self.model):
+            return self.model
+        from huggingface_hub import snapshot_download
+        return snapshot_download(self.model, allow_patterns=[ONNX_MODEL_FILE, "tokenizer.json", "*.json"])
+
+    def _load(self):
+        # Loaded on first use so importing the app never pays for the model
+        with self._load_lock:
+            if self._session is not None:
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+
+            model_dir = self._model_dir()
+            tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+            tokenizer.enable_truncation(max_length=ONNX_MAX_TOKENS)
+            tokenizer.enable_padding()
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = EMBEDDING_THREADS
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = onnxruntime.InferenceSession(
+                os.path.join(model_dir, ONNX_MODEL_FILE),
+                sess_options=options,
+                providers=["CPUExecutionProvider"]
+            )
+            self._input_names = {i.name for i in session.get_inputs()}
+            self._tokenizer = tokenizer
+            self._session = session
+            logger.info("Loaded ONNX embedding model %s from %s", self.model, model_dir)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+
+        self._load()
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self._session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def embed(self, texts: List[str], operation: str = "ingest") -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        with observe(EMBEDDING_REQUEST_DURATION, model=self.name, operation=operation):
+            results = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, self._embed_batch, batch) for batch in batches
+            ))
+        return [vector for batch in results for vector in batch]
+
+
+def embedding_model_name(backend: Optional[str] = None) -> str:
+    """Name of the configured model without loading it, used to pick the index."""
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        return _onnx_model_name(ONNX_EMBEDDING_MODEL)
+    return f"openai:{OPENAI_EMBEDDING_MODEL}"
+
+
+def _create_embedding_backend() -> EmbeddingBackend:
+    if EMBEDDING_BACKEND == "onnx":
+        return OnnxEmbeddingBackend()
+    if EMBEDDING_BACKEND != "openai":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {EMBEDDING_BACKEND!r}, expected 'openai' or 'onnx'")
+    return OpenAIEmbeddingBackend()
+
+
+services.register("embeddings", _create_embedding_backend, close=lambda backend: backend.close())
+
+
+def get_embedding_backend() -> EmbeddingBackend:
+    return services.get("embeddings")
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+from typing import Optional, Tuple
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, a single process owns the data directories
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Exclusive lock on `path` across worker processes, held on a `path.lock`
+    file next to it, so a read-modify-write of a file shared by every worker
+    can't interleave with another one.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as handle:
+        lock_handle(handle)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+
+def lock_handle(handle, blocking: bool = True) -> bool:
+    """
+    Exclusive lock on an open file, held until it is unlocked or closed.
+    Non-blocking, returns False instead of waiting when another process
+    holds it.
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        return True
+    except BlockingIOError:
+        return False
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Changes whenever the file is replaced, None when it is gone."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,136 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+from contextlib import contextmanager
+import time
+
+# Buckets sized for this app: sub-second API calls up to multi-second LLM answers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2 ** exp for exp in range(10, 29, 2))  # 1 KiB .. 256 MiB
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency, including the full body of streamed responses",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Chat completion call duration",
+    ["model", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from starting answer generation to the first streamed word",
+    buckets=LATENCY_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by the OpenAI API",
+    ["model", "operation", "kind"]
+)
+EMBEDDING_REQUEST_DURATION = Histogram(
+    "embedding_request_duration_seconds",
+    "Embeddings call duration",
+    ["model", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+CHROMA_OPERATION_DURATION = Histogram(
+    "chroma_operation_duration_seconds",
+    "Chroma collection call duration",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+VECTOR_QUERY_BATCH_SIZE = Histogram(
+    "vector_query_batch_size",
+    "Query embeddings answered by one Chroma query call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+MESSAGE_FLUSH_SIZE = Histogram(
+    "chat_message_flush_size",
+    "Chat messages written by one bulk_write",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+UPLOAD_SIZE = Histogram(
+    "upload_size_bytes",
+    "Size of uploaded files",
+    ["kind"],
+    buckets=SIZE_BUCKETS
+)
+INGESTION_DURATION = Histogram(
+    "document_ingestion_duration_seconds",
+    "End-to-end process_document duration",
+    buckets=LATENCY_BUCKETS
+)
+STREAMS_CANCELLED = Counter(
+    "chat_streams_cancelled_total",
+    "Streamed answers cut short because the client disconnected",
+    ["kind"]
+)
+STREAMS_IN_FLIGHT = Gauge(
+    "chat_streams_in_flight",
+    "Answers currently being streamed, and open voice sessions",
+    ["kind"]
+)
+
+
+def register_gauge(name: str, documentation: str, fn):
+    """Gauge read from `fn` at scrape time, for caches and queues that already keep counts."""
+    gauge = Gauge(name, documentation)
+    gauge.set_function(fn)
+    return gauge
+
+
+@contextmanager
+def observe(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
+
+
+def record_token_usage(model: str, operation: str, usage):
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model, operation, "prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(model, operation, "completion").inc(usage.completion_tokens or 0)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so streamed bodies pass through untouched and
+    the histogram covers the whole response. Routes are labelled by their
+    template (/chat/ask/{session_id}) to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status)
+            ).observe(time.perf_counter() - started)
+
+
+async def metrics_endpoint():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,49 @@
+from fastapi import HTTPException
+from src.utils.metrics import register_gauge
+from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import os
+
+# Raising BCRYPT_ROUNDS upgrades existing hashes on the user's next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Requests allowed to wait for a worker before new ones are turned away with 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL while hashing, so a small thread pool keeps it off the event loop
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_in_flight = 0
+register_gauge("password_hash_in_flight", "bcrypt calls running or waiting for a worker", lambda: _in_flight)
+
+
+async def _run_bounded(fn, *args):
+    global _in_flight
+    if _in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in attempts in progress, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _in_flight -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run_bounded(pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Returns (valid, new_hash). new_hash is set when the stored hash uses outdated parameters."""
+    return await _run_bounded(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_password_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
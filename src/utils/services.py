@@ -0,0 +1,84 @@
+from typing import Any, Callable, Dict, List, Optional
+import inspect
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceRegistry:
+    """
+    Process-wide clients created on first use. A factory runs at most once
+    per process, every caller shares its instance, and aclose() tears the
+    instances down in reverse order of creation at shutdown. Importing a
+    module never pays for a client it may not need.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._closers: Dict[str, Optional[Callable[[Any], Any]]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._created: List[str] = []
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], Any]] = None):
+        self._factories[name] = factory
+        self._closers[name] = close
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError(f"Unknown service {name!r}")
+                self._instances[name] = self._factories[name]()
+                self._created.append(name)
+                logger.info("Created service %s", name)
+            return self._instances[name]
+
+    def created(self) -> List[str]:
+        return list(self._created)
+
+    async def aclose(self):
+        while self._created:
+            name = self._created.pop()
+            instance = self._instances.pop(name)
+            close = self._closers.get(name)
+            if close is None:
+                continue
+            try:
+                result = close(instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning("Closing service %s failed: %s", name, e)
+
+
+services = ServiceRegistry()
+
+
+def _create_openai():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _create_tts_http():
+    import httpx
+    return httpx.AsyncClient(timeout=30)
+
+
+services.register("openai", _create_openai, close=lambda client: client.close())
+# Keep-alive connections to the /speak server and its static audio
+services.register("tts_http", _create_tts_http, close=lambda client: client.aclose())
+
+
+def get_openai_client():
+    """The one AsyncOpenAI client of this process: chat, summaries and embeddings share its connection pool."""
+    return services.get("openai")
+
+
+async def close_services():
+    await services.aclose()
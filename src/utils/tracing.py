@@ -0,0 +1,87 @@
+from opentelemetry import trace
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+    SpanExportResult
+)
+from typing import Optional, Sequence
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# otlp | file | console | none. Defaults to otlp only when a collector endpoint is configured
+OTEL_TRACES_EXPORTER = os.getenv(
+    "OTEL_TRACES_EXPORTER",
+    "otlp" if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") else "none"
+).strip().lower()
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "medichat-api")
+# Used by the file exporter, one JSON span per line
+OTEL_TRACES_FILE = os.getenv("OTEL_TRACES_FILE", "./traces.jsonl")
+
+_provider: Optional[TracerProvider] = None
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends finished spans to a local file for offline inspection and tests."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: Sequence) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning("Writing spans to %s failed: %s", self.path, e)
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def _build_exporter(name: str) -> Optional[SpanExporter]:
+    if name == "otlp":
+        # Endpoint, headers and TLS come from the standard OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if name == "file":
+        return JsonLinesSpanExporter(OTEL_TRACES_FILE)
+    if name == "console":
+        return ConsoleSpanExporter()
+    if name != "none":
+        logger.warning("Unknown OTEL_TRACES_EXPORTER %r, tracing disabled", name)
+    return None
+
+
+def setup_tracing(app):
+    """Install the tracer provider and instrument the FastAPI app. No-op when no exporter is configured."""
+    global _provider
+    exporter = _build_exporter(OTEL_TRACES_EXPORTER)
+    if exporter is None:
+        return
+
+    _provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+    FastAPIInstrumentor.instrument_app(app, tracer_provider=_provider)
+    logger.info("Tracing enabled, exporting spans via %s", OTEL_TRACES_EXPORTER)
+
+
+def shutdown_tracing():
+    # Flushes spans still queued in the batch processor
+    global _provider
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
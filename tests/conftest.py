@@ -0,0 +1,55 @@
+"""
+Shared test setup. Everything the app writes goes under a temporary
+directory and nothing reaches the network: upstream services are played
+by small local apps started with the `serve` fixture.
+"""
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+import uvicorn
+
+WORKDIR = tempfile.mkdtemp(prefix="app-tests-")
+
+# Set before any src module is imported, they read their settings at import time
+for key, value in {
+    "OPENAI_API_KEY": "test",
+    "DEEPGRAM_API_KEY": "test",
+    "SECRET_KEY": "test-secret",
+    "STORAGE_BACKEND": "local",
+    "LOCAL_STORAGE_DIR": os.path.join(WORKDIR, "uploads"),
+    "TTS_CACHE_DIR": os.path.join(WORKDIR, "tts_cache"),
+    "LEXICAL_INDEX_DIR": os.path.join(WORKDIR, "lexical_data"),
+    "VECTOR_STORE_DIR": os.path.join(WORKDIR, "vector_data"),
+    "OTEL_TRACES_EXPORTER": "none",
+    "HF_HUB_OFFLINE": "1",
+    "ANONYMIZED_TELEMETRY": "False"
+}.items():
+    os.environ.setdefault(key, value)
+
+
+@pytest.fixture
+def serve():
+    """Start an ASGI app on a free localhost port for the test; returns its base URL."""
+    servers = []
+
+    def start(app) -> str:
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 10
+        while not server.started:
+            if time.monotonic() > deadline or not thread.is_alive():
+                raise RuntimeError("Test server did not start")
+            time.sleep(0.01)
+        servers.append((server, thread))
+        port = server.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    yield start
+
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(timeout=10)
@@ -0,0 +1,240 @@
+"""
+In-process stand-in for the Motor database, shared by the tests and the e2e
+benchmark.
+
+Covers the subset of the Motor API the app calls: equality filters on
+top-level or dotted fields (reaching into arrays), simple projections, $set / $push (with $each) /
+$pull / $inc updates, bulk_write of UpdateOne operations and async cursors with sort, skip and limit. Documents
+are deep-copied on the way in and out, like a real round trip.
+"""
+import copy
+from types import SimpleNamespace
+
+from bson import ObjectId
+
+
+def _get(doc: dict, dotted: str):
+    value = doc
+    for part in dotted.split("."):
+        if isinstance(value, list):
+            # "documents.doc_id" reaches into every element of an array
+            value = [item[part] for item in value if isinstance(item, dict) and part in item]
+        elif not isinstance(value, dict) or part not in value:
+            return None
+        else:
+            value = value[part]
+    return value
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        # Array fields match when any element does, like Mongo
+        values = value if isinstance(value, list) else [value]
+        for op, operand in condition.items():
+            if op == "$in" and not any(v in operand for v in values):
+                return False
+            if op == "$nin" and any(v in operand for v in values):
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$exists" and (value is not None) != bool(operand):
+                return False
+            if op == "$lt" and not (value is not None and value < operand):
+                return False
+            if op == "$lte" and not (value is not None and value <= operand):
+                return False
+            if op == "$gt" and not (value is not None and value > operand):
+                return False
+            if op == "$gte" and not (value is not None and value >= operand):
+                return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_condition(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc: dict, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = {key for key, flag in projection.items() if flag and key != "_id"}
+    if included:
+        result = {key: copy.deepcopy(doc[key]) for key in included if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {key: copy.deepcopy(value) for key, value in doc.items() if projection.get(key, 1)}
+
+
+def _apply_update(doc: dict, update: dict):
+    for field, value in update.get("$set", {}).items():
+        doc[field] = copy.deepcopy(value)
+    for field, value in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + value
+    for field, value in update.get("$push", {}).items():
+        items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        doc.setdefault(field, []).extend(copy.deepcopy(items))
+    for field, condition in update.get("$pull", {}).items():
+        doc[field] = [
+            item for item in doc.get(field, [])
+            if not (matches(item, condition) if isinstance(condition, dict) else item == condition)
+        ]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (_get(d, field) is None, _get(d, field)), reverse=order < 0)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def _window(self):
+        end = self._skip + self._limit if self._limit else None
+        return self._docs[self._skip:end]
+
+    async def to_list(self, length=None):
+        docs = self._window()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._window())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self):
+        self._docs = []
+
+    def _matching(self, query):
+        return [doc for doc in self._docs if matches(doc, query)]
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        for doc in self._docs:
+            if matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor([_project(doc, projection) for doc in self._matching(query)])
+
+    async def count_documents(self, query=None, **kwargs):
+        return len(self._matching(query))
+
+    async def insert_one(self, document: dict, **kwargs):
+        document.setdefault("_id", ObjectId())
+        self._docs.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, **kwargs):
+        ids = [(await self.insert_one(doc)).inserted_id for doc in documents]
+        return SimpleNamespace(inserted_ids=ids)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        for doc in self._docs:
+            if matches(doc, query):
+                _apply_update(doc, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            doc = {key: value for key, value in query.items() if not key.startswith("$")}
+            doc["_id"] = ObjectId()
+            _apply_update(doc, update)
+            for field, value in update.get("$setOnInsert", {}).items():
+                doc[field] = copy.deepcopy(value)
+            self._docs.append(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def bulk_write(self, operations, ordered=True, **kwargs):
+        matched = 0
+        for operation in operations:
+            # pymongo's UpdateOne keeps its arguments in private attributes
+            result = await self.update_one(operation._filter, operation._doc, upsert=bool(operation._upsert))
+            matched += result.matched_count
+        return SimpleNamespace(matched_count=matched, modified_count=matched, upserted_count=0)
+
+    async def update_many(self, query, update, **kwargs):
+        docs = self._matching(query)
+        for doc in docs:
+            _apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(docs), modified_count=len(docs))
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False, **kwargs):
+        for doc in self._docs:
+            if matches(doc, query):
+                before = _project(doc, projection)
+                _apply_update(doc, update)
+                return _project(doc, projection) if return_document else before
+        return None
+
+    async def delete_one(self, query, **kwargs):
+        for i, doc in enumerate(self._docs):
+            if matches(doc, query):
+                del self._docs[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query, **kwargs):
+        before = len(self._docs)
+        self._docs = [doc for doc in self._docs if not matches(doc, query)]
+        return SimpleNamespace(deleted_count=before - len(self._docs))
+
+    async def create_index(self, *args, **kwargs):
+        return "fake_index"
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection()
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class FakeClient:
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return self._databases.setdefault(name, FakeDatabase())
+
+    def close(self):
+        pass
+
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI
+
+from src.database.db import get_database
+from src.features.chats import chatController, chatRoutes, utils
+from src.utils.auth_utils import create_access_token
+from tests.fake_mongo import FakeClient
+
+USER_ID = "patient@example.com"
+QUESTION = "What does my HbA1c mean?"
+ANSWER_WORDS = 200
+TOKEN_INTERVAL = 0.02
+
+
+def fake_openai(streams: dict) -> FastAPI:
+    """Streamed /v1/chat/completions, one word every TOKEN_INTERVAL, that records how each stream ended."""
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions():
+        def event(delta: dict, finish_reason=None) -> bytes:
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            payload = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": "gpt-4o", "choices": [choice]}
+            return f"data: {json.dumps(payload)}\n\n".encode()
+
+        async def stream():
+            outcome, sent = "aborted", 0
+            try:
+                for i in range(ANSWER_WORDS):
+                    await asyncio.sleep(TOKEN_INTERVAL)
+                    yield event({"content": f"word{i} "})
+                    sent += 1
+                yield event({}, finish_reason="stop")
+                yield b"data: [DONE]\n\n"
+                outcome = "completed"
+            finally:
+                # Cancelled before the end when the app drops the connection
+                streams.update(outcome=outcome, sent=sent)
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def wait_for(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not (result := condition()):
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.02)
+    return result
+
+
+@pytest.fixture
+def chat_app(serve, monkeypatch):
+    streams = {}
+    upstream = serve(fake_openai(streams))
+    # Created on the server's event loop, in the request
+    monkeypatch.setattr(utils, "get_openai_client", lambda: AsyncOpenAI(api_key="test", base_url=f"{upstream}/v1"))
+
+    async def refine_question(question, chat_context):
+        return question
+
+    async def retrieve_chunks(user_id, session_id, query, live_doc_ids=None):
+        return ["HbA1c 6.1%, fasting glucose 108 mg/dl."]
+
+    async def rerank_chunks(query, chunks):
+        return chunks
+
+    monkeypatch.setattr(chatController, "refine_question", refine_question)
+    monkeypatch.setattr(chatController, "retrieve_chunks", retrieve_chunks)
+    monkeypatch.setattr(chatController, "rerank_chunks", rerank_chunks)
+
+    db = FakeClient()["test"]
+    asyncio.run(db["sessions"].insert_one({"session_id": "s1", "user_id": USER_ID, "deleted_at": None, "messages": []}))
+
+    app = FastAPI()
+    app.include_router(chatRoutes.router)
+    app.dependency_overrides[get_database] = lambda: db
+    return serve(app), streams, db
+
+
+def test_client_disconnect_closes_upstream_and_keeps_partial_answer(chat_app):
+    app_url, streams, db = chat_app
+    headers = {"Authorization": f"Bearer {create_access_token({'user_id': USER_ID})}"}
+
+    received = ""
+    with httpx.Client(timeout=10) as client:
+        with client.stream("POST", f"{app_url}/chat/ask/s1", data={"question": QUESTION}, headers=headers) as response:
+            assert response.status_code == 200
+            for text in response.iter_text():
+                received += text
+                if len(received.split()) >= 5:
+                    break
+    # Leaving the block mid-body closes the connection
+
+    # The app closed its OpenAI stream, so the upstream stopped generating long before the end
+    wait_for(lambda: "outcome" in streams)
+    assert streams["outcome"] == "aborted"
+    assert streams["sent"] < ANSWER_WORDS / 2
+
+    # The partial answer is saved by a task of its own, after the request is gone
+    [message] = wait_for(lambda: asyncio.run(db["sessions"].find_one({"session_id": "s1"}))["messages"])
+    assert message["truncated"] is True
+    assert message["question"] == QUESTION
+    # Everything the client saw was saved, and nothing the upstream never sent
+    assert message["answer"].startswith(received.strip())
+    assert len(message["answer"].split()) <= streams["sent"]
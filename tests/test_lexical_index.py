@@ -0,0 +1,60 @@
+import json
+
+from src.database.lexical_index import LexicalIndexStore, SessionLexicalIndex
+
+CHUNKS = {
+    "c1": ("Start metformin 500mg twice daily with meals.", "d1"),
+    "c2": ("HbA1c 6.1% and fasting glucose 108 mg/dl.", "d1"),
+    "c3": ("Co-amoxiclav for the chest infection.", "d2")
+}
+
+
+def add_chunks(target, *args):
+    ids = list(CHUNKS)
+    target.add(*args, ids, [CHUNKS[i][0] for i in ids], [{"doc_id": CHUNKS[i][1]} for i in ids])
+
+
+def test_saved_index_loads_without_retokenizing():
+    index = SessionLexicalIndex()
+    add_chunks(index)
+    loaded = SessionLexicalIndex.from_dict(json.loads(json.dumps(index.to_dict())))
+    assert loaded.postings == index.postings
+    assert loaded.lengths == index.lengths
+    assert loaded.search("amoxiclav") == index.search("amoxiclav")
+
+
+def test_index_written_without_postings_still_loads():
+    legacy = {"chunks": [[chunk_id, text, doc_id] for chunk_id, (text, doc_id) in CHUNKS.items()]}
+    loaded = SessionLexicalIndex.from_dict(legacy)
+    assert [hit["id"] for hit in loaded.search("hba1c")] == ["c2"]
+    assert "postings" in loaded.to_dict()
+
+
+def test_workers_see_and_keep_each_others_writes(tmp_path):
+    a, b = LexicalIndexStore(str(tmp_path)), LexicalIndexStore(str(tmp_path))
+    a.add("u", "s", ["c1"], [CHUNKS["c1"][0]], [{"doc_id": "d1"}])
+    assert [hit["id"] for hit in b.search("u", "s", "metformin")] == ["c1"]
+
+    # b has the session open; a's later write must reach it, and b's own write must not undo a's
+    a.add("u", "s", ["c2"], [CHUNKS["c2"][0]], [{"doc_id": "d1"}])
+    assert [hit["id"] for hit in b.search("u", "s", "glucose")] == ["c2"]
+    b.add("u", "s", ["c3"], [CHUNKS["c3"][0]], [{"doc_id": "d2"}])
+    assert len(LexicalIndexStore(str(tmp_path))._load(a._path("u", "s"))) == 3
+
+    a.delete("u", "s", "d1")
+    assert b.search("u", "s", "metformin") == []
+    a.delete("u", "s")
+    assert not b.exists("u", "s")
+
+
+def test_searching_many_sessions_keeps_open_ones_cached(tmp_path):
+    store = LexicalIndexStore(str(tmp_path), cache_size=2)
+    for session_id in ("s1", "s2", "s3", "s4"):
+        add_chunks(store, "u", session_id)
+    add_chunks(store, "other", "hot")
+    hot = store._path("other", "hot")
+    assert hot in store._open
+
+    hits = store.search_sessions("u", ["s1", "s2", "s3", "s4"], "glucose")
+    assert sorted(hit["session_id"] for hit in hits) == ["s1", "s2", "s3", "s4"]
+    assert hot in store._open
@@ -0,0 +1,69 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from src.features.chats import message_writer as writer_module
+from src.features.chats.message_writer import MessageWriter
+from tests.fake_mongo import FakeClient
+
+
+class FlakySessions:
+    """sessions collection whose pushes fail while a message in them has failures left, like Mongo's bulk_write."""
+
+    def __init__(self, collection, failures: dict):
+        self.collection = collection
+        self.failures = failures
+
+    async def bulk_write(self, operations, ordered=True):
+        errors = []
+        for i, operation in enumerate(operations):
+            ids = [message["message_id"] for message in operation._doc["$push"]["messages"]["$each"]]
+            failing = [message_id for message_id in ids if self.failures.get(message_id)]
+            if failing:
+                for message_id in failing:
+                    self.failures[message_id] -= 1
+                errors.append({"index": i, "code": 1, "errmsg": "write failed"})
+                if ordered:
+                    break
+                continue
+            await self.collection.update_one(operation._filter, operation._doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def message(message_id: str) -> dict:
+    return {"message_id": message_id, "question": f"q {message_id}", "answer": f"a {message_id}"}
+
+
+def test_retried_message_keeps_its_place_in_the_session(monkeypatch):
+    monkeypatch.setattr(writer_module, "schedule_memory_update", lambda *args: None)
+
+    async def run():
+        client = FakeClient()["test"]
+        for session_id in ("s1", "s2"):
+            await client["sessions"].insert_one({"session_id": session_id, "user_id": "u", "deleted_at": None, "messages": []})
+        # "a" fails in the first flush and again in the second, after "c" was queued behind it
+        db = {"sessions": FlakySessions(client["sessions"], {"a": 2})}
+
+        writer = MessageWriter(interval_ms=60_000)
+        writer.start(db)
+        try:
+            await writer.save("u", "s1", [message("a")], db)
+            await writer.save("u", "s2", [message("b")], db)
+            await writer.flush()
+            await writer.save("u", "s1", [message("c")], db)
+            await writer.flush()
+            # "c" waits for "a" instead of landing first
+            assert (await client["sessions"].find_one({"session_id": "s1"}))["messages"] == []
+            await writer.flush()
+        finally:
+            await writer.stop()
+
+        assert [m["message_id"] for m in (await client["sessions"].find_one({"session_id": "s1"}))["messages"]] == ["a", "c"]
+        assert [m["message_id"] for m in (await client["sessions"].find_one({"session_id": "s2"}))["messages"]] == ["b"]
+        assert writer.pending_count() == 0
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+import asyncio
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pytest
+import soundfile as sf
+from fastapi import FastAPI, Request
+from starlette.datastructures import UploadFile
+
+from src.features.chats import utils
+from src.features.chats.utils import convert_speech_to_text
+
+SAMPLE_RATE = 16000
+
+
+def fake_deepgram(received: list) -> FastAPI:
+    """Pre-recorded /v1/listen that consumes the upload as it arrives and keeps only its size."""
+    app = FastAPI()
+
+    @app.post("/v1/listen")
+    async def listen(request: Request):
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        received.append(size)
+        return {"results": {"channels": [{"alternatives": [{"transcript": " What do my results mean? "}]}]}}
+
+    return app
+
+
+def recording(seconds: int) -> UploadFile:
+    """A 16 kHz mono WAV on disk, the way Starlette spools a large upload."""
+    spool = tempfile.TemporaryFile()
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    second = (0.2 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+    with sf.SoundFile(spool, "w", samplerate=SAMPLE_RATE, channels=1, format="WAV", subtype="PCM_16") as wav:
+        for _ in range(seconds):
+            wav.write(second)
+    size = spool.tell()
+    spool.seek(0)
+    return UploadFile(spool, size=size, filename="visit.wav")
+
+
+def transcribe_peak_memory(upload: UploadFile) -> int:
+    tracemalloc.start()
+    try:
+        assert asyncio.run(convert_speech_to_text(upload)) == "What do my results mean?"
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture
+def deepgram(serve, monkeypatch):
+    received = []
+    monkeypatch.setattr(utils, "DEEPGRAM_API_URL", f"{serve(fake_deepgram(received))}/v1/listen")
+    return received
+
+
+def test_peak_memory_does_not_grow_with_recording_length(deepgram):
+    # Imports and connection setup on the first call are not part of the measurement
+    transcribe_peak_memory(recording(1))
+
+    short, long = recording(30), recording(30 * 20)
+    short_peak = transcribe_peak_memory(short)
+    long_peak = transcribe_peak_memory(long)
+
+    # Every byte reached Deepgram, in full
+    assert deepgram[1:] == [short.size, long.size]
+    # 20x the audio (18 MB more) costs no more than a few upload chunks
+    assert long.size - short.size > 16 * 1024 * 1024
+    assert long_peak - short_peak < 1024 * 1024
+    assert long_peak < long.size / 8
+
+
+def test_oversized_upload_is_rejected_before_sending(deepgram, monkeypatch):
+    monkeypatch.setattr(utils, "STT_MAX_UPLOAD_BYTES", 1024 * 1024)
+    with pytest.raises(Exception) as error:
+        asyncio.run(convert_speech_to_text(recording(60)))
+    assert getattr(error.value, "status_code", None) == 413
+    assert deepgram == []
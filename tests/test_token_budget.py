@@ -0,0 +1,122 @@
+import pytest
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import WhitespaceSplit
+
+from src.features.chats import token_budget
+from src.features.chats.token_budget import MIN_PARTIAL_TOKENS, assemble_context, count_tokens, truncate_to_tokens
+
+
+def words(count: int, prefix: str = "w") -> str:
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+@pytest.fixture(params=["tokenizer", "characters"])
+def tokenizer(request, monkeypatch):
+    """One token per word with a real (in-memory) tokenizer, or the character estimate when none is loaded."""
+    monkeypatch.setattr(token_budget, "load_tokenizer", lambda: None)
+    if request.param == "tokenizer":
+        model = Tokenizer(WordLevel({"[UNK]": 0}, unk_token="[UNK]"))
+        model.pre_tokenizer = WhitespaceSplit()
+        monkeypatch.setattr(token_budget, "_tokenizer", model)
+    else:
+        monkeypatch.setattr(token_budget, "_tokenizer", None)
+    return request.param
+
+
+def test_truncate_keeps_short_text(tokenizer):
+    text = words(10)
+    assert truncate_to_tokens(text, count_tokens(text)) == text
+
+
+def test_truncate_cuts_to_max_tokens(tokenizer):
+    text = words(500)
+    cut = truncate_to_tokens(text, 100)
+    assert text.startswith(cut)
+    assert count_tokens(cut) <= 100
+    assert count_tokens(cut) >= 95
+
+
+def test_truncate_to_nothing(tokenizer):
+    assert truncate_to_tokens(words(10), 0) == ""
+    assert truncate_to_tokens(words(10), -5) == ""
+
+
+@pytest.mark.parametrize("tokenizer", ["tokenizer"], indirect=True)
+def test_truncate_cuts_on_token_boundary(tokenizer):
+    assert truncate_to_tokens("alpha beta gamma delta", 2) == "alpha beta"
+
+
+def test_everything_fits(tokenizer):
+    context = assemble_context("q1 q2", [words(20, "c")], [words(10, "t")], words(10, "s"), budget=1000)
+    assert context.chunks == [words(20, "c")]
+    assert context.recent_turns == [words(10, "t")]
+    assert context.summary == words(10, "s")
+    assert context.total_tokens <= 1000
+
+
+def test_oversize_query_takes_whole_budget(tokenizer):
+    context = assemble_context(words(2000), [words(20, "c")], [words(10, "t")], words(10, "s"), budget=300, overhead=50)
+    assert count_tokens(context.query) <= 250
+    assert words(2000).startswith(context.query)
+    assert context.chunks == []
+    assert context.recent_turns == []
+    assert context.summary == ""
+    assert context.total_tokens <= 300
+
+
+def test_oversize_chunk_is_cut_when_enough_survives(tokenizer):
+    chunks = [words(100, "a"), words(1000, "b"), words(100, "c")]
+    context = assemble_context("q", chunks, [], "", budget=400)
+    assert context.chunks[0] == chunks[0]
+    assert len(context.chunks) == 2
+    assert chunks[1].startswith(context.chunks[1])
+    assert count_tokens(context.chunks[1]) >= MIN_PARTIAL_TOKENS
+    assert context.total_tokens <= 400
+
+
+def test_chunk_dropped_when_too_little_would_survive(tokenizer):
+    chunks = [words(300, "a"), words(1000, "b")]
+    budget = count_tokens("q") + count_tokens(chunks[0]) + MIN_PARTIAL_TOKENS - 1
+    context = assemble_context("q", chunks, [], "", budget=budget)
+    assert context.chunks == [chunks[0]]
+    assert context.total_tokens <= budget
+
+
+def test_history_keeps_newest_turns_in_order(tokenizer):
+    turns = [words(100, "old"), words(100, "mid"), words(100, "new")]
+    budget = count_tokens("q") + count_tokens(turns[1]) + count_tokens(turns[2]) + 10
+    context = assemble_context("q", [], turns, "", budget=budget)
+    assert context.recent_turns == turns[1:]
+    assert context.total_tokens <= budget
+
+
+def test_oversize_turn_stops_history(tokenizer):
+    turns = [words(10, "old"), words(5000, "huge"), words(10, "new")]
+    context = assemble_context("q", [], turns, "", budget=500)
+    # An older turn is never kept past a newer one that didn't fit
+    assert context.recent_turns == [turns[2]]
+
+
+def test_oversize_summary_is_cut(tokenizer):
+    summary = words(3000, "s")
+    context = assemble_context("q", [words(50, "c")], [], summary, budget=500)
+    assert summary.startswith(context.summary)
+    assert MIN_PARTIAL_TOKENS <= count_tokens(context.summary) <= 500
+    assert context.total_tokens <= 500
+
+
+def test_summary_dropped_when_too_little_would_survive(tokenizer):
+    chunk = words(400, "c")
+    budget = count_tokens("q") + count_tokens(chunk) + MIN_PARTIAL_TOKENS - 1
+    context = assemble_context("q", [chunk], [], words(3000, "s"), budget=budget)
+    assert context.summary == ""
+    assert context.token_counts["older_history"] == 0
+
+
+def test_token_counts_add_up(tokenizer):
+    context = assemble_context("q1 q2 q3", [words(30, "c")], [words(20, "t")], words(20, "s"), budget=1000, overhead=40)
+    assert context.token_counts["overhead"] == 40
+    assert context.token_counts["query"] == count_tokens("q1 q2 q3")
+    assert context.token_counts["chunks"] == count_tokens(words(30, "c"))
+    assert context.total_tokens == sum(context.token_counts.values())
@@ -0,0 +1,136 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from src.features.chats import chatRoutes, utils, voice_stream
+from src.utils.auth_utils import create_access_token
+from tests.fake_mongo import FakeClient
+
+QUESTION = "What does my HbA1c mean?"
+SENTENCES = [
+    "Your HbA1c of 6.1 percent is above normal.",
+    "It points to prediabetes rather than diabetes.",
+    "Repeat the test in three months."
+]
+# Earlier sentences take longer to synthesize, so their audio is ready last
+SPEAK_DELAYS = {SENTENCES[0]: 0.3, SENTENCES[1]: 0.15, SENTENCES[2]: 0.0}
+
+
+def fake_upstream(calls: dict) -> FastAPI:
+    """Streaming Deepgram (/v1/listen over a WebSocket) and the /speak TTS server with its /static files."""
+    app = FastAPI()
+
+    @app.websocket("/v1/listen")
+    async def listen(websocket: WebSocket):
+        calls["stt_query"] = dict(websocket.query_params)
+        calls["stt_auth"] = websocket.headers.get("authorization")
+        await websocket.accept()
+        frames = 0
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                frames += 1
+                if frames == 1:
+                    await websocket.send_text(json.dumps({
+                        "type": "Results", "is_final": False,
+                        "channel": {"alternatives": [{"transcript": "What does my"}]}
+                    }))
+                elif frames == 2:
+                    await websocket.send_text(json.dumps({
+                        "type": "Results", "is_final": True, "speech_final": True,
+                        "channel": {"alternatives": [{"transcript": QUESTION}]}
+                    }))
+            elif json.loads(message["text"]).get("type") == "CloseStream":
+                await websocket.close()
+                return
+
+    @app.post("/speak")
+    async def speak(request: Request):
+        text = (await request.json())["text"]
+        await asyncio.sleep(SPEAK_DELAYS.get(text, 0))
+        calls.setdefault("spoken", []).append(text)
+        return {"file": f"{SENTENCES.index(text)}.wav"}
+
+    @app.get("/static/{filename}")
+    async def static_audio(filename: str):
+        return Response(b"RIFF" + filename.encode(), media_type="audio/wav")
+
+    return app
+
+
+@pytest.fixture
+def voice_app(serve, monkeypatch):
+    calls = {"questions": []}
+    upstream = serve(fake_upstream(calls))
+    monkeypatch.setattr(voice_stream, "DEEPGRAM_STREAM_URL", upstream.replace("http://", "ws://") + "/v1/listen")
+    monkeypatch.setattr(utils, "SPEAK_API_URL", f"{upstream}/speak")
+
+    async def handle_user_query(user_id, session_id, question, db):
+        calls["questions"].append((user_id, session_id, question))
+        for word in " ".join(SENTENCES).split(" "):
+            yield word + " "
+
+    monkeypatch.setattr(voice_stream, "handle_user_query", handle_user_query)
+
+    db = FakeClient()["test"]
+    asyncio.run(db["sessions"].insert_one({"session_id": "s1", "user_id": "patient@example.com", "deleted_at": None}))
+    monkeypatch.setattr(chatRoutes, "get_database", lambda: db)
+
+    app = FastAPI()
+    app.include_router(chatRoutes.router)
+    with TestClient(app) as client:
+        yield client, calls
+
+
+def test_voice_stream_round_trip(voice_app):
+    client, calls = voice_app
+    token = create_access_token({"user_id": "patient@example.com"})
+
+    events = []
+    with client.websocket_connect(f"/chat/voice-stream/s1?token={token}") as websocket:
+        websocket.send_bytes(b"\x00" * 3200)
+        websocket.send_bytes(b"\x00" * 3200)
+        websocket.send_text(json.dumps({"type": "stop"}))
+        while not events or events[-1]["type"] not in ("done", "error"):
+            events.append(websocket.receive_json())
+
+    assert events[-1]["type"] == "done"
+    assert calls["stt_query"]["interim_results"] == "true"
+    assert calls["stt_auth"] == "Token test"
+
+    # Live transcripts, interim first, then the question that was answered
+    transcripts = [(event["text"], event["is_final"]) for event in events if event["type"] == "transcript"]
+    assert transcripts == [("What does my", False), (QUESTION, True)]
+    assert calls["questions"] == [("patient@example.com", "s1", QUESTION)]
+
+    # Every answer token, in order, between answer_start and answer_end
+    types = [event["type"] for event in events]
+    start, end = types.index("answer_start"), types.index("answer_end")
+    tokens = [event["text"] for event in events if event["type"] == "token"]
+    assert all(start < i < end for i, event in enumerate(events) if event["type"] == "token")
+    assert "".join(tokens).strip() == " ".join(SENTENCES)
+    assert events[end]["answer"] == " ".join(SENTENCES)
+
+    # One audio event per sentence, in sentence order although later ones were synthesized first
+    audio = [event for event in events if event["type"] == "audio"]
+    assert [event["index"] for event in audio] == [0, 1, 2]
+    assert [event["text"] for event in audio] == SENTENCES
+    # Absolute, on the host the client called
+    assert all(event["url"] == f"http://testserver/chat/tts-audio/{event['file']}" for event in audio)
+    assert calls["spoken"] == SENTENCES[::-1]
+
+
+def test_voice_stream_rejects_unknown_session(voice_app):
+    client, calls = voice_app
+    token = create_access_token({"user_id": "patient@example.com"})
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/chat/voice-stream/other?token={token}") as websocket:
+            websocket.receive_json()
+    assert "stt_query" not in calls